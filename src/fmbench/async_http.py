@@ -0,0 +1,43 @@
+"""
+aiohttp session shared by the requests a predictor sends from the event loop.
+
+An aiohttp session is bound to the event loop it was created in, the notebooks and the
+in-process runner may use a different loop for every step, so the session is created
+lazily in the running loop and recreated if the loop changes.
+"""
+import asyncio
+import aiohttp
+import logging
+from typing import Optional
+from fmbench.aws_clients import pool_size
+
+logger = logging.getLogger(__name__)
+
+# the read timeout is generous since generating long completions can take minutes
+DEFAULT_TIMEOUT_SECONDS: float = 600
+
+
+class LoopBoundSession:
+    """Lazily created aiohttp session with a connection pool sized for the benchmark concurrency."""
+
+    def __init__(self, limit: Optional[int] = None, timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS):
+        self._limit: Optional[int] = limit
+        self._timeout_seconds: float = timeout_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def get(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            limit = self._limit if self._limit is not None else pool_size()
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit),
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout_seconds))
+            self._loop = loop
+            logger.info(f"get, created aiohttp session with connection limit={limit}")
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
@@ -0,0 +1,160 @@
+"""
+Registry of shared boto3 clients.
+
+boto3 clients are thread safe, so a single client per service (and region) is created and
+reused by every thread instead of creating a new client for every S3 call or predictor. The
+HTTP connection pool and the retry settings of these clients are sized from the largest
+concurrency level configured for the benchmark: with the botocore default of 10 pooled
+connections any request above the pool size opens (and then discards) a new connection, so
+the measured latency includes a TCP and TLS handshake. Pool saturation reported by urllib3 is
+counted and logged so that it shows up in the benchmark logs.
+"""
+import boto3
+import logging
+import threading
+from botocore.auth import SigV4Auth
+from botocore.config import Config
+from botocore.awsrequest import AWSRequest
+from typing import Dict, List, Optional, Tuple
+from fmbench.load_generator import max_in_flight
+
+logger = logging.getLogger(__name__)
+
+# botocore defaults to 10 pooled connections per client
+DEFAULT_MAX_POOL_CONNECTIONS: int = 10
+# a few extra connections for the calls made besides the inference requests (e.g. S3 writes)
+POOL_CONNECTIONS_HEADROOM: int = 4
+DEFAULT_MAX_RETRY_ATTEMPTS: int = 3
+MAX_RETRY_ATTEMPTS: int = 10
+# log a saturation warning for the first occurrence and then every so many occurrences
+POOL_SATURATION_LOG_EVERY: int = 100
+
+_clients: Dict[Tuple, object] = {}
+_clients_lock = threading.Lock()
+_max_concurrency: int = 0
+# session whose (refreshable) credentials are used for signing requests sent outside of boto3
+_signing_session: Optional[boto3.session.Session] = None
+
+
+def max_retry_attempts() -> int:
+    """Retries of a throttled or failed request, in addition to the first attempt."""
+    # more concurrent requests are more likely to be throttled, allow more retries for them
+    return min(MAX_RETRY_ATTEMPTS, DEFAULT_MAX_RETRY_ATTEMPTS + _max_concurrency // 25)
+
+
+def _client_config(max_pool_connections: int) -> Config:
+    return Config(max_pool_connections=max_pool_connections,
+                  retries=dict(max_attempts=max_retry_attempts(), mode='standard'))
+
+
+def pool_size() -> int:
+    return max(DEFAULT_MAX_POOL_CONNECTIONS, _max_concurrency + POOL_CONNECTIONS_HEADROOM)
+
+
+def max_concurrency_in_config(config: Dict, parallel_experiments: int = 1) -> int:
+    """
+    The largest number of requests in flight across all the experiments in the config, when experiments
+    run in parallel the sum of the largest numbers of that many experiments. This is the concurrency level,
+    or for the open-loop load generator (where the levels are arrival rates) its `max_in_flight`.
+    """
+    # imported here, the search module depends on the inference helpers that depend on this module
+    from fmbench.concurrency_search import DEFAULT_SEARCH_SPEC
+    levels: List[int] = []
+    for e in config.get('experiments', []):
+        if e.get('concurrency_search') is not None:
+            concurrency_levels = [(DEFAULT_SEARCH_SPEC | e['concurrency_search'])['max_concurrency']]
+        else:
+            concurrency_levels = e.get('concurrency_levels', [1])
+        levels.append(max(max_in_flight(e.get('load_generator'), c) for c in concurrency_levels))
+    return max(1, sum(sorted(levels, reverse=True)[:parallel_experiments]))
+
+
+def configure_clients(max_concurrency: int) -> None:
+    """Sizes the connection pools for the given concurrency, clients created before this are recreated on next use."""
+    global _max_concurrency
+    with _clients_lock:
+        if max_concurrency == _max_concurrency:
+            return
+        _max_concurrency = max_concurrency
+        _clients.clear()
+    logger.info(f"configure_clients, max_concurrency={max_concurrency}, max_pool_connections={pool_size()}")
+
+
+def get_client(service_name: str, region_name: Optional[str] = None, max_pool_connections: Optional[int] = None):
+    """
+    Returns the shared client for the service, max_pool_connections overrides the pool size
+    for callers that run their own pool of workers (e.g. bulk S3 reads).
+    """
+    max_pool_connections = max_pool_connections if max_pool_connections is not None else pool_size()
+    key = (service_name, region_name, max_pool_connections)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                # creating clients from the default session is not thread safe, hence the lock
+                client = boto3.client(service_name, region_name=region_name,
+                                      config=_client_config(max_pool_connections))
+                _clients[key] = client
+                logger.info(f"get_client, created client for service={service_name}, region={region_name}, "
+                            f"max_pool_connections={max_pool_connections}")
+    return client
+
+
+def sign_request(service_name: str,
+                 region_name: str,
+                 method: str,
+                 url: str,
+                 body: bytes,
+                 headers: Dict[str, str]) -> Dict[str, str]:
+    """
+    Returns the headers of a SigV4 signed request, for callers that send requests to AWS
+    APIs with a non-boto3 HTTP client (e.g. aiohttp). Credentials are refreshed as needed.
+    """
+    global _signing_session
+    if _signing_session is None:
+        with _clients_lock:
+            if _signing_session is None:
+                _signing_session = boto3.session.Session()
+    credentials = _signing_session.get_credentials().get_frozen_credentials()
+    request = AWSRequest(method=method, url=url, data=body, headers=headers)
+    SigV4Auth(credentials, service_name, region_name).add_auth(request)
+    return dict(request.headers.items())
+
+
+def get_sagemaker_session(region_name: Optional[str] = None):
+    """A sagemaker Session that uses the shared (pool sized) sagemaker and sagemaker-runtime clients."""
+    import sagemaker
+    boto_session = boto3.session.Session(region_name=region_name)
+    return sagemaker.Session(boto_session=boto_session,
+                             sagemaker_client=get_client('sagemaker', region_name),
+                             sagemaker_runtime_client=get_client('sagemaker-runtime', region_name))
+
+
+class _PoolSaturationHandler(logging.Handler):
+    """Counts the 'connection pool is full' warnings that urllib3 logs when a pool is too small."""
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.count: int = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not record.getMessage().startswith("Connection pool is full"):
+            return
+        with self._lock:
+            self.count += 1
+            count = self.count
+        if count == 1 or count % POOL_SATURATION_LOG_EVERY == 0:
+            logger.warning(f"connection pool saturated {count} times, max_pool_connections={pool_size()}, "
+                           f"requests above the pool size open new connections and their latency includes "
+                           f"the connection setup, message={record.getMessage()}")
+
+
+_saturation_handler = _PoolSaturationHandler()
+logging.getLogger("urllib3.connectionpool").addHandler(_saturation_handler)
+
+
+def pool_saturation_count() -> int:
+    """Number of times a request found its connection pool full since the process started."""
+    return _saturation_handler.count
@@ -0,0 +1,159 @@
+"""
+Adaptive search for the highest concurrency level that stays within the latency budget.
+
+Instead of sweeping a fixed list of `concurrency_levels`, an experiment can search for the
+knee of the latency curve with an optional `concurrency_search` section in the config file:
+
+    concurrency_search:
+      min_concurrency: 1
+      max_concurrency: 128
+      growth_factor: 2            # concurrency is multiplied by this while within the budget
+      chunks_per_step: 2          # chunks of requests sent at every concurrency level probed
+      resolution: 1               # bisection stops when the bounds are this close
+      max_error_rate: 0.0
+      latency_budget: 20          # seconds, defaults to latency_budget in the report section
+      latency_budget_percentile: 90  # defaults to latency_budget_percentile in the report section, mean if not set
+
+The concurrency is ramped up geometrically from min_concurrency until a level exceeds the
+latency budget or the maximum error rate, and then bisected between the last level within the
+budget and the first one outside of it. Every probed level is sent through run_inferences so the
+search trace is recorded in the usual per chunk and per inference metrics. Every probed level is a step
+of the trace, a search that was interrupted continues after the steps it completed (see ConcurrencySearch.restore).
+"""
+import math
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from fmbench.inference import run_inferences, should_warm_up
+from fmbench.histogram import merge_histograms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_SPEC: Dict = dict(min_concurrency=1,
+                                 max_concurrency=128,
+                                 growth_factor=2,
+                                 chunks_per_step=2,
+                                 resolution=1,
+                                 max_error_rate=0.0)
+
+
+def latency_statistic(metrics: List[Dict], percentile: Optional[float]) -> Optional[float]:
+    """Mean latency (or a latency percentile) over the chunks of a step, None if every request failed."""
+    if percentile is not None:
+        merged = merge_histograms([m.get('latency_histogram') for m in metrics])
+        return merged.percentile(percentile) if merged is not None else None
+    successes = sum(m['successes'] for m in metrics)
+    if successes == 0:
+        return None
+    return sum(m['latency_mean'] * m['successes'] for m in metrics if m['latency_mean'] is not None) / successes
+
+
+class ConcurrencySearch:
+    """Geometric ramp followed by a bisection over the concurrency level."""
+
+    def __init__(self, search_spec: Dict, latency_budget: float, latency_budget_percentile: Optional[float] = None):
+        self.spec: Dict = DEFAULT_SEARCH_SPEC | search_spec
+        self.latency_budget: float = self.spec.get('latency_budget', latency_budget)
+        self.latency_budget_percentile: Optional[float] = self.spec.get('latency_budget_percentile', latency_budget_percentile)
+        self.trace: List[Dict] = []
+        self.stop_reason: Optional[str] = None
+        # highest concurrency within the budget and lowest one outside of it found so far
+        self._lo: Optional[Dict] = None
+        self._hi: Optional[Dict] = None
+
+    @property
+    def latency_statistic_name(self) -> str:
+        return f"p{self.latency_budget_percentile:g}" if self.latency_budget_percentile is not None else "mean"
+
+    def next_concurrency(self) -> Optional[int]:
+        """Concurrency level to probe next, None once the search is done."""
+        if self.stop_reason is not None:
+            return None
+        if self._lo is None:
+            if self._hi is not None:
+                self.stop_reason = "min_concurrency exceeds the latency budget or the error rate"
+                return None
+            return self.spec['min_concurrency']
+        if self._hi is None:
+            if self._lo['concurrency'] >= self.spec['max_concurrency']:
+                self.stop_reason = "max_concurrency reached"
+                return None
+            return min(self.spec['max_concurrency'],
+                       max(self._lo['concurrency'] + 1, math.ceil(self._lo['concurrency'] * self.spec['growth_factor'])))
+        if self._hi['concurrency'] - self._lo['concurrency'] <= self.spec['resolution']:
+            self.stop_reason = "bisection converged"
+            return None
+        return (self._lo['concurrency'] + self._hi['concurrency']) // 2
+
+    def record(self, concurrency: int, metrics: List[Dict]) -> Dict:
+        """Records the per chunk metrics of a probed concurrency level and returns the step of the trace."""
+        transactions = sum(m['transactions'] for m in metrics)
+        error_rate = sum(len(m['errors']) for m in metrics) / transactions if transactions else 1.0
+        latency = latency_statistic(metrics, self.latency_budget_percentile)
+        within_budget = (latency is not None and latency <= self.latency_budget
+                         and error_rate <= self.spec['max_error_rate'])
+        step = dict(concurrency=concurrency,
+                    latency=latency,
+                    error_rate=error_rate,
+                    transactions_per_minute=int(sum(m['transactions_per_minute'] for m in metrics) / len(metrics)) if metrics else 0,
+                    within_budget=within_budget)
+        self.restore(step)
+        logger.info(f"record, concurrency={concurrency}, {self.latency_statistic_name} latency={latency}, "
+                    f"error_rate={error_rate}, within_budget={within_budget}")
+        return step
+
+    def restore(self, step: Dict) -> None:
+        """Adds a step returned by record, e.g. a step completed before the run was resumed."""
+        self.trace.append(step)
+        if step['within_budget']:
+            self._lo = step
+        else:
+            self._hi = step
+
+    async def run(self,
+                  predictor,
+                  payload_list: List[Dict],
+                  experiment: Dict,
+                  payload_file: str,
+                  warmed_up_levels: Optional[Set] = None,
+                  on_step: Optional[Callable[[Dict], None]] = None) -> AsyncIterator[Tuple[List, Dict]]:
+        """
+        Probes concurrency levels until the search is done, yields the same (responses, metrics) as run_inferences.
+        The concurrency levels that have been warmed up are added to warmed_up_levels, on_step is called with
+        every step once the responses of all of its chunks have been yielded.
+        """
+        warmed_up_levels = warmed_up_levels if warmed_up_levels is not None else set()
+        # continue after the payloads sent by the restored steps
+        offset: int = sum(s['concurrency'] for s in self.trace) * self.spec['chunks_per_step'] % len(payload_list)
+        while (concurrency := self.next_concurrency()) is not None:
+            # cycle through the payloads so that every step sees different prompts
+            n = concurrency * self.spec['chunks_per_step']
+            payloads = [payload_list[(offset + i) % len(payload_list)] for i in range(n)]
+            offset = (offset + n) % len(payload_list)
+            split_payload = [payloads[i:i + concurrency] for i in range(0, n, concurrency)]
+            step_metrics: List[Dict] = []
+            warmup = should_warm_up(experiment, concurrency, warmed_up_levels)
+            async for responses, metrics in run_inferences(predictor, split_payload, experiment, concurrency, payload_file, warmup):
+                # the responses of the warm-up requests come without metrics
+                if metrics:
+                    step_metrics.append(metrics)
+                yield responses, metrics
+            if warmup:
+                warmed_up_levels.add(concurrency)
+            step = self.record(concurrency, step_metrics)
+            if on_step is not None:
+                on_step(step)
+        logger.info(f"run, experiment={experiment['name']}, payload_file={payload_file}, done after "
+                    f"{len(self.trace)} steps, stop_reason={self.stop_reason}, result={self.result()}")
+
+    def result(self) -> Dict:
+        """Highest sustainable concurrency and its transactions per minute, None values if none was found."""
+        best = self._lo
+        return dict(max_sustainable_concurrency=best['concurrency'] if best is not None else None,
+                    transactions_per_minute=best['transactions_per_minute'] if best is not None else None,
+                    latency=best['latency'] if best is not None else None,
+                    latency_statistic=self.latency_statistic_name,
+                    latency_budget=self.latency_budget,
+                    error_rate=best['error_rate'] if best is not None else None,
+                    steps=len(self.trace),
+                    probed_concurrency_levels=[s['concurrency'] for s in self.trace],
+                    stop_reason=self.stop_reason)
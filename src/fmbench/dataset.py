@@ -0,0 +1,396 @@
+"""
+Streaming creation of the prompts and payload files from the source datasets.
+
+The source JSON lines files are read line by line, the prompts are created and tokenized in
+batches, and every prompt is routed in a single pass to each of the `datasets.filters` buckets
+it matches. The buckets are found with a binary search over the sorted filter boundaries, so
+the cost per prompt does not grow with the number of filters. The payload files and the
+all prompts file are streamed to S3 as they are produced, so memory stays bounded
+irrespective of the size of the source datasets.
+
+A filter can cap the size of its payload file with a deterministic, length stratified sample:
+
+    - language: en
+      min_length_in_tokens: 1
+      max_length_in_tokens: 500
+      payload_file: payload_en_1-500.jsonl
+      max_prompts: 200      # at most this many prompts in the payload file
+      seed: 42              # default 0
+      strata: 10            # equal width prompt length strata, default 10
+
+Every prompt gets a priority from a hash of its id and the seed, each stratum keeps the
+max_prompts prompts with the lowest priority (a bottom-k reservoir, so memory is bounded on
+streamed input) and the sample is allocated across the strata in proportion to their sizes.
+The sample depends only on the source data and the seed, not on the order in which the
+prompts are read, so repeated runs send exactly the same requests.
+
+The prompts can also be written to a columnar prompt store (see fmbench.prompt_store), in which
+case the payload files can reference the prompts by id instead of carrying a copy of them.
+
+update_payload_files only creates the artifacts whose inputs changed since the last run, as
+recorded in the manifest (see fmbench.manifest), and reuses the others.
+"""
+import io
+import math
+import csv
+import copy
+import json
+import bisect
+import hashlib
+import heapq
+import logging
+import posixpath
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from fmbench.globals import TRUNCATE_POLICY, PROMPT_TOKENS_PAYLOAD_KEY, PROMPT_ID_PAYLOAD_KEY
+from fmbench.prompt_store import PromptStoreWriter
+from fmbench.manifest import Manifest, content_hash, source_file_etags
+from fmbench.utils import iter_s3_lines, process_items, S3StreamWriter, write_to_s3
+
+logger = logging.getLogger(__name__)
+
+# number of source records that are tokenized together
+DEFAULT_BATCH_SIZE: int = 512
+DEFAULT_SAMPLING_SEED: int = 0
+DEFAULT_SAMPLING_STRATA: int = 10
+SAMPLING_STATS_FILE_SUFFIX: str = ".sampling_stats.json"
+
+
+def iter_source_records(bucket: str, keys: List[str]) -> Iterator[Tuple[str, str, Dict]]:
+    """Yields (id, source_file, record) for every line of the source JSON lines files, the id is stable across runs."""
+    for key in keys:
+        source_file = posixpath.basename(key)
+        logger.info(f"iter_source_records, reading s3://{bucket}/{key}")
+        for line_number, line in enumerate(iter_s3_lines(bucket, key)):
+            yield f"{source_file}:{line_number}", source_file, json.loads(line)
+
+
+def create_prompt_records(records: Iterable[Tuple[str, str, Dict]],
+                          prompt_template_keys: List[str],
+                          prompt_fmt: str,
+                          batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Dict]:
+    """Creates the prompt for every source record, the prompts and the template values are tokenized in batches."""
+    batch: List[Tuple[str, str, Dict]] = []
+
+    def _process(batch: List[Tuple[str, str, Dict]]) -> Iterator[Dict]:
+        items = pd.DataFrame([{k: r[k] for k in prompt_template_keys} for _, _, r in batch])
+        for (record_id, source_file, record), prompt in zip(batch, process_items(items, prompt_template_keys, prompt_fmt)):
+            yield dict(id=record_id,
+                       source_file=source_file,
+                       language=record.get('language'),
+                       prompt=prompt['prompt'],
+                       prompt_len=prompt['prompt_len'],
+                       **{f"{k}_len": prompt[f"{k}_len"] for k in prompt_template_keys})
+
+    for r in records:
+        batch.append(r)
+        if len(batch) == batch_size:
+            yield from _process(batch)
+            batch = []
+    if batch:
+        yield from _process(batch)
+
+
+class FilterIndex:
+    """Finds the filters whose [min_length_in_tokens, max_length_in_tokens] range contains a prompt length."""
+
+    def __init__(self, filters: List[Dict]):
+        self.filters: List[Dict] = filters
+        # the filters that contain each boundary and each open interval between consecutive boundaries
+        self._boundaries: List[int] = sorted({f[k] for f in filters for k in ('min_length_in_tokens', 'max_length_in_tokens')})
+        contains = lambda lo, hi: [i for i, f in enumerate(filters) if f['min_length_in_tokens'] <= lo and hi <= f['max_length_in_tokens']]
+        self._at_boundary: List[List[int]] = [contains(b, b) for b in self._boundaries]
+        self._between: List[List[int]] = [contains(lo, hi) for lo, hi in zip(self._boundaries, self._boundaries[1:])]
+
+    def lookup(self, prompt_len: int, language: Optional[str] = None) -> List[int]:
+        """Indices of the matching filters, the language is only checked for prompts that have one."""
+        i = bisect.bisect_right(self._boundaries, prompt_len) - 1
+        if i < 0:
+            return []
+        if self._boundaries[i] == prompt_len:
+            matches = self._at_boundary[i]
+        elif i < len(self._between):
+            matches = self._between[i]
+        else:
+            return []
+        if language is None:
+            return matches
+        return [m for m in matches if self.filters[m].get('language') == language]
+
+
+def sampling_priority(prompt_id: str, seed: int) -> int:
+    """Deterministic pseudo random priority of a prompt, unlike hash() it is the same in every process."""
+    return int.from_bytes(hashlib.blake2b(f"{seed}:{prompt_id}".encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class StratifiedReservoir:
+    """Deterministic length stratified sample of at most max_prompts items from a stream."""
+
+    def __init__(self, min_length: int, max_length: int, max_prompts: int,
+                 seed: int = DEFAULT_SAMPLING_SEED, strata: int = DEFAULT_SAMPLING_STRATA):
+        self.min_length: int = min_length
+        self.max_length: int = max_length
+        self.max_prompts: int = max_prompts
+        self.seed: int = seed
+        self.strata: int = max(1, min(strata, max_length - min_length + 1))
+        self.counts: List[int] = [0] * self.strata
+        self._prompt_len_sum: int = 0
+        # one max heap per stratum (priorities negated) holding the max_prompts lowest priorities
+        self._heaps: List[List[Tuple]] = [[] for _ in range(self.strata)]
+        self._seq: int = 0
+
+    def stratum(self, prompt_len: int) -> int:
+        width = (self.max_length - self.min_length + 1) / self.strata
+        return min(self.strata - 1, max(0, int((prompt_len - self.min_length) / width)))
+
+    def stratum_bounds(self, i: int) -> Tuple[int, int]:
+        width = (self.max_length - self.min_length + 1) / self.strata
+        lo = self.min_length + math.ceil(i * width)
+        hi = self.min_length + math.ceil((i + 1) * width) - 1 if i < self.strata - 1 else self.max_length
+        return lo, hi
+
+    def add(self, prompt_id: str, prompt_len: int, item) -> None:
+        i = self.stratum(prompt_len)
+        self.counts[i] += 1
+        self._prompt_len_sum += prompt_len
+        # the sequence number keeps the order of the source data in the sample
+        entry = (-sampling_priority(prompt_id, self.seed), self._seq, prompt_len, item)
+        self._seq += 1
+        if len(self._heaps[i]) < self.max_prompts:
+            heapq.heappush(self._heaps[i], entry)
+        elif entry[0] > self._heaps[i][0][0]:
+            heapq.heapreplace(self._heaps[i], entry)
+
+    def allocation(self) -> List[int]:
+        """Sample size of every stratum, proportional to the stratum sizes (largest remainder method)."""
+        total = sum(self.counts)
+        if total <= self.max_prompts:
+            return list(self.counts)
+        quotas = [self.max_prompts * c / total for c in self.counts]
+        allocation = [math.floor(q) for q in quotas]
+        remainders = sorted(range(self.strata), key=lambda i: (allocation[i] - quotas[i], i))
+        for i in remainders[:self.max_prompts - sum(allocation)]:
+            allocation[i] += 1
+        return allocation
+
+    def sample(self) -> List[Tuple[int, object]]:
+        """(prompt_len, item) of the sampled items in the order in which they were added."""
+        selected: List[Tuple] = []
+        for heap, n in zip(self._heaps, self.allocation()):
+            # the n lowest priorities of the stratum
+            selected.extend(sorted(heap, key=lambda e: -e[0])[:n])
+        return [(prompt_len, item) for _, _, prompt_len, item in sorted(selected, key=lambda e: e[1])]
+
+    def stats(self, sample: List[Tuple[int, object]]) -> Dict:
+        sample_lengths = [prompt_len for prompt_len, _ in sample]
+        sampled_per_stratum = [0] * self.strata
+        for prompt_len in sample_lengths:
+            sampled_per_stratum[self.stratum(prompt_len)] += 1
+        return dict(max_prompts=self.max_prompts,
+                    seed=self.seed,
+                    matched_prompts=sum(self.counts),
+                    sampled_prompts=len(sample),
+                    matched_prompt_len_mean=round(self._prompt_len_sum / sum(self.counts), 2) if sum(self.counts) else None,
+                    sampled_prompt_len_mean=round(sum(sample_lengths) / len(sample), 2) if sample else None,
+                    strata=[dict(min_length_in_tokens=lo, max_length_in_tokens=hi, matched=c, sampled=n)
+                            for (lo, hi), c, n in zip(map(self.stratum_bounds, range(self.strata)),
+                                                      self.counts, sampled_per_stratum)])
+
+
+def payload_file_name(dataset_info: Dict) -> str:
+    return dataset_info['payload_file'].format(lang=dataset_info['language'],
+                                               min=dataset_info['min_length_in_tokens'],
+                                               max=dataset_info['max_length_in_tokens'])
+
+
+def construct_request_payload(prompt_record: Dict, inference_parameters: Dict, reference_prompt: bool = False) -> Dict:
+    """
+    Request payload for a prompt, the prompt token count is carried along so that prompts are not tokenized again.
+    With reference_prompt the payload carries the id of the prompt in the prompt store instead of the prompt text.
+    """
+    parameters = copy.deepcopy(inference_parameters)
+    if parameters.get('truncate', None) == TRUNCATE_POLICY.AT_PROMPT_TOKEN_LENGTH:
+        parameters['truncate'] = prompt_record['prompt_len']
+    prompt = {PROMPT_ID_PAYLOAD_KEY: prompt_record['id']} if reference_prompt else {'inputs': prompt_record['prompt']}
+    return prompt | {PROMPT_TOKENS_PAYLOAD_KEY: int(prompt_record['prompt_len']),
+                     'parameters': parameters}
+
+
+class _AllPromptsWriter:
+    """Streams the prompt records to a CSV file with one typed column per field."""
+
+    def __init__(self, bucket: str, key: str):
+        self._writer = S3StreamWriter(bucket, key)
+        self._fieldnames: Optional[List[str]] = None
+
+    def write(self, prompt_record: Dict) -> None:
+        buffer = io.StringIO()
+        csv_writer = csv.DictWriter(buffer, fieldnames=self._fieldnames or list(prompt_record.keys()),
+                                    lineterminator="\n")
+        if self._fieldnames is None:
+            self._fieldnames = list(prompt_record.keys())
+            csv_writer.writeheader()
+        csv_writer.writerow(prompt_record)
+        self._writer.write(buffer.getvalue())
+
+    def close(self) -> str:
+        return self._writer.close()
+
+    def abort(self) -> None:
+        self._writer.abort()
+
+
+def _update_payload_file_stats(s: Dict, prompt_len: int) -> None:
+    s['prompts'] += 1
+    s['prompt_len_sum'] += prompt_len
+    s['prompt_len_min'] = prompt_len if s['prompt_len_min'] is None else min(s['prompt_len_min'], prompt_len)
+    s['prompt_len_max'] = prompt_len if s['prompt_len_max'] is None else max(s['prompt_len_max'], prompt_len)
+
+
+def create_payload_files(prompt_records: Iterable[Dict],
+                         filters: List[Dict],
+                         inference_parameters: Dict,
+                         bucket: str,
+                         prefix: str,
+                         all_prompts_file: Optional[str] = None,
+                         prompt_store_file: Optional[str] = None,
+                         reference_prompts: bool = False) -> List[Dict]:
+    """
+    Routes every prompt to the payload files of all the filters it matches in a single pass and streams
+    the payload files (and optionally all the prompts) to S3. Filters with max_prompts keep a stratified
+    sample that is written, along with its sampling statistics, once all the prompts have been read.
+    With reference_prompts the payloads reference the prompts in the prompt store by id, the caller makes
+    sure that the prompt store is written (or is up to date).
+    Returns the statistics of every payload file, the path is None for a filter that no prompt matched.
+    """
+    index = FilterIndex(filters)
+    writers: Dict[int, S3StreamWriter] = {}
+    reservoirs: Dict[int, StratifiedReservoir] = {i: StratifiedReservoir(f['min_length_in_tokens'],
+                                                                         f['max_length_in_tokens'],
+                                                                         f['max_prompts'],
+                                                                         f.get('seed', DEFAULT_SAMPLING_SEED),
+                                                                         f.get('strata', DEFAULT_SAMPLING_STRATA))
+                                                  for i, f in enumerate(filters) if f.get('max_prompts') is not None}
+    stats: List[Dict] = [dict(payload_file=payload_file_name(f), path=None, prompts=0,
+                              prompt_len_min=None, prompt_len_max=None, prompt_len_sum=0) for f in filters]
+    all_prompts_writer = _AllPromptsWriter(bucket, posixpath.join(prefix, all_prompts_file)) if all_prompts_file is not None else None
+    prompt_store_writer = PromptStoreWriter(bucket, posixpath.join(prefix, prompt_store_file)) if prompt_store_file is not None else None
+    num_prompts: int = 0
+
+    def _write(i: int, prompt_len: int, payload: str) -> None:
+        if i not in writers:
+            writers[i] = S3StreamWriter(bucket, posixpath.join(prefix, stats[i]['payload_file']))
+        writers[i].write(payload)
+        _update_payload_file_stats(stats[i], prompt_len)
+
+    try:
+        for prompt_record in prompt_records:
+            num_prompts += 1
+            if all_prompts_writer is not None:
+                all_prompts_writer.write(prompt_record)
+            if prompt_store_writer is not None:
+                prompt_store_writer.write(prompt_record)
+            prompt_len = prompt_record['prompt_len']
+            for i in index.lookup(prompt_len, prompt_record.get('language')):
+                payload = json.dumps(construct_request_payload(prompt_record, inference_parameters, reference_prompts)) + "\n"
+                if i in reservoirs:
+                    reservoirs[i].add(prompt_record['id'], prompt_len, payload)
+                else:
+                    _write(i, prompt_len, payload)
+        for i, reservoir in reservoirs.items():
+            sample = reservoir.sample()
+            for prompt_len, payload in sample:
+                _write(i, prompt_len, payload)
+            if sample:
+                sampling_stats = reservoir.stats(sample)
+                stats[i]['matched_prompts'] = sampling_stats['matched_prompts']
+                sampling_stats_file = posixpath.splitext(stats[i]['payload_file'])[0] + SAMPLING_STATS_FILE_SUFFIX
+                write_to_s3(json.dumps(sampling_stats, indent=2), bucket, prefix, "", sampling_stats_file)
+                logger.info(f"create_payload_files, payload_file={stats[i]['payload_file']}, sampled "
+                            f"{sampling_stats['sampled_prompts']} of {sampling_stats['matched_prompts']} prompts")
+    except Exception:
+        for writer in writers.values():
+            writer.abort()
+        if all_prompts_writer is not None:
+            all_prompts_writer.abort()
+        if prompt_store_writer is not None:
+            prompt_store_writer.abort()
+        raise
+    for i, writer in writers.items():
+        stats[i]['path'] = writer.close()
+    if all_prompts_writer is not None:
+        all_prompts_writer.close()
+    if prompt_store_writer is not None:
+        prompt_store_writer.close()
+
+    for f, s in zip(filters, stats):
+        prompt_len_sum = s.pop('prompt_len_sum')
+        s['prompt_len_mean'] = round(prompt_len_sum / s['prompts'], 2) if s['prompts'] else None
+        if s['path'] is None:
+            logger.error(f"create_payload_files, did not find any prompts that matched the filtering criteria {json.dumps(f)}")
+    logger.info(f"create_payload_files, routed {num_prompts} prompts to {len(writers)} payload files")
+    return stats
+
+
+def update_payload_files(source_bucket: str,
+                         source_keys: List[str],
+                         prompt_template_keys: List[str],
+                         prompt_template: str,
+                         tokenizer_fingerprint: str,
+                         filters: List[Dict],
+                         inference_parameters: Dict,
+                         bucket: str,
+                         prefix: str,
+                         all_prompts_file: Optional[str] = None,
+                         prompt_store_file: Optional[str] = None,
+                         reference_prompts: bool = False) -> List[Dict]:
+    """
+    Same as create_payload_files from the source files, but the artifacts that are up to date in the manifest
+    are reused. The source files are only read if at least one artifact has to be created. The statistics of
+    every payload file have reused set to True for a payload file that was reused.
+    """
+    if reference_prompts and prompt_store_file is None:
+        raise ValueError("update_payload_files, payloads can only reference prompts by id when a prompt store file is set")
+    manifest = Manifest(bucket, prefix)
+    prompt_inputs: Dict[str, str] = dict(source_files=content_hash(source_file_etags(source_bucket, source_keys)),
+                                         prompt_template=content_hash(prompt_template),
+                                         prompt_template_keys=content_hash(prompt_template_keys),
+                                         tokenizer=tokenizer_fingerprint)
+    payload_inputs: List[Dict[str, str]] = [prompt_inputs | dict(filter=content_hash(f),
+                                                                 inference_parameters=content_hash(inference_parameters),
+                                                                 reference_prompts=content_hash(reference_prompts))
+                                            for f in filters]
+    stale: List[int] = [i for i, f in enumerate(filters) if not manifest.is_up_to_date(payload_file_name(f), payload_inputs[i])]
+    stale_prompt_files: Dict[str, Optional[str]] = {k: f if f is not None and not manifest.is_up_to_date(f, prompt_inputs) else None
+                                                    for k, f in [('all_prompts_file', all_prompts_file),
+                                                                 ('prompt_store_file', prompt_store_file)]}
+    reused = [payload_file_name(f) for i, f in enumerate(filters) if i not in stale]
+    reused += [f for k, f in [('all_prompts_file', all_prompts_file), ('prompt_store_file', prompt_store_file)]
+               if f is not None and stale_prompt_files[k] is None]
+    logger.info(f"update_payload_files, reusing {len(reused)} up to date artifacts={reused}")
+
+    stats: List[Optional[Dict]] = [dict(manifest.get(payload_file_name(f))['stats'], reused=True) if i not in stale else None
+                                   for i, f in enumerate(filters)]
+    if not stale and not any(stale_prompt_files.values()):
+        logger.info("update_payload_files, every artifact is up to date, the source files are not read")
+        return stats
+
+    records = iter_source_records(source_bucket, source_keys)
+    prompt_records = create_prompt_records(records, prompt_template_keys, prompt_template)
+    stale_stats = create_payload_files(prompt_records,
+                                       [filters[i] for i in stale],
+                                       inference_parameters,
+                                       bucket,
+                                       prefix,
+                                       stale_prompt_files['all_prompts_file'],
+                                       # an up to date prompt store is not written again
+                                       stale_prompt_files['prompt_store_file'],
+                                       reference_prompts)
+    for i, s in zip(stale, stale_stats):
+        manifest.record(payload_file_name(filters[i]), payload_inputs[i], s['path'], s)
+        stats[i] = dict(s, reused=False)
+    for f in stale_prompt_files.values():
+        if f is not None:
+            manifest.record(f, prompt_inputs, f"s3://{bucket}/{posixpath.join(prefix, f)}")
+    logger.info(f"update_payload_files, created {len(stale)} payload files, manifest={manifest.save()}")
+    return stats
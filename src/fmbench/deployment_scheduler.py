@@ -0,0 +1,163 @@
+"""
+Deploys the endpoints of the experiments in a config and waits for them to be ready.
+
+Deployments run in a sliding window: up to `max_in_flight` deployments are in progress at a
+time and the next one starts as soon as one completes, so a slow deployment does not hold up
+the others. Endpoint readiness is polled with a jittered exponential backoff instead of a flat
+sleep, which bounds the time an endpoint sits idle (and billed) after it is ready, and the time
+every endpoint took to become ready is recorded. SageMaker throttling errors are retried with
+the same backoff rather than counted as deployment failures:
+
+    deployment_scheduler:
+      max_in_flight: 4              # deployments in progress at the same time
+      max_throttling_retries: 5     # retries of a throttled deployment
+
+The readiness polling of an experiment can be tuned with an optional `readiness_polling`
+section in the experiment (see DEFAULT_BACKOFF_SPEC). The SageMaker client, the sleep and
+the clock are parameters so that the polling can be tested against stubbed clients.
+"""
+import time
+import random
+import asyncio
+import logging
+from botocore.exceptions import ClientError
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEDULER_SPEC: Dict = dict(max_in_flight=4,
+                                    max_throttling_retries=5)
+DEFAULT_BACKOFF_SPEC: Dict = dict(initial_delay_seconds=5,
+                                  max_delay_seconds=30,
+                                  multiplier=2,
+                                  jitter=0.5,              # delays are drawn from [(1 - jitter) * delay, delay]
+                                  timeout_seconds=None)    # stop polling after this long, None to wait indefinitely
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'TooManyRequestsException',
+                          'RequestLimitExceeded', 'SlowDown'}
+# endpoint statuses for which the endpoint is polled again
+PENDING_ENDPOINT_STATUSES = {'Creating', 'Updating'}
+
+
+def deployment_scheduler_spec(config: Dict) -> Dict:
+    return DEFAULT_SCHEDULER_SPEC | config.get('deployment_scheduler', {})
+
+
+def is_throttling_error(e: Exception) -> bool:
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+class Backoff:
+    """Jittered exponential backoff delays, capped at max_delay_seconds."""
+
+    def __init__(self, spec: Optional[Dict] = None, rng: Optional[random.Random] = None):
+        self.spec: Dict = DEFAULT_BACKOFF_SPEC | (spec if spec is not None else {})
+        self._rng = rng if rng is not None else random.Random()
+
+    def delays(self) -> Iterator[float]:
+        delay = self.spec['initial_delay_seconds']
+        while True:
+            yield delay * (1 - self.spec['jitter'] * self._rng.random())
+            delay = min(self.spec['max_delay_seconds'], delay * self.spec['multiplier'])
+
+
+def call_with_backoff(fn: Callable, *args,
+                      max_retries: int = DEFAULT_SCHEDULER_SPEC['max_throttling_retries'],
+                      spec: Optional[Dict] = None,
+                      sleep: Callable[[float], None] = time.sleep,
+                      **kwargs) -> Any:
+    """Calls fn, retrying throttling errors with backoff, e.g. for SageMaker create_* calls."""
+    delays = Backoff(spec).delays()
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except ClientError as e:
+            if not is_throttling_error(e) or attempt == max_retries:
+                raise
+            delay = next(delays)
+            logger.warning(f"call_with_backoff, {getattr(fn, '__name__', fn)} throttled, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            sleep(delay)
+
+
+def wait_for_endpoint(sm_client,
+                      endpoint_name: str,
+                      spec: Optional[Dict] = None,
+                      sleep: Callable[[float], None] = time.sleep,
+                      clock: Callable[[], float] = time.monotonic,
+                      rng: Optional[random.Random] = None) -> Dict:
+    """
+    Polls the endpoint until it is no longer being created, throttled describe calls are retried.
+    Returns the final status, the seconds it took to become ready, the number of polls and of throttled polls.
+    """
+    backoff = Backoff(spec, rng)
+    delays = backoff.delays()
+    timeout = backoff.spec['timeout_seconds']
+    start = clock()
+    polls: int = 0
+    throttled: int = 0
+    status: Optional[str] = None
+    while True:
+        try:
+            polls += 1
+            status = sm_client.describe_endpoint(EndpointName=endpoint_name)['EndpointStatus']
+            if status not in PENDING_ENDPOINT_STATUSES:
+                break
+        except ClientError as e:
+            if not is_throttling_error(e):
+                raise
+            throttled += 1
+            logger.warning(f"wait_for_endpoint, endpoint={endpoint_name}, describe_endpoint throttled {throttled} times")
+        if timeout is not None and clock() - start >= timeout:
+            logger.error(f"wait_for_endpoint, endpoint={endpoint_name} not ready after {timeout} seconds, status={status}")
+            break
+        sleep(next(delays))
+    ready_seconds = round(clock() - start, 2)
+    logger.info(f"wait_for_endpoint, endpoint={endpoint_name}, status={status}, ready_seconds={ready_seconds}, "
+                f"polls={polls}, throttled={throttled}")
+    return dict(endpoint_name=endpoint_name, status=status, ready_seconds=ready_seconds, polls=polls, throttled=throttled)
+
+
+async def deploy_with_retries(experiment: Dict,
+                              deploy_fn: Callable[[Dict], Optional[Dict]],
+                              max_throttling_retries: int = DEFAULT_SCHEDULER_SPEC['max_throttling_retries'],
+                              backoff_spec: Optional[Dict] = None,
+                              sleep: Callable[[float], Awaitable] = asyncio.sleep) -> Optional[Dict]:
+    """Runs the blocking deploy_fn(experiment) in a thread, throttled deployments are retried with backoff. None if it failed."""
+    delays = Backoff(backoff_spec).delays()
+    for attempt in range(max_throttling_retries + 1):
+        try:
+            return await asyncio.to_thread(deploy_fn, experiment)
+        except Exception as e:
+            if not is_throttling_error(e) or attempt == max_throttling_retries:
+                logger.error(f"deploy_with_retries, deployment of name={experiment['name']} failed, exception={e}")
+                return None
+            delay = next(delays)
+            logger.warning(f"deploy_with_retries, deployment of name={experiment['name']} throttled, "
+                           f"retry {attempt + 1}/{max_throttling_retries} in {delay:.1f}s")
+            await sleep(delay)
+
+
+async def run_deployments(experiments: List[Dict],
+                          deploy_fn: Callable[[Dict], Optional[Dict]],
+                          max_in_flight: int = DEFAULT_SCHEDULER_SPEC['max_in_flight'],
+                          max_throttling_retries: int = DEFAULT_SCHEDULER_SPEC['max_throttling_retries'],
+                          backoff_spec: Optional[Dict] = None,
+                          sleep: Callable[[float], Awaitable] = asyncio.sleep) -> List[Optional[Dict]]:
+    """
+    Runs the blocking deploy_fn(experiment) in a thread for every experiment with at most max_in_flight
+    of them at the same time. Returns the results in the order of the experiments, with the deployment
+    time added, None for an experiment that was not deployed.
+    """
+    slots = asyncio.Semaphore(max(1, max_in_flight))
+    logger.info(f"run_deployments, deploying {len(experiments)} experiments, max_in_flight={max_in_flight}")
+
+    async def _deploy(e_idx: int, experiment: Dict) -> Optional[Dict]:
+        async with slots:
+            logger.info(f"run_deployments, starting deployment {e_idx}/{len(experiments)}, name={experiment['name']}")
+            start = time.perf_counter()
+            result = await deploy_with_retries(experiment, deploy_fn, max_throttling_retries, backoff_spec, sleep)
+            deployment_seconds = round(time.perf_counter() - start, 2)
+            logger.info(f"run_deployments, deployment {e_idx}/{len(experiments)}, name={experiment['name']} "
+                        f"done in {deployment_seconds} seconds")
+            return dict(result, deployment_seconds=deployment_seconds) if result is not None else None
+
+    return await asyncio.gather(*[_deploy(e_idx, experiment) for e_idx, experiment in enumerate(experiments, start=1)])
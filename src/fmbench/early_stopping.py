@@ -0,0 +1,89 @@
+"""
+Statistical early stopping for a combination of concurrency level and payload file.
+
+By default every combination sends every payload in the payload file. With the optional
+`early_stopping` section of an experiment a combination stops as soon as the latency
+estimate has converged:
+
+    early_stopping:
+      min_requests: 50          # never stop before this many requests
+      max_requests: 1000        # always stop after this many requests
+      statistic: mean           # mean or a latency percentile such as 90 or 99
+      confidence: 0.95
+      relative_ci_width: 0.1    # stop once the confidence interval is within 10% of the estimate
+
+The confidence interval of the mean uses the normal approximation, the one of a percentile
+is the distribution free interval between the order statistics around the percentile rank.
+"""
+import math
+import bisect
+import logging
+from enum import Enum
+from statistics import NormalDist, mean, stdev
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EARLY_STOPPING_SPEC: Dict = dict(min_requests=50,
+                                         max_requests=1000,
+                                         statistic="mean",
+                                         confidence=0.95,
+                                         relative_ci_width=0.1)
+
+
+class STOP_REASON(str, Enum):
+    PAYLOADS_EXHAUSTED = 'payloads-exhausted'
+    CONVERGED = 'converged'
+    MAX_REQUESTS = 'max-requests'
+
+
+class EarlyStopping:
+    """Tracks the latencies of a combination and decides when the latency estimate is precise enough."""
+
+    def __init__(self, spec: Dict):
+        self.spec: Dict = DEFAULT_EARLY_STOPPING_SPEC | spec
+        statistic: Union[str, float] = self.spec['statistic']
+        self.percentile: Optional[float] = None if str(statistic) == "mean" else float(str(statistic).lstrip("p"))
+        self._z: float = NormalDist().inv_cdf((1 + self.spec['confidence']) / 2)
+        self.sample_count: int = 0
+        # latencies of the successful requests, kept sorted for the percentile interval
+        self._latencies: List[float] = []
+
+    def relative_ci_width(self) -> Optional[float]:
+        """Width of the confidence interval relative to the estimate, None while it cannot be computed."""
+        n = len(self._latencies)
+        if n < 2:
+            return None
+        if self.percentile is None:
+            estimate = mean(self._latencies)
+            width = 2 * self._z * stdev(self._latencies) / math.sqrt(n)
+        else:
+            p = self.percentile / 100
+            half_width = self._z * math.sqrt(n * p * (1 - p))
+            lo, hi = math.floor(n * p - half_width), math.ceil(n * p + half_width)
+            # not enough samples yet to bracket the percentile, e.g. p99 with fewer than a few hundred requests
+            if lo < 0 or hi >= n:
+                return None
+            estimate = self._latencies[min(n - 1, math.ceil(n * p) - 1)]
+            width = self._latencies[hi] - self._latencies[lo]
+        return width / estimate if estimate > 0 else None
+
+    def update(self, responses: List[Dict]) -> Optional[STOP_REASON]:
+        """Adds the responses of a chunk, returns the reason to stop or None to continue."""
+        return self.restore([r.get('latency') if r.get('completion') is not None else None for r in responses])
+
+    def restore(self, latencies: List[Optional[float]]) -> Optional[STOP_REASON]:
+        """Same as update with the latencies of the requests, None for a failed request, e.g. from the run journal."""
+        self.sample_count += len(latencies)
+        for latency in latencies:
+            if latency is not None:
+                bisect.insort(self._latencies, latency)
+        if self.sample_count >= self.spec['max_requests']:
+            return STOP_REASON.MAX_REQUESTS
+        if self.sample_count < self.spec['min_requests']:
+            return None
+        width = self.relative_ci_width()
+        if width is not None and width <= self.spec['relative_ci_width']:
+            logger.info(f"update, converged after {self.sample_count} requests, relative_ci_width={width:.4f}")
+            return STOP_REASON.CONVERGED
+        return None
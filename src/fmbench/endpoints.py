@@ -0,0 +1,161 @@
+"""
+Deployment, description and deletion of the endpoints of the experiments.
+
+Used by the deployment and cleanup steps and, in the pipelined orchestration mode, by the
+inference step which deploys, benchmarks and deletes the endpoint of every experiment itself.
+"""
+import sys
+import logging
+import importlib.util
+from pathlib import Path
+from typing import Dict, Optional
+import importlib.resources as pkg_resources
+from fmbench.aws_clients import get_client
+from fmbench.deployment_scheduler import is_throttling_error, wait_for_endpoint, PENDING_ENDPOINT_STATUSES
+from fmbench.scripts.mock_inference_server import MOCK_SERVER_IMAGE
+from fmbench.scripts.deploy_w_mock_server import shutdown as shutdown_mock_server
+
+logger = logging.getLogger(__name__)
+
+# endpoints in any other status are left alone by the cleanup
+DELETABLE_ENDPOINT_STATUSES = {'InService', 'Failed'}
+
+
+def sagemaker_execution_role(config: Dict) -> Optional[str]:
+    """The SageMaker execution role of the notebook instance, or the one in the config file."""
+    try:
+        from sagemaker import get_execution_role
+        return get_execution_role()
+    except Exception as e:
+        logger.error(f"could not determine SageMaker execution role, error={e}, going to look for execution role in config file..")
+        return config['aws'].get('sagemaker_execution_role')
+
+
+def deploy_model(experiment_config: Dict, aws_region: str, role_arn: str) -> Optional[Dict]:
+    """Deploys the endpoint of an experiment with its deployment script, None if it is not deployed."""
+    # Log the deployment details
+    logger.info(f"going to deploy {experiment_config}, in {aws_region} with {role_arn}")
+    model_deployment_result = None
+
+    # Check if deployment is enabled in the config; skip if not
+    deploy = experiment_config.get('deploy', False)
+    if deploy is False:
+        logger.error(f"skipping deployment of {experiment_config['model_id']} because deploy={deploy}")
+        return model_deployment_result
+
+    # Assuming fmbench is a valid Python package and scripts is a subdirectory within it
+    scripts_dir = Path(pkg_resources.files('fmbench'), 'scripts')
+    logger.info(f"Using fmbench.scripts directory: {scripts_dir}")
+
+    # Proceed with deployment as before
+    try:
+        module_name = Path(experiment_config['deployment_script']).stem
+        logger.info(f"script provided for deploying this model is --> {module_name}")
+        deployment_script_path = scripts_dir / f"{module_name}.py"
+        logger.info(f"script path is --> {deployment_script_path}")
+
+        # Check and proceed with local script
+        if not deployment_script_path.exists():
+            logger.error(f"Deployment script {deployment_script_path} not found.")
+            return None
+
+        logger.info(f"Deploying using local code: {deployment_script_path}")
+
+        spec = importlib.util.spec_from_file_location(module_name, str(deployment_script_path))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+
+        model_deployment_result = module.deploy(experiment_config, role_arn)
+        return model_deployment_result
+
+    except Exception as error:  # Broader exception handling for non-ClientError issues
+        # throttled deployments are retried by the deployment scheduler
+        if is_throttling_error(error):
+            raise
+        logger.error(f"An error occurred during deployment: {error}")
+        return model_deployment_result
+
+
+def get_all_info_for_endpoint(ep: Dict) -> Optional[Dict]:
+    """Describes the endpoint, endpoint config and model of a deployed endpoint."""
+    ## extract the endpoint name
+    ep_name = ep['endpoint_name']
+
+    ## extract the experiment name from the config.yml file
+    experiment_name = ep['experiment_name']
+    if ep_name is None:
+        return None
+
+    ## deployment scripts for endpoints that are not hosted on SageMaker (e.g. the mock inference server)
+    ## provide the endpoint description themselves, in the same shape as the SageMaker describe calls
+    deployment = dict(deployment_seconds=ep.get('deployment_seconds'), ready_seconds=ep.get('ready_seconds'))
+    if ep.get('endpoint_info') is not None:
+        return dict(experiment_name=experiment_name, deployment=deployment, **ep['endpoint_info'])
+    sm_client = get_client('sagemaker')
+
+    ## get the description on the configuration of the deployed model
+    endpoint = sm_client.describe_endpoint(EndpointName=ep_name)
+    endpoint_config = sm_client.describe_endpoint_config(EndpointConfigName=endpoint['EndpointConfigName'])
+    model_config = sm_client.describe_model(ModelName=endpoint_config['ProductionVariants'][0]['ModelName'])
+
+    ## Store the experiment name and all of the other model configuration information in the 'info' dict
+    info = dict(experiment_name=experiment_name,
+                endpoint=endpoint,
+                endpoint_config=endpoint_config,
+                model_config=model_config,
+                deployment=deployment)
+    return info
+
+
+def is_in_service(endpoint_info: Dict) -> bool:
+    return endpoint_info['endpoint'].get('EndpointStatus') == 'InService'
+
+
+def delete_endpoint(endpoint_info: Dict) -> None:
+    """Deletes an endpoint described by get_all_info_for_endpoint, mock inference servers are stopped instead."""
+    ## Extract the endpoint name from the deployed model configuration
+    ep_name = endpoint_info['endpoint']["EndpointName"]
+
+    ## mock inference servers are local processes and not SageMaker endpoints, stop them instead
+    if endpoint_info['model_config'].get('PrimaryContainer', {}).get('Image') == MOCK_SERVER_IMAGE:
+        logger.info(f"going to stop the mock inference server at {ep_name}")
+        shutdown_mock_server(ep_name)
+        return
+
+    sm_client = get_client("sagemaker")
+    ## Describe the model endpoint
+    logger.info(f"Going to describing the endpoint -> {ep_name}")
+    status = sm_client.describe_endpoint(EndpointName=ep_name)['EndpointStatus']
+
+    ## an endpoint that is still being created (e.g. its readiness polling timed out) is billed as well,
+    ## wait until it is created (or has failed) and delete it instead of leaving it behind
+    if status in PENDING_ENDPOINT_STATUSES:
+        logger.info(f"endpoint {ep_name} is {status}, waiting for it before deleting it")
+        status = wait_for_endpoint(sm_client, ep_name)['status']
+
+    ## If the given model endpoint is in service (or failed to deploy), delete it
+    if status in DELETABLE_ENDPOINT_STATUSES:
+        logger.info(f"going to delete {ep_name}")
+        ## deleting the model endpoint
+        sm_client.delete_endpoint(EndpointName=ep_name)
+        logger.info(f"deleted {ep_name}")
+    else:
+        logger.warning(f"not deleting {ep_name}, status={status}")
+
+
+def deploy_endpoint(experiment_config: Dict, aws_region: str, role_arn: str) -> Optional[Dict]:
+    """
+    Deploys the endpoint of an experiment and returns its description, None if it could not be deployed.
+    An endpoint that was created but is not in service is deleted.
+    """
+    ep = deploy_model(experiment_config, aws_region, role_arn)
+    if ep is None:
+        return None
+    info = get_all_info_for_endpoint(ep)
+    if info is not None and not is_in_service(info):
+        logger.error(f"endpoint={ep['endpoint_name']} for experiment={experiment_config['name']} is "
+                     f"{info['endpoint'].get('EndpointStatus')}, deleting it")
+        delete_endpoint(info)
+        return None
+    return info
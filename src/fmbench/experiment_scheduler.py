@@ -0,0 +1,130 @@
+"""
+Runs the experiments in a config concurrently.
+
+Experiments that benchmark different endpoints are independent of each other, so instead of
+benchmarking them one after the other (with every endpoint but the current one idle and still
+billed) they are run as concurrent tasks on the event loop, every experiment with its own load
+loop. The number of experiments running at the same time is capped so that the client side
+(CPU, threads, connections) does not become the bottleneck and distort the results:
+
+    experiment_scheduler:
+      max_parallel_experiments: 4   # default 1, i.e. one experiment after the other
+
+Experiments that share an endpoint are never run at the same time.
+
+In the pipelined orchestration mode the endpoints are not deployed upfront by the deployment
+step and deleted together by the cleanup step, instead every experiment moves through deploy,
+benchmark (including its warm-up) and delete on its own, as soon as there is room for another
+live endpoint. An endpoint is billed only for as long as its own experiment needs it:
+
+    experiment_scheduler:
+      pipelined: yes
+      max_live_endpoints: 2         # endpoints deployed at the same time, default 1
+      max_parallel_experiments: 2   # endpoints benchmarked at the same time
+"""
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from fmbench.deployment_scheduler import deploy_with_retries, DEFAULT_SCHEDULER_SPEC
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PARALLEL_EXPERIMENTS: int = 1
+DEFAULT_MAX_LIVE_ENDPOINTS: int = 1
+
+
+def max_parallel_experiments(config: Dict) -> int:
+    """Cap on the number of experiments that run at the same time, from the optional `experiment_scheduler` section."""
+    return max(1, int(config.get('experiment_scheduler', {}).get('max_parallel_experiments', DEFAULT_MAX_PARALLEL_EXPERIMENTS)))
+
+
+def is_pipelined(config: Dict) -> bool:
+    """True if the endpoints are deployed and deleted by the inference step, one experiment at a time."""
+    return config.get('experiment_scheduler', {}).get('pipelined', False) is True
+
+
+def max_live_endpoints(config: Dict) -> int:
+    return max(1, int(config.get('experiment_scheduler', {}).get('max_live_endpoints', DEFAULT_MAX_LIVE_ENDPOINTS)))
+
+
+async def run_experiments(experiments: List[Dict],
+                          run_experiment: Callable[[int, Dict], Awaitable[Any]],
+                          max_parallel: int = DEFAULT_MAX_PARALLEL_EXPERIMENTS,
+                          endpoint_of: Optional[Callable[[Dict], str]] = None) -> List[Any]:
+    """
+    Runs `run_experiment(e_idx, experiment)` for every experiment (e_idx starts at 1) with at most
+    max_parallel of them at the same time, experiments with the same endpoint_of value one after
+    the other. Returns the results in the order of the experiments, None for an experiment that failed.
+    """
+    endpoint_of = endpoint_of if endpoint_of is not None else (lambda experiment: experiment['name'])
+    slots = asyncio.Semaphore(max_parallel)
+    endpoint_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+    logger.info(f"run_experiments, running {len(experiments)} experiments, max_parallel={max_parallel}")
+
+    async def _run(e_idx: int, experiment: Dict) -> Any:
+        # take the endpoint before a slot so that waiting for a busy endpoint does not hold a slot
+        async with endpoint_locks[endpoint_of(experiment)], slots:
+            logger.info(f"run_experiments, starting experiment={e_idx}/{len(experiments)}, name={experiment['name']}")
+            try:
+                return await run_experiment(e_idx, experiment)
+            except Exception as e:
+                logger.error(f"run_experiments, experiment={e_idx}/{len(experiments)}, name={experiment['name']} "
+                             f"failed, exception={e}")
+                return None
+
+    return await asyncio.gather(*[_run(e_idx, experiment) for e_idx, experiment in enumerate(experiments, start=1)])
+
+
+async def run_pipelined_experiments(experiments: List[Dict],
+                                    deploy: Callable[[Dict], Optional[Dict]],
+                                    run_experiment: Callable[[int, Dict], Awaitable[Optional[Dict]]],
+                                    delete: Callable[[Dict], None],
+                                    max_live: int = DEFAULT_MAX_LIVE_ENDPOINTS,
+                                    max_parallel: int = DEFAULT_MAX_PARALLEL_EXPERIMENTS,
+                                    max_throttling_retries: int = DEFAULT_SCHEDULER_SPEC['max_throttling_retries']) -> List[Optional[Dict]]:
+    """
+    Runs every experiment through the blocking deploy(experiment) (which returns the endpoint, None if it could
+    not be deployed, throttled deployments are retried as by the deployment scheduler), run_experiment(e_idx,
+    experiment) and the blocking delete(endpoint), with at most max_live endpoints deployed and max_parallel
+    experiments benchmarked at the same time. Returns the results of run_experiment in the order of the
+    experiments, with the endpoint, the seconds from the start of its deployment until it was deleted and
+    whether it was deleted (an endpoint that could not be deleted is left for the cleanup step).
+    The endpoint and its lifetime are returned (without results) for an experiment that deployed but then
+    failed, since its endpoint was billed all the same, None for an experiment that could not be deployed.
+    """
+    live_endpoints = asyncio.Semaphore(max_live)
+    slots = asyncio.Semaphore(max_parallel)
+    logger.info(f"run_pipelined_experiments, running {len(experiments)} experiments, max_live={max_live}, max_parallel={max_parallel}")
+
+    async def _run(e_idx: int, experiment: Dict) -> Optional[Dict]:
+        name = f"experiment={e_idx}/{len(experiments)}, name={experiment['name']}"
+        async with live_endpoints:
+            start = time.perf_counter()
+            logger.info(f"run_pipelined_experiments, deploying {name}")
+            endpoint = await deploy_with_retries(experiment, deploy, max_throttling_retries)
+            if endpoint is None:
+                logger.error(f"run_pipelined_experiments, {name} not deployed, skipping")
+                return None
+            result = None
+            endpoint_deleted = False
+            try:
+                async with slots:
+                    logger.info(f"run_pipelined_experiments, benchmarking {name}")
+                    result = await run_experiment(e_idx, experiment)
+            except Exception as e:
+                logger.error(f"run_pipelined_experiments, {name} failed, exception={e}")
+            finally:
+                try:
+                    await asyncio.to_thread(delete, endpoint)
+                    endpoint_deleted = True
+                except Exception as e:
+                    logger.error(f"run_pipelined_experiments, could not delete the endpoint of {name}, "
+                                 f"it is left for the cleanup step, exception={e}")
+            endpoint_lifetime_seconds = time.perf_counter() - start
+            logger.info(f"run_pipelined_experiments, {name} done, endpoint_lifetime_seconds={endpoint_lifetime_seconds:.2f}")
+        return dict(result if result is not None else {}, endpoint=endpoint, endpoint_deleted=endpoint_deleted,
+                    endpoint_lifetime_seconds=endpoint_lifetime_seconds)
+
+    return await asyncio.gather(*[_run(e_idx, experiment) for e_idx, experiment in enumerate(experiments, start=1)])
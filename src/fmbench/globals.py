@@ -1,10 +1,9 @@
 import os
-import yaml
-import boto3
-import requests
 from enum import Enum
 from pathlib import Path
 from datetime import datetime
+from typing import Callable, Dict, Optional
+from fmbench.run_context import RunContext, get_run_context, set_run_context
 
 
 FMBENCH_PACKAGE_NAME: str = "fmbench"
@@ -13,119 +12,81 @@ current_working_directory: str = Path.cwd()
 
 CONFIG_FILEPATH_FILE: str = current_working_directory / 'config_filepath.txt'
 
-# S3 client initialization
-s3_client = boto3.client('s3')
-session = boto3.session.Session()
-
-## Configuring the role ARN -- extract the role name
-caller = boto3.client('sts').get_caller_identity()
-account_id = caller.get('Account')
-arn_string = caller.get('Arn')
-ROLE_NAME = arn_string.split('/')[-1]
-
-current_config_file = os.environ.get("CONFIG_FILE_FMBENCH")
-## if var is true, use that from cli
-if current_config_file is not None:
-    CONFIG_FILE = current_config_file
-    print(f"config file current -> {CONFIG_FILE}, {current_config_file}")
-else:
-    CONFIG_FILE = Path(CONFIG_FILEPATH_FILE).read_text().strip()
-    print(f"config file current -> {CONFIG_FILE}, {current_config_file}")
-
-
-if CONFIG_FILE.startswith("s3://"):
-    # Parse the S3 URL
-    bucket_name, key_path = CONFIG_FILE.replace("s3://", "").split("/", 1)
-    # Use boto3 to access the S3 service
-    s3 = boto3.resource('s3')
-    # Fetch the object from S3
-    obj = s3.Object(bucket_name, key_path)
-    # Read the object's content
-    CONFIG_FILE_CONTENT = obj.get()['Body'].read().decode('utf-8')
-elif CONFIG_FILE.startswith("https://"):
-    # Fetch the content from the HTTPS URL
-    response = requests.get(CONFIG_FILE)
-    response.raise_for_status()  # Ensure we got a successful response
-    CONFIG_FILE_CONTENT = response.text
-else:
-    CONFIG_FILE_CONTENT = Path(CONFIG_FILE).read_text()
-
-# check if the file is still parameterized and if so replace the parameters with actual values
-# if the file is not parameterized then the following statements change nothing
-args = dict(region=session.region_name,
-            role_arn=arn_string,
-            write_bucket=f"sagemaker-fmbench-write-{account_id}",
-            read_bucket=f"sagemaker-fmbench-read-{account_id}")
-CONFIG_FILE_CONTENT = CONFIG_FILE_CONTENT.format(**args)
-
-# Load the configuration
-config = yaml.safe_load(CONFIG_FILE_CONTENT)
-print(f"Loaded config: {config}")
-                                                                                           
-    
-## data directory and prompts
-PER_ACCOUNT_DIR: str = f"{config['general']['name']}-{ROLE_NAME}"
-DATA_DIR: str = os.path.join(PER_ACCOUNT_DIR, config['dir_paths']['data_prefix'])
-PROMPTS_DIR = os.path.join(DATA_DIR, config['dir_paths']['prompts_prefix'])
-
-## --------------------- Metrics directory based on date and time ---------------------------
-
-current_time = datetime.now()
-
-# Assuming current_time is a datetime object
-formatted_time = current_time.strftime("%Y/%m/%d/%H/%M")
-
-# Split the formatted_time into components
-year, month, day, hour, minute = formatted_time.split('/')
-
-# Construct the METRICS_DIR path
-METRICS_DIR = f"{DATA_DIR}/metrics/yyyy={year}/mm={month}/dd={day}/hh={hour}/mm={minute}"
-
-METRICS_PER_INFERENCE_DIR = os.path.join(METRICS_DIR, "per_inference")
-METRICS_PER_CHUNK_DIR = os.path.join(METRICS_DIR, "per_chunk")
-
-METRICS_PER_INFERENCE_DIR = os.path.join(METRICS_DIR, "per_inference")
-METRICS_PER_CHUNK_DIR = os.path.join(METRICS_DIR, "per_chunk")
-
-
-## --------------------- Models directory based on date and time ---------------------------
-MODELS_DIR = f"{DATA_DIR}/models"
-
-## Use this to upload to the s3 bucket (extracted from the config file)
-BUCKET_NAME = config['aws']['bucket']
-READ_BUCKET_NAME = config['s3_read_data']['read_bucket']
-
-## S3 prefix
-PREFIX_NAME = config['dir_paths']['data_prefix']
-
-## SOURCE data is where your actual data resides in s3
-SOURCE_DATA = config['s3_read_data']['source_data_prefix']
-
-## Read the prompt template that the user uploads
-PROMPT_TEMPLATE_S3_PREFIX = config['s3_read_data']['prompt_template_dir']
-
 ## Initialize the scripts directory
 SCRIPTS_DIR: str = "fmbench/scripts"
 
-## METADATA DIR TO HANDLE DYNAMIC S3 PATHS FOR METRICS/RESULTS
-METADATA_DIR:str = config['dir_paths']['metadata_dir']
 METRICS_PATH_FNAME: str = "metrics_path.txt"
 
-DIR_LIST = [DATA_DIR, PROMPTS_DIR, METRICS_DIR, MODELS_DIR, METRICS_PER_INFERENCE_DIR, METRICS_PER_CHUNK_DIR]
+## info of the deployed endpoints, written to the models directory by the deploy step
+ENDPOINT_LIST_FNAME: str = "endpoints.json"
 
 ## this is for custom tokenizers
-TOKENIZER_DIR_S3 = config['s3_read_data']['tokenizer_prefix']
 TOKENIZER = 'tokenizer'
 
-DEPLOYMENT_SCRIPT_S3 = config['s3_read_data']['scripts_prefix']
-
-_ = list(map(lambda x: os.makedirs(x, exist_ok=True), DIR_LIST))
+## Everything that depends on the config file or on the AWS account is resolved through the
+## run context on first access (see fmbench.run_context), importing this module does not read
+## the config, call STS or create any directories.
+_LAZY_GLOBALS: Dict[str, Callable[[RunContext], object]] = {
+    # S3 client and session
+    's3_client': lambda ctx: ctx.s3_client,
+    'session': lambda ctx: ctx.session,
+    ## role ARN and role name
+    'account_id': lambda ctx: ctx.account_id,
+    'arn_string': lambda ctx: ctx.role_arn,
+    'ROLE_NAME': lambda ctx: ctx.role_name,
+    ## config file
+    'CONFIG_FILE': lambda ctx: ctx.config_file,
+    'CONFIG_FILE_CONTENT': lambda ctx: ctx.config_content,
+    'config': lambda ctx: ctx.config,
+    ## data directory and prompts
+    'PER_ACCOUNT_DIR': lambda ctx: ctx.per_account_dir,
+    'DATA_DIR': lambda ctx: ctx.data_dir,
+    'PROMPTS_DIR': lambda ctx: ctx.prompts_dir,
+    ## run id and whether the run continues from its progress journal
+    'RUN_ID': lambda ctx: ctx.run_id,
+    'RESUME_RUN': lambda ctx: ctx.resume,
+    ## metrics directory based on date and time
+    'METRICS_DIR': lambda ctx: ctx.metrics_dir,
+    'METRICS_PER_INFERENCE_DIR': lambda ctx: ctx.metrics_per_inference_dir,
+    'METRICS_PER_CHUNK_DIR': lambda ctx: ctx.metrics_per_chunk_dir,
+    ## models directory
+    'MODELS_DIR': lambda ctx: ctx.models_dir,
+    'DIR_LIST': lambda ctx: ctx.dir_list,
+    ## Use this to upload to the s3 bucket (extracted from the config file)
+    'BUCKET_NAME': lambda ctx: ctx.config['aws']['bucket'],
+    'READ_BUCKET_NAME': lambda ctx: ctx.config['s3_read_data']['read_bucket'],
+    ## S3 prefix
+    'PREFIX_NAME': lambda ctx: ctx.config['dir_paths']['data_prefix'],
+    ## SOURCE data is where your actual data resides in s3
+    'SOURCE_DATA': lambda ctx: ctx.config['s3_read_data']['source_data_prefix'],
+    ## Read the prompt template that the user uploads
+    'PROMPT_TEMPLATE_S3_PREFIX': lambda ctx: ctx.config['s3_read_data']['prompt_template_dir'],
+    ## METADATA DIR TO HANDLE DYNAMIC S3 PATHS FOR METRICS/RESULTS
+    'METADATA_DIR': lambda ctx: ctx.config['dir_paths']['metadata_dir'],
+    'TOKENIZER_DIR_S3': lambda ctx: ctx.config['s3_read_data']['tokenizer_prefix'],
+    'DEPLOYMENT_SCRIPT_S3': lambda ctx: ctx.config['s3_read_data']['scripts_prefix'],
+    ## Define the endpoint list as the config-general name plus the role arn for unique generation from different roles in the same/different accounts
+    'ENDPOINT_LIST_PATH': lambda ctx: os.path.join(ctx.models_dir, ENDPOINT_LIST_FNAME),
+    'REQUEST_PAYLOAD_FPATH': lambda ctx: os.path.join(ctx.prompts_dir, "payload.jsonl"),
+    'RESULTS_FPATH': lambda ctx: os.path.join(ctx.metrics_dir, "results.csv"),
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_GLOBALS:
+        return _LAZY_GLOBALS[name](get_run_context())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# prompt token count precomputed in 1_generate_data and carried in the payload files,
+# this key is removed from the payload before it is sent to the endpoint
+PROMPT_TOKENS_PAYLOAD_KEY: str = "prompt_tokens"
+# id of the prompt in the prompt store, carried instead of the prompt text by payload files
+# that reference prompts by id and replaced with the prompt text when the payload file is read
+PROMPT_ID_PAYLOAD_KEY: str = "prompt_id"
+# position of the payload in its payload file, set when the payload file is read so that a resumed
+# run knows which payloads completed, removed from the payload before it is sent to the endpoint
+PAYLOAD_INDEX_KEY: str = "payload_index"
 
-## Define the endpoint list as the config-general name plus the role arn for unique generation from different roles in the same/different accounts
-ENDPOINT_LIST_PATH:str = os.path.join(MODELS_DIR, "endpoints.json")
-
-REQUEST_PAYLOAD_FPATH:str = os.path.join(PROMPTS_DIR, "payload.jsonl")
-RESULTS_FPATH:str = os.path.join(METRICS_DIR, "results.csv")
 class TRUNCATE_POLICY(str, Enum):
     AT_PROMPT_TOKEN_LENGTH = 'at-prompt-token-length'
 
@@ -144,6 +105,8 @@ SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_FNAME: str = "summary_metrics_f
 SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_EACH_INSTANCE_TYPE_FNAME: str = "summary_metrics_for_dataset_best_option_each_instance_type.csv"
 SUMMARY_MODEL_ENDPOINT_COST_PER_INSTANCE: str = "endpoint_per_instance_per_run_costs.csv"
 BUSINESS_SUMMARY_PLOT_FNAME: str = "business_summary.png"
+STREAMING_METRICS_FNAME: str = "streaming_metrics.csv"
+CONCURRENCY_SEARCH_RESULTS_FNAME: str = "concurrency_search_results.csv"
 
 # plot filenames
 ERROR_RATES_PLOT_TEXT: str = "Error rates for different concurrency levels and instance types"
@@ -155,6 +118,9 @@ CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_TEXT: str = "Concurrency Vs latency for di
 
 
 LATENCY_BUDGET: int = 20
+# the latency budget applies to the mean latency unless a percentile (e.g. 90 or 99) is set,
+# both can be overridden with latency_budget and latency_budget_percentile in the report section of the config
+LATENCY_BUDGET_PERCENTILE: Optional[float] = None
 
 OVERALL_RESULTS_MD: str = """
 # Results for performance benchmarking
@@ -174,11 +140,11 @@ The following table provides the best combinations for running inference for dif
 """
 
 ## Dataset=`{dataset}`, instance_type=`{instance_type}`
-RESULT_DESC: str = """The best option for staying within a latency budget of `{latency_budget} seconds` on a `{instance_type}` for the `{dataset}` dataset is a `concurrency level of {concurrency}`. A concurrency level of {concurrency} achieves an `average latency of {latency_mean} seconds`, for an `average prompt size of {prompt_size} tokens` and `completion size of {completion_size} tokens` with `{tpm} transactions/minute`."""
+RESULT_DESC: str = """The best option for staying within a {latency_stat} latency budget of `{latency_budget} seconds` on a `{instance_type}` for the `{dataset}` dataset is a `concurrency level of {concurrency}`. A concurrency level of {concurrency} achieves a `{latency_stat} latency of {latency} seconds`, for an `average prompt size of {prompt_size} tokens` and `completion size of {completion_size} tokens` with `{tpm} transactions/minute`."""
 
 RESULT_ROW: str = "|`{dataset}`|`{instance_type}`|{desc}|"
 
-RESULT_FAILURE_DESC: str = """This experiment did not find any combination of concurrency level and other configuration settings that could provide a response within a latency budget of `{latency_budget} seconds` on a `{instance_type}` for the `{dataset}` dataset."""
+RESULT_FAILURE_DESC: str = """This experiment did not find any combination of concurrency level and other configuration settings that could provide a response within a {latency_stat} latency budget of `{latency_budget} seconds` on a `{instance_type}` for the `{dataset}` dataset."""
 
 PROMPT_TEMPLATE: str = """<s>[INST] <<SYS>>
 You are an assistant for question-answering tasks. Use the following pieces of retrieved context in the section demarcated by "```" to answer the question. If you don't know the answer just say that you don't know. Use three sentences maximum and keep the answer concise.
@@ -194,3 +160,8 @@ Question: {input}
 Answer:
 
 """
+
+# `from fmbench.globals import *` only exports the constants, the lazily resolved names are
+# imported by name (e.g. `from fmbench.globals import config, METRICS_DIR`) by the code that
+# needs them, which is where the run context is resolved
+__all__ = [name for name in list(globals()) if not name.startswith('_') and name not in _LAZY_GLOBALS]
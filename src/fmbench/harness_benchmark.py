@@ -0,0 +1,287 @@
+"""
+Benchmarks the overhead of the benchmarking harness itself.
+
+The load generator loop, the predictor wrappers, the deferred token counting and the metrics
+aggregation from fmbench.inference are run against in-process predictors that respond
+immediately, so all the time that is measured is time spent in the client. Reported are
+
+1. the per-request cost of the individual components (payload serialization, get_inference,
+   token counting, calculate_metrics) in microseconds,
+2. for every concurrency level the overhead per request and the maximum number of requests
+   per second the harness can drive, for both the thread based and the async predictor path,
+3. the memory held per in-flight request.
+
+Every run is appended to a json lines results file together with the fmbench version and is
+compared with the previous run in that file so that regressions in the harness show up.
+
+Run with `python -m fmbench.harness_benchmark` or `fmbench-harness-benchmark`.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import threading
+import tracemalloc
+import importlib.metadata
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import importlib.resources as pkg_resources
+from fmbench.utils import CustomTokenizer
+from fmbench.globals import PROMPT_TOKENS_PAYLOAD_KEY
+from fmbench.run_context import RunContext, set_run_context
+from fmbench.inference import get_inference, calculate_metrics, count_deferred_tokens, run_inferences
+from fmbench.scripts.fmbench_predictor import FMBenchPredictor, FMBenchPredictionResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY_LEVELS: List[int] = [1, 2, 4, 8, 16, 32, 64]
+DEFAULT_REQUESTS_PER_LEVEL: int = 2000
+DEFAULT_PROMPT_WORDS: int = 500
+DEFAULT_COMPLETION_WORDS: int = 100
+COMPONENT_ITERATIONS: int = 1000
+DEFAULT_RESULTS_FILE: str = "harness_benchmark_results.jsonl"
+# an increase in the per request overhead above this fraction is reported as a regression
+REGRESSION_THRESHOLD: float = 0.2
+
+
+class ZeroLatencyPredictor(FMBenchPredictor):
+    """Responds immediately, only does the client side work of a real predictor (json in and out)."""
+
+    def __init__(self, endpoint_name: str = "zero-latency", inference_spec: Dict | None = None):
+        self._endpoint_name: str = endpoint_name
+        completion_words: int = (inference_spec or {}).get("completion_words", DEFAULT_COMPLETION_WORDS)
+        self._response: bytes = json.dumps([dict(generated_text=" ".join(["token"] * completion_words))]).encode('utf-8')
+
+    def _respond(self, payload: Dict) -> FMBenchPredictionResponse:
+        st = time.perf_counter()
+        json.dumps(payload)
+        response_json = json.loads(self._response)[0]
+        return FMBenchPredictionResponse(response_json=response_json, latency=time.perf_counter() - st)
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        return self._respond(payload)
+
+    @property
+    def endpoint_name(self) -> str:
+        return self._endpoint_name
+
+
+class ZeroLatencyAsyncPredictor(ZeroLatencyPredictor):
+    """Zero latency predictor with the native async interface."""
+    supports_async: bool = True
+
+    async def get_prediction_async(self, payload: Dict) -> FMBenchPredictionResponse:
+        # yield to the event loop once, like a real request would
+        await asyncio.sleep(0)
+        return self._respond(payload)
+
+
+class _InFlightMemoryProbe:
+    """Holds requests until `concurrency` of them are in flight and then records the traced memory."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency: int = concurrency
+        self.traced_bytes: Optional[int] = None
+        self._barrier = threading.Barrier(concurrency, action=self._snapshot)
+        self._arrived: int = 0
+        self._released: Optional[asyncio.Event] = None
+
+    def _snapshot(self) -> None:
+        self.traced_bytes = tracemalloc.get_traced_memory()[0]
+
+    def wait(self) -> None:
+        self._barrier.wait()
+
+    async def wait_async(self) -> None:
+        if self._released is None:
+            self._released = asyncio.Event()
+        self._arrived += 1
+        if self._arrived == self.concurrency:
+            self._snapshot()
+            self._released.set()
+        await self._released.wait()
+
+
+class _ProbedPredictor(ZeroLatencyPredictor):
+    def __init__(self, probe: _InFlightMemoryProbe):
+        super().__init__()
+        self._probe = probe
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        self._probe.wait()
+        return self._respond(payload)
+
+
+class _ProbedAsyncPredictor(_ProbedPredictor):
+    supports_async: bool = True
+
+    async def get_prediction_async(self, payload: Dict) -> FMBenchPredictionResponse:
+        await self._probe.wait_async()
+        return self._respond(payload)
+
+
+def _create_payloads(n: int, prompt_words: int) -> List[Dict]:
+    # the prompt token count is precomputed in the payload files, as it is for real runs
+    prompt = " ".join(["word"] * prompt_words)
+    return [{'inputs': f"{i} {prompt}", PROMPT_TOKENS_PAYLOAD_KEY: prompt_words + 1,
+             'parameters': dict(max_new_tokens=DEFAULT_COMPLETION_WORDS)} for i in range(n)]
+
+
+def _split(payloads: List[Dict], concurrency: int) -> List[List[Dict]]:
+    return [payloads[i:i + concurrency] for i in range(0, len(payloads) - concurrency + 1, concurrency)]
+
+
+async def _drive(predictor: FMBenchPredictor, chunks: List[List[Dict]], concurrency: int, load_spec: Optional[Dict]) -> int:
+    experiment = dict(name="harness-benchmark", load_generator=load_spec)
+    num_responses: int = 0
+    async for responses, _ in run_inferences(predictor, chunks, experiment, concurrency, "harness-benchmark.jsonl"):
+        num_responses += len(responses)
+    return num_responses
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    st = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return round((time.perf_counter() - st) / iterations * 1e6, 2)
+
+
+def measure_components(prompt_words: int, iterations: int = COMPONENT_ITERATIONS) -> Dict[str, float]:
+    """Per request cost in microseconds of the individual pieces of work done on and after the request path."""
+    predictor = ZeroLatencyPredictor()
+    payloads = _create_payloads(iterations, prompt_words)
+    responses = [get_inference(predictor, p) for p in payloads]
+    chunk_size: int = 100
+    components = dict(serialize_payload_us=_per_call_us(lambda i: json.dumps(payloads[i]), iterations),
+                      get_inference_us=_per_call_us(lambda i: get_inference(predictor, payloads[i]), iterations))
+    # completions are unique in real runs so every one of them misses the token count cache
+    for i, r in enumerate(responses):
+        r['completion'] = f"{i} {r['completion']}"
+    st = time.perf_counter()
+    count_deferred_tokens(responses)
+    components['count_deferred_tokens_us'] = round((time.perf_counter() - st) / len(responses) * 1e6, 2)
+    chunks = _split(responses, chunk_size)
+    st = time.perf_counter()
+    for chunk in chunks:
+        calculate_metrics(chunk, chunk, 1.0, "harness-benchmark", chunk_size, "harness-benchmark.jsonl")
+    components['calculate_metrics_us'] = round((time.perf_counter() - st) / (len(chunks) * chunk_size) * 1e6, 2)
+    return components
+
+
+def measure_load(concurrency: int,
+                 use_async: bool,
+                 num_requests: int,
+                 prompt_words: int,
+                 load_spec: Optional[Dict] = None) -> Dict:
+    """Drives num_requests through the harness at the given concurrency against a zero latency predictor."""
+    predictor = ZeroLatencyAsyncPredictor() if use_async else ZeroLatencyPredictor()
+    chunks = _split(_create_payloads(num_requests, prompt_words), concurrency)
+    st = time.perf_counter()
+    n = asyncio.run(_drive(predictor, chunks, concurrency, load_spec))
+    elapsed = time.perf_counter() - st
+    return dict(concurrency=concurrency,
+                predictor="async" if use_async else "thread",
+                requests=n,
+                wall_time_seconds=round(elapsed, 3),
+                overhead_us_per_request=round(elapsed / n * 1e6, 2),
+                max_requests_per_second=round(n / elapsed, 1))
+
+
+def measure_memory_per_in_flight_request(concurrency: int, use_async: bool, prompt_words: int) -> int:
+    """Python heap held per request while `concurrency` requests are in flight at once, in bytes."""
+    probe = _InFlightMemoryProbe(concurrency)
+    predictor = _ProbedAsyncPredictor(probe) if use_async else _ProbedPredictor(probe)
+    chunks = _split(_create_payloads(concurrency, prompt_words), concurrency)
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        asyncio.run(_drive(predictor, chunks, concurrency, None))
+    finally:
+        tracemalloc.stop()
+    return int((probe.traced_bytes - baseline) / concurrency)
+
+
+def _fmbench_version() -> str:
+    try:
+        return importlib.metadata.version("fmbench")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def run_benchmark(concurrency_levels: List[int] = DEFAULT_CONCURRENCY_LEVELS,
+                  num_requests: int = DEFAULT_REQUESTS_PER_LEVEL,
+                  prompt_words: int = DEFAULT_PROMPT_WORDS,
+                  load_spec: Optional[Dict] = None) -> Dict:
+    load: List[Dict] = []
+    for concurrency in concurrency_levels:
+        for use_async in [False, True]:
+            result = measure_load(concurrency, use_async, num_requests, prompt_words, load_spec)
+            result['memory_bytes_per_in_flight_request'] = measure_memory_per_in_flight_request(concurrency, use_async, prompt_words)
+            load.append(result)
+    return dict(fmbench_version=_fmbench_version(),
+                timestamp=datetime.now(timezone.utc).isoformat(),
+                python_version=platform.python_version(),
+                platform=platform.platform(),
+                cpu_count=os.cpu_count(),
+                prompt_words=prompt_words,
+                load_spec=load_spec,
+                components=measure_components(prompt_words),
+                load=load)
+
+
+def find_regressions(results: Dict, previous: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Compares the per request overheads with those of a previous run."""
+    regressions: List[str] = []
+    for k, v in results['components'].items():
+        prev = previous.get('components', {}).get(k)
+        if prev and v > prev * (1 + threshold):
+            regressions.append(f"{k}: {prev} -> {v}")
+    previous_load = {(r['predictor'], r['concurrency']): r for r in previous.get('load', [])}
+    for r in results['load']:
+        prev = previous_load.get((r['predictor'], r['concurrency']))
+        if prev and r['overhead_us_per_request'] > prev['overhead_us_per_request'] * (1 + threshold):
+            regressions.append(f"overhead_us_per_request, predictor={r['predictor']}, concurrency={r['concurrency']}: "
+                               f"{prev['overhead_us_per_request']} -> {r['overhead_us_per_request']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the overhead of the FMBench harness with a zero latency predictor.')
+    parser.add_argument('--concurrency-levels', type=int, nargs='+', default=DEFAULT_CONCURRENCY_LEVELS)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS_PER_LEVEL, help='Requests per concurrency level')
+    parser.add_argument('--prompt-words', type=int, default=DEFAULT_PROMPT_WORDS)
+    parser.add_argument('--load-mode', type=str, default=None, help='Load generator mode, chunked by default')
+    parser.add_argument('--tokenizer-dir', type=str, default=str(Path(pkg_resources.files('fmbench'), 'tokenizer')))
+    parser.add_argument('--results-file', type=str, default=DEFAULT_RESULTS_FILE)
+    parser.add_argument('--log-level', type=str, default="INFO",
+                        help='Level for the harness logs, they are formatted (and discarded) as in a real run')
+    args = parser.parse_args()
+
+    # the per request logs are part of the overhead, format them as a real run would but do not print them
+    logging.basicConfig(level=args.log_level, handlers=[logging.StreamHandler(open(os.devnull, "w"))])
+    # no AWS access: the tokenizer is read from a local directory and no config is needed
+    set_run_context(RunContext(config={}, account_id="", role_arn="", tokenizer=CustomTokenizer(None, None, args.tokenizer_dir)))
+
+    load_spec = dict(mode=args.load_mode) if args.load_mode is not None else None
+    results = run_benchmark(args.concurrency_levels, args.requests, args.prompt_words, load_spec)
+    print(json.dumps(results, indent=2))
+
+    results_file = Path(args.results_file)
+    previous_runs = [json.loads(line) for line in results_file.read_text().splitlines() if line.strip()] if results_file.exists() else []
+    if previous_runs:
+        regressions = find_regressions(results, previous_runs[-1])
+        print(f"compared with the run of fmbench {previous_runs[-1]['fmbench_version']} at {previous_runs[-1]['timestamp']}: "
+              f"{len(regressions)} regression(s)")
+        for r in regressions:
+            print(f"  {r}")
+    with open(results_file, "a") as f:
+        f.write(json.dumps(results) + "\n")
+    print(f"results appended to {results_file}")
+
+
+if __name__ == "__main__":
+    main()
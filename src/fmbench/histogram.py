@@ -0,0 +1,113 @@
+"""
+Mergeable log-bucketed latency histograms.
+
+Every latency is counted in the bucket (gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a),
+so any percentile read from the histogram is within a relative error `a` of the exact value
+(1% by default). Histograms of different chunks are merged by adding the bucket counts, which
+makes it possible to compute the tail latencies of an experiment, payload file and concurrency
+level from the per chunk metrics without reading back every per inference row.
+
+Histograms are serialized to a compact json string so that they can be stored as a column of
+the per chunk metrics csv.
+"""
+import json
+import math
+import logging
+import pandas as pd
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELATIVE_ACCURACY: float = 0.01
+# latencies below this value (in seconds) are counted in the lowest bucket
+MIN_LATENCY_SECONDS: float = 1e-6
+LATENCY_PERCENTILES: List[float] = [50, 90, 99, 99.9]
+LATENCY_HISTOGRAM_COL: str = "latency_histogram"
+
+
+def percentile_col(percentile: float, prefix: str = "latency") -> str:
+    """Column name for a latency percentile, e.g. latency_p90 or latency_p99_9."""
+    return f"{prefix}_p{percentile:g}".replace(".", "_")
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram with a bounded relative error, mergeable by adding bucket counts."""
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, counts: Optional[Dict[int, int]] = None):
+        self.relative_accuracy: float = relative_accuracy
+        self._gamma: float = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma: float = math.log(self._gamma)
+        self.counts: Counter = Counter(counts if counts is not None else {})
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, value: Optional[float]) -> None:
+        # failed requests have no latency
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        self.counts[math.ceil(math.log(max(value, MIN_LATENCY_SECONDS)) / self._log_gamma)] += 1
+
+    def update(self, values: Iterable[Optional[float]]) -> "LatencyHistogram":
+        for v in values:
+            self.add(v)
+        return self
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"cannot merge histograms with relative accuracy {self.relative_accuracy} "
+                             f"and {other.relative_accuracy}")
+        self.counts.update(other.counts)
+        return self
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Nearest rank percentile (0-100), None for an empty histogram."""
+        total = self.count
+        if total == 0:
+            return None
+        rank = max(1, math.ceil(percentile / 100 * total))
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            if cumulative >= rank:
+                break
+        # the value in the middle of the bucket in terms of relative error
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps(dict(a=self.relative_accuracy, c={str(k): v for k, v in sorted(self.counts.items())}),
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, s: str) -> "LatencyHistogram":
+        d = json.loads(s)
+        return cls(d['a'], {int(k): v for k, v in d['c'].items()})
+
+
+def merge_histograms(histograms: Iterable[Optional[str]]) -> Optional[LatencyHistogram]:
+    """Merges serialized histograms, missing ones (e.g. from runs before histograms were recorded) are skipped."""
+    merged: Optional[LatencyHistogram] = None
+    for h in histograms:
+        if not isinstance(h, str):
+            continue
+        hist = LatencyHistogram.from_json(h)
+        merged = hist if merged is None else merged.merge(hist)
+    return merged
+
+
+def latency_percentiles(df: pd.DataFrame,
+                        group_by_cols: List[str],
+                        percentiles: List[float] = LATENCY_PERCENTILES,
+                        histogram_col: str = LATENCY_HISTOGRAM_COL) -> pd.DataFrame:
+    """Latency percentiles per group from the histograms of the chunks in that group."""
+    rows: List[Dict] = []
+    for keys, df_group in df.groupby(group_by_cols):
+        merged = merge_histograms(df_group[histogram_col])
+        row = dict(zip(group_by_cols, keys if isinstance(keys, tuple) else (keys,)))
+        for p in percentiles:
+            row[percentile_col(p)] = merged.percentile(p) if merged is not None else None
+        rows.append(row)
+    logger.info(f"latency_percentiles, computed {percentiles} percentiles for {len(rows)} groups")
+    return pd.DataFrame(rows, columns=group_by_cols + [percentile_col(p) for p in percentiles])
@@ -0,0 +1,343 @@
+"""
+Sending the inference requests and calculating the metrics, used by 3_run_inference.ipynb.
+
+These functions were part of the notebook, they live in a module so that the overhead of the
+harness itself can be benchmarked (see fmbench/harness_benchmark.py).
+"""
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+from fmbench.utils import count_tokens_batch
+from fmbench.histogram import LatencyHistogram
+from fmbench.early_stopping import EarlyStopping, STOP_REASON
+from fmbench.globals import PROMPT_TOKENS_PAYLOAD_KEY, PAYLOAD_INDEX_KEY
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+from fmbench.load_generator import generate_load, get_load_mode, max_in_flight
+
+logger = logging.getLogger(__name__)
+
+def safe_sum(l: List) -> Union[int, float]:
+    return sum(filter(None, l))
+
+def safe_div(n: Union[int, float], d: Union[int, float]) -> Optional[Union[int, float]]:
+    return n/d if d else None
+
+## Represents the function to calculate all of the metrics at the time of inference
+def calculate_metrics(responses, chunk, elapsed_async, experiment_name, concurrency, payload_file) -> Dict:
+    
+    ## calculate errors based on the completion status of the inference prompt
+    errors = [r for r in responses if r['completion'] is None]
+    
+    ## Calculate the difference as the successes 
+    successes = len(chunk) - len(errors)
+    
+    ## Count all of the prompts token count during inference
+    all_prompts_token_count = safe_sum([r['prompt_tokens'] for r in responses])
+    prompt_token_throughput = round(all_prompts_token_count / elapsed_async, 2)
+    prompt_token_count_mean = safe_div(all_prompts_token_count, successes)
+    all_completions_token_count = safe_sum([r['completion_tokens'] for r in responses])
+    completion_token_throughput = round(all_completions_token_count / elapsed_async, 2)
+    completion_token_count_mean = safe_div(all_completions_token_count, successes)
+    transactions_per_second = round(successes / elapsed_async, 2)
+    transactions_per_minute = int(transactions_per_second * 60)
+    
+    ## calculate the latency mean utilizing the safe_sum function defined above
+    latency_mean = safe_div(safe_sum([r['latency'] for r in responses]), successes)
+    ## mergeable histogram of the latencies, the analysis step merges these to compute the tail latencies
+    latency_histogram = LatencyHistogram().update([r['latency'] for r in responses]).to_json()
+
+    ## streaming metrics are only recorded by streaming predictors, average over the responses that have them
+    mean_of = lambda k: safe_div(safe_sum([r.get(k) for r in responses]), len([r for r in responses if r.get(k) is not None]))
+    time_to_first_token_mean = mean_of('time_to_first_token')
+    inter_token_latency_mean = mean_of('inter_token_latency_mean')
+    decode_tokens_per_second_mean = mean_of('decode_tokens_per_second')
+    
+    ## Function returns all these values at the time of the invocations
+    return {
+        'experiment_name': experiment_name,
+        'concurrency': concurrency,
+        'payload_file': payload_file,
+        'errors': errors,
+        'successes': successes,
+        'error_rate': len(errors)/len(chunk),
+        'all_prompts_token_count': all_prompts_token_count,
+        'prompt_token_count_mean': prompt_token_count_mean,
+        'prompt_token_throughput': prompt_token_throughput,
+        'all_completions_token_count': all_completions_token_count,
+        'completion_token_count_mean': completion_token_count_mean,
+        'completion_token_throughput': completion_token_throughput,
+        'transactions': len(chunk),
+        'transactions_per_second': transactions_per_second,
+        'transactions_per_minute': transactions_per_minute,
+        'latency_mean': latency_mean,
+        'latency_histogram': latency_histogram,
+        'time_to_first_token_mean': time_to_first_token_mean,
+        'inter_token_latency_mean': inter_token_latency_mean,
+        'decode_tokens_per_second_mean': decode_tokens_per_second_mean
+    }
+
+def set_metrics(endpoint_name=None,
+                    prompt=None,
+                    inference_params=None,
+                    completion=None,
+                    prompt_tokens=None,
+                    completion_tokens=None,
+                    latency=None,
+                    time_to_first_token=None,
+                    inter_token_latency_mean=None,
+                    inter_token_latency_p50=None,
+                    inter_token_latency_p90=None,
+                    inter_token_latency_p99=None,
+                    decode_tokens_per_second=None) -> Dict:
+    return dict(endpoint_name=endpoint_name,                
+                prompt=prompt,
+                **inference_params,
+                completion=completion,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                latency=latency,
+                time_to_first_token=time_to_first_token,
+                inter_token_latency_mean=inter_token_latency_mean,
+                inter_token_latency_p50=inter_token_latency_p50,
+                inter_token_latency_p90=inter_token_latency_p90,
+                inter_token_latency_p99=inter_token_latency_p99,
+                decode_tokens_per_second=decode_tokens_per_second)
+
+## No tokenization happens on the request path: the prompt token count is precomputed in 1_generate_data
+## and carried in the payload (it is not sent to the endpoint), the completion tokens are counted by
+## count_deferred_tokens once the load of their chunk is over. The payload index is not sent to the endpoint either.
+def split_prompt_tokens(payload: Dict) -> Tuple[Optional[int], Dict]:
+    return payload.get(PROMPT_TOKENS_PAYLOAD_KEY), {k: v for k, v in payload.items()
+                                                     if k not in (PROMPT_TOKENS_PAYLOAD_KEY, PAYLOAD_INDEX_KEY)}
+
+def get_inference(predictor, payload) -> Dict:
+    
+    prompt_tokens, payload = split_prompt_tokens(payload)
+    try:
+        logger.info(f"get_inference, endpoint={predictor.endpoint_name}, prompt_tokens={prompt_tokens}")
+
+        # get inference     
+        resp = predictor.get_prediction(payload)        
+        response = inference_response(predictor, payload, prompt_tokens, resp)
+    except Exception as e:
+        response = failed_inference_response(predictor, payload, prompt_tokens, e)
+
+    return response
+
+## Same as get_inference for predictors that provide get_prediction_async, the request is
+## awaited on the event loop instead of occupying a thread for its whole duration
+async def get_inference_async(predictor, payload) -> Dict:
+    
+    prompt_tokens, payload = split_prompt_tokens(payload)
+    try:
+        logger.info(f"get_inference_async, endpoint={predictor.endpoint_name}, prompt_tokens={prompt_tokens}")
+        resp = await predictor.get_prediction_async(payload)
+        response = inference_response(predictor, payload, prompt_tokens, resp)
+    except Exception as e:
+        response = failed_inference_response(predictor, payload, prompt_tokens, e)
+
+    return response
+
+def inference_response(predictor, payload: Dict, prompt_tokens: Optional[int], resp: Dict) -> Dict:
+    completion_tokens = None
+    response_json: Dict = resp['response_json']
+    latency: float = resp['latency']
+
+    completion = response_json.get("generated_text", "")
+    logger.debug(f"get_inference, prompt={payload['inputs']}, completion={completion}")
+
+    # Set metrics and logging for both cases, the streaming metrics are only
+    # available with streaming predictors and are None otherwise
+    response = set_metrics(predictor.endpoint_name,
+                           payload['inputs'],
+                           payload['parameters'],
+                           completion,
+                           prompt_tokens,
+                           completion_tokens,
+                           latency,
+                           resp.get('time_to_first_token'),
+                           resp.get('inter_token_latency_mean'),
+                           resp.get('inter_token_latency_p50'),
+                           resp.get('inter_token_latency_p90'),
+                           resp.get('inter_token_latency_p99'),
+                           resp.get('decode_tokens_per_second'))
+    # logger.info(f"get_inference, done, endpoint={predictor.endpoint_name}, response={json.dumps(response, indent=2)}, latency={latency:.2f}")
+    logger.info(f"get_inference, done, endpoint={predictor.endpoint_name}, latency={latency:.4f}")
+    return response
+
+def failed_inference_response(predictor, payload: Dict, prompt_tokens: Optional[int], e: Exception) -> Dict:
+    print(f"error occurred with {predictor.endpoint_name}, exception={str(e)}")
+    return set_metrics(predictor.endpoint_name,
+                       payload['inputs'],
+                       payload['parameters'],
+                       None,
+                       prompt_tokens,
+                       None,
+                       None)
+
+## Post processing stage that runs once the load of a chunk is over: counts the completion tokens (and the prompt
+## tokens for payload files that do not carry them) in batches so that tokenization does not distort the timings
+def count_deferred_tokens(responses: List[Dict]) -> None:
+    for tokens_field, text_field in [('prompt_tokens', 'prompt'), ('completion_tokens', 'completion')]:
+        pending = [r for r in responses if r[tokens_field] is None and r[text_field] is not None]
+        counts = count_tokens_batch([r[text_field] for r in pending])
+        for r, c in zip(pending, counts):
+            r[tokens_field] = c
+
+## Invokes the model without blocking the event loop: predictors with a native async interface are awaited directly,
+## others run the blocking get_inference in a thread. The default executor of the loop has min(32, cpu+4) threads which
+## would silently cap the number of requests in flight, so callers pass an executor sized for the concurrency level.
+def supports_async(predictor) -> bool:
+    # predictors from custom inference scripts may not derive from FMBenchPredictor
+    return getattr(predictor, 'supports_async', False) is True
+
+async def async_get_inference(predictor, payload: Dict, executor: Optional[ThreadPoolExecutor] = None) -> Dict:
+    if supports_async(predictor):
+        return await get_inference_async(predictor, payload)
+    return await asyncio.get_running_loop().run_in_executor(executor, get_inference, predictor, payload)
+
+## Gathers all of the tasks and sets of the concurrent calling of the asychronous invocations
+async def async_get_all_inferences(predictor, payload_list: List, executor: Optional[ThreadPoolExecutor] = None) -> List:
+    return await asyncio.gather(*[async_get_inference(predictor, payload, executor) for payload in payload_list])
+
+## Warm-up: the first requests to a new endpoint include cold start effects (e.g. CUDA graph capture, KV cache
+## allocation), an experiment can send some requests before the measured ones with an optional `warmup` section:
+##   warmup:
+##     requests: 10                  # number of warm-up requests, or
+##     duration_seconds: 30          # keep sending warm-up requests for this long (whichever limit comes first)
+##     per_concurrency_level: false  # warm up before every concurrency level instead of only before the first
+## warm-up responses are tagged with warmup=True in the per-inference records and left out of the chunk metrics
+DEFAULT_WARMUP_REQUESTS: int = 10
+
+def should_warm_up(experiment: Dict, concurrency: int, warmed_up_levels: Set) -> bool:
+    warmup_spec: Optional[Dict] = experiment.get('warmup')
+    if warmup_spec is None:
+        return False
+    if warmup_spec.get('per_concurrency_level', False):
+        return concurrency not in warmed_up_levels
+    return len(warmed_up_levels) == 0
+
+async def warm_up(predictor, payloads: List[Dict], warmup_spec: Dict, concurrency: int, executor: Optional[ThreadPoolExecutor] = None) -> List[Dict]:
+    duration_seconds: Optional[float] = warmup_spec.get('duration_seconds')
+    num_requests: Optional[int] = warmup_spec.get('requests', DEFAULT_WARMUP_REQUESTS if duration_seconds is None else None)
+    batch_size: int = max(1, int(concurrency))
+    responses: List[Dict] = []
+    st = time.perf_counter()
+    while ((num_requests is None or len(responses) < num_requests)
+           and (duration_seconds is None or time.perf_counter() - st < duration_seconds)):
+        n = batch_size if num_requests is None else min(batch_size, num_requests - len(responses))
+        batch = [payloads[(len(responses) + i) % len(payloads)] for i in range(n)]
+        responses.extend(await async_get_all_inferences(predictor, batch, executor))
+    for r in responses:
+        r['warmup'] = True
+    logger.info(f"warm_up, endpoint={predictor.endpoint_name}, concurrency={concurrency}, sent {len(responses)} warm-up requests "
+                f"in {time.perf_counter() - st:.2f} seconds")
+    return responses
+
+## This function runs the asynchronous function series above together for different experiments and concurrency levels.
+## The payloads are sent as per the load generator mode configured for the experiment (chunked by default) and
+## the responses and metrics are returned for every chunk of `concurrency` completed requests as soon as the chunk
+## completes, so that the caller can write (and checkpoint) them while the next chunks are being sent. The load
+## runs in its own task and the tokens of a completed chunk are counted in a worker thread, so neither the token
+## counting nor the caller delays the requests. With warmup=True the warm-up requests are sent first and their
+## responses are returned with empty metrics. The stop reason is only known once the load is over, it is set in
+## the metrics of the last chunk (None in the others) and sample_count is the number of requests up to the chunk.
+## A resumed combination passes the latencies of its requests that completed before the run was interrupted
+## (None for a failed request), the early stopping decision and sample_count continue from them.
+async def run_inferences(predictor,
+                         split_payload: List,
+                         experiment: Dict,
+                         concurrency: int,
+                         payload_file: str,
+                         warmup: bool = False,
+                         completed_latencies: Optional[List[Optional[float]]] = None) -> AsyncIterator[Tuple[List, Dict]]:
+    load_spec: Optional[Dict] = experiment.get('load_generator')
+    load_mode = get_load_mode(load_spec)
+    logger.info(f"processing {len(split_payload)} chunks with concurrency={concurrency}, load_mode={load_mode.value}, "
+                f"async_predictor={supports_async(predictor)}")
+    executor = None
+    if not supports_async(predictor):
+        executor = ThreadPoolExecutor(max_workers=max_in_flight(load_spec, concurrency), thread_name_prefix="inference")
+    infer = lambda payload: async_get_inference(predictor, payload, executor)
+
+    def failed_response(payload: Dict, e: Exception) -> Dict:
+        ## get_inference already turns the errors of the predictor into failed responses, this covers the rest
+        prompt_tokens, payload = split_prompt_tokens(payload)
+        return failed_inference_response(predictor, payload, prompt_tokens, e)
+
+    ## optionally stop sending requests once the latency estimate has converged
+    early_stopping = EarlyStopping(experiment['early_stopping']) if experiment.get('early_stopping') is not None else None
+    stop_reason: STOP_REASON = STOP_REASON.PAYLOADS_EXHAUSTED
+    if early_stopping is not None and completed_latencies:
+        # the combination may have reached its stop decision just before the run was interrupted
+        if (reason := early_stopping.restore(completed_latencies)) is not None:
+            stop_reason = reason
+            split_payload = []
+    ## completed chunks, None once the load is over
+    completed: asyncio.Queue = asyncio.Queue()
+
+    async def _send_load() -> None:
+        nonlocal stop_reason
+        try:
+            async with aclosing(generate_load(infer, split_payload, concurrency, load_spec, failed_response)) as load:
+                async for chunk, responses, elapsed_async in load:
+                    completed.put_nowait((chunk, responses, elapsed_async))
+                    if early_stopping is not None and (reason := early_stopping.update(responses)) is not None:
+                        stop_reason = reason
+                        break
+        finally:
+            completed.put_nowait(None)
+
+    def _tag(responses: List[Dict], warmup: bool, chunk: Optional[List[Dict]] = None) -> None:
+        # Add more metadata about this experiment
+        for r in responses:
+            r['experiment_name'] = experiment['name']
+            r['concurrency'] = concurrency
+            r['warmup'] = warmup
+        # the responses of a chunk are in the order of its payloads
+        if chunk is not None:
+            for r, payload in zip(responses, chunk):
+                r['payload_index'] = payload.get(PAYLOAD_INDEX_KEY)
+
+    load_task: Optional[asyncio.Task] = None
+    try:
+        if warmup and split_payload:
+            warmup_responses = await warm_up(predictor, [p for chunk in split_payload for p in chunk],
+                                             experiment['warmup'], concurrency, executor)
+            await asyncio.to_thread(count_deferred_tokens, warmup_responses)
+            _tag(warmup_responses, True)
+            yield warmup_responses, {}
+        load_task = asyncio.create_task(_send_load())
+        sample_count: int = len(completed_latencies) if completed_latencies else 0
+        # the last chunk is held back until the next one completes, its metrics carry the stop reason
+        last: Optional[Tuple[List, Dict]] = None
+        while (chunk_result := await completed.get()) is not None:
+            chunk, responses, elapsed_async = chunk_result
+            # the chunk's load is over, count the tokens that were not counted on the request path
+            await asyncio.to_thread(count_deferred_tokens, responses)
+            _tag(responses, False, chunk)
+            sample_count += len(responses)
+            metrics = calculate_metrics(responses, chunk, elapsed_async, experiment['name'], concurrency, payload_file)
+            metrics['load_mode'] = load_mode.value
+            metrics['stop_reason'] = None
+            metrics['sample_count'] = sample_count
+            if last is not None:
+                yield last
+            last = (responses, metrics)
+        # raises the exception of the load, if any
+        await load_task
+        if stop_reason != STOP_REASON.PAYLOADS_EXHAUSTED:
+            logger.info(f"stopped early with concurrency={concurrency}, payload_file={payload_file}, reason={stop_reason.value}, "
+                        f"sample_count={sample_count} of {sum(len(c) for c in split_payload)} payloads")
+        if last is not None:
+            last[1]['stop_reason'] = stop_reason.value
+            yield last
+    finally:
+        # the caller stopped consuming the results, do not leave requests running in the background
+        if load_task is not None and not load_task.done():
+            load_task.cancel()
+            await asyncio.gather(load_task, return_exceptions=True)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
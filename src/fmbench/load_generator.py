@@ -0,0 +1,236 @@
+"""
+Load generators used by 3_run_inference.ipynb to send requests to an endpoint.
+
+The mode is selected per experiment through the optional `load_generator` section
+in the config file, for example:
+
+    load_generator:
+      mode: sliding-window     # chunked (default) | sliding-window | open-loop
+      arrival_process: poisson # open-loop only: poisson (default) | constant
+      seed: 42                 # open-loop only, makes poisson arrivals repeatable
+      max_in_flight: 200       # open-loop only, threads for predictors without an async interface
+
+1. chunked: the original behavior, a chunk of `concurrency` payloads is sent at once
+   and the next chunk starts only after every request in the current one completes.
+2. sliding-window: `concurrency` requests are kept in flight at all times, a new
+   request is sent as soon as any in-flight request completes.
+3. open-loop: requests arrive at a target rate irrespective of completions, the
+   values in `concurrency_levels` are interpreted as the arrival rate in
+   requests per second.
+
+Every generator yields (chunk, responses, elapsed) tuples so that the per-chunk
+metrics can still be computed with calculate_metrics. For the sliding-window and
+open-loop modes a chunk is a group of `concurrency` consecutive completions and the
+elapsed time is measured between the completions that close successive chunks.
+A request that raises is completed with a failed response, so every payload sent
+has a response in every mode.
+"""
+import math
+import time
+import random
+import asyncio
+import logging
+from enum import Enum
+from contextlib import aclosing
+from typing import Dict, List, Tuple, Callable, Optional, Awaitable, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# if the open loop scheduler falls behind the arrival schedule by more than this
+# many seconds then the client is the bottleneck and not the endpoint
+OPEN_LOOP_LAG_WARNING_THRESHOLD_SECONDS: float = 0.1
+# in open loop mode the number of requests in flight is the arrival rate times the latency,
+# used to size the thread pool for predictors that only have a blocking interface
+OPEN_LOOP_DEFAULT_MAX_LATENCY_SECONDS: float = 10
+
+
+class LOAD_MODE(str, Enum):
+    CHUNKED = 'chunked'
+    SLIDING_WINDOW = 'sliding-window'
+    OPEN_LOOP = 'open-loop'
+
+
+class ARRIVAL_PROCESS(str, Enum):
+    POISSON = 'poisson'
+    CONSTANT = 'constant'
+
+
+InferFn = Callable[[Dict], Awaitable[Dict]]
+FailedResponseFn = Callable[[Dict, Exception], Dict]
+ChunkResult = Tuple[List[Dict], List[Dict], float]
+
+
+def _default_failed_response(payload: Dict, e: Exception) -> Dict:
+    return dict(error=str(e))
+
+
+def _with_failed_responses(infer: InferFn, failed_response: FailedResponseFn) -> InferFn:
+    """Completes a request that raises with a failed response instead of the exception."""
+    async def _infer(payload: Dict) -> Dict:
+        try:
+            return await infer(payload)
+        except Exception as e:
+            logger.error(f"_with_failed_responses, request failed, exception={e}")
+            return failed_response(payload, e)
+    return _infer
+
+
+def get_load_mode(load_spec: Optional[Dict]) -> LOAD_MODE:
+    """Returns the load mode from the `load_generator` section of an experiment, defaults to chunked."""
+    if load_spec is None:
+        return LOAD_MODE.CHUNKED
+    return LOAD_MODE(load_spec.get('mode', LOAD_MODE.CHUNKED))
+
+
+def max_in_flight(load_spec: Optional[Dict], concurrency: int) -> int:
+    """Upper bound on the number of requests that the load generator keeps in flight at once."""
+    if get_load_mode(load_spec) != LOAD_MODE.OPEN_LOOP:
+        return max(1, int(concurrency))
+    return int(load_spec.get('max_in_flight', math.ceil(concurrency * OPEN_LOOP_DEFAULT_MAX_LATENCY_SECONDS)))
+
+
+async def _run_chunked(infer: InferFn, chunks: List[List[Dict]]) -> AsyncIterator[ChunkResult]:
+    for chunk in chunks:
+        s = time.perf_counter()
+        responses = await asyncio.gather(*[infer(payload) for payload in chunk])
+        yield chunk, list(responses), time.perf_counter() - s
+
+
+async def _run_sliding_window(infer: InferFn,
+                              payloads: List[Dict],
+                              concurrency: int) -> AsyncIterator[ChunkResult]:
+
+    async def _send(payload: Dict) -> Tuple[Dict, Dict]:
+        return payload, await infer(payload)
+
+    payload_iter = iter(payloads)
+    in_flight = set()
+
+    def _fill_window() -> None:
+        while len(in_flight) < concurrency:
+            payload = next(payload_iter, None)
+            if payload is None:
+                break
+            in_flight.add(asyncio.create_task(_send(payload)))
+
+    completed_payloads: List[Dict] = []
+    completed_responses: List[Dict] = []
+    window_start = time.perf_counter()
+    _fill_window()
+    try:
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            now = time.perf_counter()
+            for task in done:
+                in_flight.remove(task)
+                payload, response = task.result()
+                completed_payloads.append(payload)
+                completed_responses.append(response)
+            # keep the window full before handing the results over to the caller
+            _fill_window()
+            while len(completed_responses) >= concurrency:
+                chunk, completed_payloads = completed_payloads[:concurrency], completed_payloads[concurrency:]
+                responses, completed_responses = completed_responses[:concurrency], completed_responses[concurrency:]
+                yield chunk, responses, now - window_start
+                window_start = now
+    finally:
+        # the caller stopped early (e.g. early stopping), do not leave requests running in the background
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+    if completed_responses:
+        yield completed_payloads, completed_responses, time.perf_counter() - window_start
+
+
+async def _run_open_loop(infer: InferFn,
+                         payloads: List[Dict],
+                         requests_per_second: float,
+                         chunk_size: int,
+                         arrival_process: ARRIVAL_PROCESS,
+                         seed: Optional[int]) -> AsyncIterator[ChunkResult]:
+    rng = random.Random(seed)
+    mean_interarrival: float = 1 / requests_per_second
+    completions: asyncio.Queue = asyncio.Queue()
+    in_flight = set()
+
+    async def _send(payload: Dict) -> None:
+        response = await infer(payload)
+        completions.put_nowait((payload, response))
+
+    async def _produce() -> None:
+        max_lag: float = 0
+        next_arrival = time.perf_counter()
+        for payload in payloads:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+            task = asyncio.create_task(_send(payload))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            if arrival_process == ARRIVAL_PROCESS.POISSON:
+                next_arrival += rng.expovariate(requests_per_second)
+            else:
+                next_arrival += mean_interarrival
+        if max_lag > OPEN_LOOP_LAG_WARNING_THRESHOLD_SECONDS:
+            logger.warning(f"_run_open_loop, requests were sent up to {max_lag:.3f} seconds behind schedule "
+                           f"for requests_per_second={requests_per_second}, the client could not keep up with the arrival rate")
+
+    producer = asyncio.create_task(_produce())
+    completed_payloads: List[Dict] = []
+    completed_responses: List[Dict] = []
+    window_start = time.perf_counter()
+    try:
+        for _ in range(len(payloads)):
+            payload, response = await completions.get()
+            completed_payloads.append(payload)
+            completed_responses.append(response)
+            if len(completed_responses) == chunk_size:
+                now = time.perf_counter()
+                yield completed_payloads, completed_responses, now - window_start
+                completed_payloads, completed_responses = [], []
+                window_start = now
+        await producer
+    finally:
+        # the caller stopped early (e.g. early stopping), stop sending and cancel the requests in flight
+        producer.cancel()
+        for task in list(in_flight):
+            task.cancel()
+        await asyncio.gather(producer, *in_flight, return_exceptions=True)
+
+    if completed_responses:
+        yield completed_payloads, completed_responses, time.perf_counter() - window_start
+
+
+async def generate_load(infer: InferFn,
+                        chunks: List[List[Dict]],
+                        concurrency: int,
+                        load_spec: Optional[Dict] = None,
+                        failed_response: FailedResponseFn = _default_failed_response) -> AsyncIterator[ChunkResult]:
+    """
+    Sends all the payloads in `chunks` using the mode configured in `load_spec` and
+    yields a (chunk, responses, elapsed) tuple for every group of `concurrency` completions.
+    The response of a request that raises is failed_response(payload, exception).
+    """
+    mode = get_load_mode(load_spec)
+    infer = _with_failed_responses(infer, failed_response)
+    logger.info(f"generate_load, mode={mode.value}, concurrency={concurrency}, chunks={len(chunks)}")
+    if mode == LOAD_MODE.CHUNKED:
+        generator = _run_chunked(infer, chunks)
+    else:
+        payloads: List[Dict] = [payload for chunk in chunks for payload in chunk]
+        if mode == LOAD_MODE.SLIDING_WINDOW:
+            generator = _run_sliding_window(infer, payloads, concurrency)
+        else:
+            arrival_process = ARRIVAL_PROCESS(load_spec.get('arrival_process', ARRIVAL_PROCESS.POISSON))
+            generator = _run_open_loop(infer,
+                                       payloads,
+                                       requests_per_second=float(concurrency),
+                                       chunk_size=max(1, int(concurrency)),
+                                       arrival_process=arrival_process,
+                                       seed=load_spec.get('seed'))
+    async with aclosing(generator):
+        async for chunk_result in generator:
+            yield chunk_result
@@ -13,6 +13,7 @@ from typing import Dict
 from pathlib import Path
 from datetime import datetime
 from nbformat import NotebookNode
+from fmbench.run_context import RUN_ID_ENV_VAR, RESUME_ENV_VAR, RUN_ID_FORMAT, new_run_id
 
 # Setup logging
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
@@ -65,7 +66,7 @@ def output_handler(cell: NotebookNode, _):
                 print(output.text, end='')
 
 
-def run_notebooks(config_file: str) -> None:
+def run_notebooks(config_file: str, in_process: bool = False) -> None:
     # Assume `read_config` function is defined elsewhere to load the config
     config = read_config(config_file)
 
@@ -76,6 +77,21 @@ def run_notebooks(config_file: str) -> None:
     if not output_directory.exists():
         output_directory.mkdir()
 
+    if in_process is True:
+        # run all the steps in this process, sharing the imports, config and in-memory state between them,
+        # the step functions and their dependencies are only imported in this mode
+        from fmbench.pipeline import run_in_process
+        steps = [step for step, execute in config['run_steps'].items() if execute]
+        logger.info(f"running steps {steps} in process")
+        try:
+            stage_stats = run_in_process(steps, output_directory)
+        except Exception as e:
+            logging.error(f"Failed to execute the steps in process: {str(e)}")
+            sys.exit(1)
+        logger.info(f"stage wall times and peak memory: {json.dumps(stage_stats, indent=2)}")
+        logger.info(f"FMBench has completed the benchmarking process. Check S3 bucket \"{config['aws']['bucket']}\" for results")
+        return
+
     for step, execute in config['run_steps'].items():
         if execute:
             notebook_path = current_directory / step
@@ -116,8 +132,17 @@ def run_notebooks(config_file: str) -> None:
 def main():
     parser = argparse.ArgumentParser(description='Run FMBench with a specified config file.')
     parser.add_argument('--config-file', type=str, help='The S3 URI of your Config File', required=True)
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run all the steps in this process instead of executing each notebook in its own kernel')
+    parser.add_argument('--resume', type=str, metavar='RUN_ID', default=None,
+                        help='Continue an interrupted run from its progress journal, in the same metrics directory')
     args = parser.parse_args()
     print(f"{args} = args")
+    if args.resume is not None:
+        try:
+            datetime.strptime(args.resume, RUN_ID_FORMAT)
+        except ValueError:
+            parser.error(f"--resume expects a run id such as {new_run_id()}, got {args.resume}")
 
     # Set the environment variable based on the parsed argument
     os.environ["CONFIG_FILE_FMBENCH"] = args.config_file
@@ -126,8 +151,14 @@ def main():
     # set env var to indicate that fmbench is being run from main and not interactively via a notebook
     os.environ["INTERACTIVE_MODE_SET"] = "no"
 
+    # every notebook of the run uses the same run id, a resumed run continues the run with the given id
+    run_id = args.resume if args.resume is not None else new_run_id()
+    os.environ[RUN_ID_ENV_VAR] = run_id
+    os.environ[RESUME_ENV_VAR] = "yes" if args.resume is not None else "no"
+    logger.info(f"run_id={run_id}, resume={args.resume is not None}")
+
     # Proceed with the rest of your script's logic, passing the config file as needed
-    run_notebooks(args.config_file)    
+    run_notebooks(args.config_file, args.in_process)
 
 if __name__ == "__main__":
     main()
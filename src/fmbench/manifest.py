@@ -0,0 +1,93 @@
+"""
+Manifest of the artifacts created by the data preparation step.
+
+For every artifact (the payload files, the all prompts file and the prompt store) the manifest
+records a content hash of each of its inputs: the ETags of the source files, the prompt template,
+the tokenizer files, the filter definition and the inference parameters. On the next run an
+artifact whose inputs have not changed (and that still exists in S3) is reused instead of being
+created again, and the inputs that did change are logged for the artifacts that are rebuilt.
+The manifest is stored as a JSON file next to the payload files.
+"""
+import json
+import hashlib
+import logging
+import posixpath
+from typing import Dict, List, Optional
+from fmbench.aws_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FNAME: str = "manifest.json"
+# bumped when the format of the artifacts changes so that artifacts from older versions are rebuilt
+MANIFEST_VERSION: int = 1
+
+
+def content_hash(obj) -> str:
+    """sha256 of a string, or of the canonical JSON of any other JSON serializable object."""
+    data = obj if isinstance(obj, str) else json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def source_file_etags(bucket: str, keys: List[str]) -> Dict[str, str]:
+    """ETag of every source file, it changes whenever the content of the file changes."""
+    s3_client = get_client('s3')
+    return {key: s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"') for key in keys}
+
+
+class Manifest:
+    """Input hashes, location and statistics of every artifact under a prefix."""
+
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket: str = bucket
+        self.key: str = posixpath.join(prefix, MANIFEST_FNAME)
+        self._s3_client = get_client('s3')
+        self.artifacts: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            manifest = json.loads(self._s3_client.get_object(Bucket=self.bucket, Key=self.key)['Body'].read())
+        except self._s3_client.exceptions.NoSuchKey:
+            logger.info(f"Manifest, no manifest at s3://{self.bucket}/{self.key}, every artifact is created")
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            logger.info(f"Manifest, manifest version={manifest.get('version')} differs from {MANIFEST_VERSION}, "
+                        f"every artifact is created")
+            return {}
+        return manifest['artifacts']
+
+    def _exists(self, path: str) -> bool:
+        bucket, key = path.replace("s3://", "").split("/", 1)
+        try:
+            self._s3_client.head_object(Bucket=bucket, Key=key)
+            return True
+        except self._s3_client.exceptions.ClientError:
+            return False
+
+    def changed_inputs(self, artifact: str, inputs: Dict[str, str]) -> Optional[List[str]]:
+        """Names of the inputs that changed since the artifact was created, None if it has to be created anyway."""
+        entry = self.artifacts.get(artifact)
+        # an artifact without a path is a payload file that no prompt matched, nothing to check in S3
+        if entry is None or (entry['path'] is not None and not self._exists(entry['path'])):
+            return None
+        return sorted(k for k in inputs.keys() | entry['inputs'].keys() if inputs.get(k) != entry['inputs'].get(k))
+
+    def is_up_to_date(self, artifact: str, inputs: Dict[str, str]) -> bool:
+        changed = self.changed_inputs(artifact, inputs)
+        if changed is None:
+            logger.info(f"is_up_to_date, artifact={artifact} does not exist, it is created")
+            return False
+        if changed:
+            logger.info(f"is_up_to_date, artifact={artifact} is rebuilt, changed inputs={changed}")
+            return False
+        return True
+
+    def get(self, artifact: str) -> Dict:
+        return self.artifacts[artifact]
+
+    def record(self, artifact: str, inputs: Dict[str, str], path: Optional[str], stats: Optional[Dict] = None) -> None:
+        self.artifacts[artifact] = dict(inputs=inputs, path=path, stats=stats)
+
+    def save(self) -> str:
+        self._s3_client.put_object(Bucket=self.bucket, Key=self.key,
+                                   Body=json.dumps(dict(version=MANIFEST_VERSION, artifacts=self.artifacts), indent=2))
+        return f"s3://{self.bucket}/{self.key}"
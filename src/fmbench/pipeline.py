@@ -0,0 +1,129 @@
+"""
+In-process runner for the FMBench steps.
+
+This is an alternative to executing every step notebook in its own papermill kernel. The step
+functions that the notebooks call (see fmbench.steps) run one after the other in the current
+process with a single PipelineContext, so the heavy imports, the config, the run context (account
+identity, paths, tokenizer) and the endpoint list and DataFrames created by one step are reused by
+the next one instead of being reloaded. Each step reports its own wall time and peak resident memory.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import logging
+import resource
+import importlib
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# how often the resident memory is sampled while a step runs
+RSS_SAMPLE_INTERVAL_SECONDS: float = 0.1
+PIPELINE_STAGES_FNAME: str = "pipeline_stages_{timestamp}.json"
+
+# the function in fmbench.steps that each step notebook calls
+STEP_FUNCTIONS: Dict[str, str] = {
+    "0_setup.ipynb": "setup",
+    "1_generate_data.ipynb": "generate_data",
+    "2_deploy_model.ipynb": "deploy",
+    "3_run_inference.ipynb": "run_inference",
+    "4_model_metric_analysis.ipynb": "analyze",
+    "5_cleanup.ipynb": "cleanup",
+}
+
+
+def _current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _max_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class _PeakRSSSampler:
+    """
+    Samples the resident memory in a background thread to find the peak while a step runs,
+    falls back to the process high water mark where the current RSS cannot be read.
+    """
+
+    def __init__(self):
+        self.peak: int = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="PeakRSSSampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+            self._sample()
+
+    def _sample(self) -> None:
+        rss = _current_rss_bytes()
+        self.peak = max(self.peak, rss if rss is not None else _max_rss_bytes())
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def step_function(step: str) -> Callable:
+    """The function in fmbench.steps that the step notebook calls."""
+    if step not in STEP_FUNCTIONS:
+        raise ValueError(f"step={step} is not one of the steps {list(STEP_FUNCTIONS)}")
+    # the steps import the dependencies of the whole benchmark (sagemaker, seaborn, ...), they are
+    # only imported when the steps run in process
+    return getattr(importlib.import_module("fmbench.steps"), STEP_FUNCTIONS[step])
+
+
+def run_step(name: str, fn: Callable, ctx) -> Dict:
+    """Runs a step function with the given context and returns its wall time and peak memory."""
+    logger.info(f"run_step, starting stage={name}")
+    st = time.perf_counter()
+    with _PeakRSSSampler() as sampler:
+        if inspect.iscoroutinefunction(fn):
+            asyncio.run(fn(ctx))
+        else:
+            fn(ctx)
+    stats = dict(stage=name,
+                 wall_time_seconds=round(time.perf_counter() - st, 3),
+                 peak_rss_mb=round(sampler.peak / (1024 * 1024), 1))
+    logger.info(f"run_step, done, stage={name}, wall_time_seconds={stats['wall_time_seconds']}, "
+                f"peak_rss_mb={stats['peak_rss_mb']}")
+    return stats
+
+
+def run_in_process(steps: List[str], output_dir: Optional[Path] = None) -> List[Dict]:
+    """
+    Runs the functions of the given step notebooks one after the other in the current process with
+    a single PipelineContext. Returns the wall time and peak memory of every step, these are also
+    written to a json file in output_dir if provided.
+    """
+    # an unknown step is reported before anything runs
+    step_functions = [(Path(step).stem, step_function(step)) for step in steps]
+    from fmbench.steps import PipelineContext
+    ctx = PipelineContext()
+    stage_stats: List[Dict] = []
+    try:
+        for name, fn in step_functions:
+            stage_stats.append(run_step(name, fn, ctx))
+    finally:
+        if output_dir is not None:
+            fpath = Path(output_dir) / PIPELINE_STAGES_FNAME.format(timestamp=time.strftime("%Y%m%d-%H%M%S"))
+            fpath.write_text(json.dumps(stage_stats, indent=2))
+            logger.info(f"run_in_process, step wall times and peak memory written to {fpath}")
+    return stage_stats
@@ -0,0 +1,141 @@
+"""
+Columnar store of the prompts created by the data preparation step.
+
+The prompts are written once to an Arrow IPC file with typed columns (id, source_file, language,
+prompt, prompt_len and the length of every prompt template key). With
+
+    datasets:
+      reference_prompts_by_id: yes
+
+the payload files carry a `prompt_id` instead of a copy of the prompt text, so prompts that
+match several (overlapping) filters are stored once. The inference step downloads the store
+once, memory maps it and resolves the ids of a payload file with a vectorized lookup, the
+prompt text is only materialized for the payloads that are actually sent.
+"""
+import os
+import logging
+import tempfile
+import functools
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import Dict, List, Optional
+from fmbench.aws_clients import get_client
+from fmbench.globals import PROMPT_ID_PAYLOAD_KEY
+
+logger = logging.getLogger(__name__)
+
+# number of prompts per record batch of the store
+DEFAULT_BATCH_ROWS: int = 4096
+DEFAULT_LOCAL_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "fmbench_prompt_store")
+_STRING_COLUMNS: List[str] = ['id', 'source_file', 'language', 'prompt']
+
+
+class PromptStoreWriter:
+    """Writes prompt records to an Arrow IPC file in record batches and uploads it to S3 on close."""
+
+    def __init__(self, bucket: str, key: str, batch_rows: int = DEFAULT_BATCH_ROWS):
+        self.bucket: str = bucket
+        self.key: str = key
+        self.batch_rows: int = batch_rows
+        self.rows: int = 0
+        self._rows: List[Dict] = []
+        self._schema: Optional[pa.Schema] = None
+        self._writer: Optional[pa.ipc.RecordBatchFileWriter] = None
+        fd, self._local_path = tempfile.mkstemp(suffix=".arrow")
+        os.close(fd)
+
+    def write(self, prompt_record: Dict) -> None:
+        if self._schema is None:
+            # the prompt template key lengths (and the prompt length) are the integer columns
+            self._schema = pa.schema([(k, pa.string() if k in _STRING_COLUMNS else pa.int64()) for k in prompt_record])
+            self._writer = pa.ipc.new_file(self._local_path, self._schema)
+        self._rows.append(prompt_record)
+        if len(self._rows) == self.batch_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_batch(pa.RecordBatch.from_pylist(self._rows, schema=self._schema))
+            self.rows += len(self._rows)
+            self._rows = []
+
+    def close(self) -> Optional[str]:
+        """Uploads the store and returns its s3 uri, None if no prompt was written."""
+        if self._writer is None:
+            os.remove(self._local_path)
+            return None
+        self._flush()
+        self._writer.close()
+        try:
+            get_client('s3').upload_file(self._local_path, self.bucket, self.key)
+        finally:
+            os.remove(self._local_path)
+        logger.info(f"PromptStoreWriter, wrote {self.rows} prompts to s3://{self.bucket}/{self.key}")
+        return f"s3://{self.bucket}/{self.key}"
+
+    def abort(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self._local_path):
+            os.remove(self._local_path)
+
+
+class PromptStore:
+    """Read only, memory mapped view of a prompt store file."""
+
+    def __init__(self, path: str):
+        self.path: str = path
+        # reading from a memory map is zero copy, pages are only read when a prompt is accessed
+        self._table: pa.Table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        logger.info(f"PromptStore, opened {path}, {self._table.num_rows} prompts")
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def prompts(self, ids: List[str]) -> List[str]:
+        """Prompt text for every id, in the order of the ids."""
+        indices = pc.index_in(pa.array(ids, type=pa.string()), value_set=self._table['id'])
+        if indices.null_count > 0:
+            missing = [i for i, idx in zip(ids, indices.to_pylist()) if idx is None]
+            raise KeyError(f"{len(missing)} prompt ids not found in the prompt store {self.path}, e.g. {missing[:5]}")
+        return self._table['prompt'].take(indices).to_pylist()
+
+
+def open_prompt_store(bucket: str, key: str, local_dir: str = DEFAULT_LOCAL_CACHE_DIR) -> PromptStore:
+    """
+    Memory maps the current version of the prompt store, a store that is created again by the data
+    preparation step has a new ETag so it is downloaded and opened again instead of being reused.
+    """
+    etag = get_client('s3').head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    return _open_prompt_store_version(bucket, key, etag, local_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def _open_prompt_store_version(bucket: str, key: str, etag: str, local_dir: str) -> PromptStore:
+    """Downloads the given version of the prompt store (unless it is cached locally) and memory maps it."""
+    local_path = os.path.join(local_dir, bucket, key)
+    # the ETag of the local copy is kept next to it
+    etag_path = f"{local_path}.etag"
+    cached_etag = None
+    if os.path.exists(local_path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            cached_etag = f.read()
+    if cached_etag != etag:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        logger.info(f"open_prompt_store, downloading s3://{bucket}/{key}, etag={etag} to {local_path}")
+        # the download replaces the file (rather than writing into it) so a store that is already memory mapped stays valid
+        get_client('s3').download_file(bucket, key, local_path)
+        with open(etag_path, "w") as f:
+            f.write(etag)
+    return PromptStore(local_path)
+
+
+def resolve_prompt_references(payload_list: List[Dict], store: PromptStore) -> List[Dict]:
+    """Replaces the prompt_id of the payloads that reference a prompt with the prompt text."""
+    referencing = [p for p in payload_list if PROMPT_ID_PAYLOAD_KEY in p]
+    if referencing:
+        prompts = store.prompts([p[PROMPT_ID_PAYLOAD_KEY] for p in referencing])
+        for payload, prompt in zip(referencing, prompts):
+            del payload[PROMPT_ID_PAYLOAD_KEY]
+            payload['inputs'] = prompt
+    return payload_list
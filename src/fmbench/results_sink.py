@@ -0,0 +1,216 @@
+"""
+Buffered sink for the per-inference and per-chunk results written by 3_run_inference.ipynb.
+
+Records are buffered in memory and flushed to S3 by a background thread as part files,
+a part file is written once `max_records_per_part` records have been buffered or every
+`max_seconds_per_part` seconds, whichever comes first. This keeps the S3 writes off the
+event loop that is sending the inference requests. Part file names contain a sequence
+number and a random suffix so they never collide, and the list of part files written is
+kept so that the results can be read back without listing the S3 prefix. A sink that continues
+a resumed run starts from the part files already under its prefix.
+
+A part file that cannot be written is retried with backoff, if it still cannot be written its
+records are put back in the buffer (and retried with the next part file), and flush and close
+raise an error if any records could not be written, so results are never dropped silently.
+"""
+import io
+import json
+import time
+import uuid
+import logging
+import threading
+import pandas as pd
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+from fmbench.aws_clients import get_client
+from fmbench.deployment_scheduler import Backoff
+from fmbench.utils import nt_to_posix, parse_json_records, read_s3_records_to_df
+
+logger = logging.getLogger(__name__)
+
+PARTS_MANIFEST_FNAME: str = "_parts.json"
+DEFAULT_MAX_RECORDS_PER_PART: int = 1000
+DEFAULT_MAX_SECONDS_PER_PART: float = 30
+# retries of a part file that could not be written, on top of the retries of the S3 client
+DEFAULT_WRITE_RETRIES: int = 3
+WRITE_BACKOFF_SPEC: Dict = dict(initial_delay_seconds=1, max_delay_seconds=10, multiplier=2, jitter=0.5)
+
+
+class PART_FORMAT(str, Enum):
+    JSONL = 'jsonl'
+    PARQUET = 'parquet'
+
+
+def _serialize_records(records: List[Dict], fmt: PART_FORMAT) -> bytes:
+    if fmt == PART_FORMAT.JSONL:
+        return "\n".join([json.dumps(r, default=str) for r in records]).encode('utf-8')
+    # nested values (such as the list of errors in the per-chunk metrics) are stored
+    # as json strings so that every part file has a flat schema
+    df = pd.DataFrame([{k: json.dumps(v, default=str) if isinstance(v, (dict, list)) else v for k, v in r.items()}
+                       for r in records])
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+class ResultsSink:
+    """Buffers result records in memory and writes them to S3 as part files in the background."""
+
+    def __init__(self,
+                 bucket: str,
+                 prefix: str,
+                 fmt: str = PART_FORMAT.JSONL,
+                 max_records_per_part: int = DEFAULT_MAX_RECORDS_PER_PART,
+                 max_seconds_per_part: float = DEFAULT_MAX_SECONDS_PER_PART,
+                 part_keys: Optional[List[str]] = None,
+                 write_retries: int = DEFAULT_WRITE_RETRIES,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.bucket: str = bucket
+        self.prefix: str = nt_to_posix(prefix)
+        self.fmt: PART_FORMAT = PART_FORMAT(fmt)
+        self.max_records_per_part: int = max_records_per_part
+        self.max_seconds_per_part: float = max_seconds_per_part
+        self.part_keys: List[str] = list(part_keys) if part_keys is not None else []
+        self.write_retries: int = write_retries
+        self._sleep = sleep
+        self._records: List[Dict] = []
+        # error of the last flush that could not write all of its records, None once they are written
+        self._write_error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        # part files are written by the background thread and by flush, one at a time
+        self._write_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._closed = threading.Event()
+        self._seq: int = 0
+        self._suffix: str = uuid.uuid4().hex[:8]
+        self._thread = threading.Thread(target=self._run, name=f"ResultsSink-{self.prefix}", daemon=True)
+        self._thread.start()
+
+    def add(self, record: Dict) -> None:
+        """Adds a record to the buffer, this never blocks on S3."""
+        with self._lock:
+            self._records.append(record)
+            buffer_full = len(self._records) >= self.max_records_per_part
+        if buffer_full:
+            self._flush_requested.set()
+
+    def _put(self, file_name: str, body: bytes) -> None:
+        """Writes an object under the prefix, retrying failed writes with backoff."""
+        key = f"{self.prefix}/{file_name}"
+        delays = Backoff(WRITE_BACKOFF_SPEC).delays()
+        for attempt in range(self.write_retries + 1):
+            try:
+                get_client('s3').put_object(Bucket=self.bucket, Key=key, Body=body)
+                return
+            except Exception as e:
+                if attempt == self.write_retries:
+                    raise
+                delay = next(delays)
+                logger.warning(f"_put, failed to write {key}, retry {attempt + 1}/{self.write_retries} in {delay:.1f}s, exception={e}")
+                self._sleep(delay)
+
+    def _write_part(self, records: List[Dict]) -> None:
+        file_name = f"part-{self._seq:05d}-{self._suffix}.{self.fmt.value}"
+        self._seq += 1
+        self._put(file_name, _serialize_records(records, self.fmt))
+        self.part_keys.append(f"{self.prefix}/{file_name}")
+        logger.info(f"_write_part, wrote {len(records)} records to s3://{self.bucket}/{self.prefix}/{file_name}")
+
+    def _flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            # records may have piled up while the previous part was being written,
+            # so split them to keep every part file within the size bound
+            for i in range(0, len(records), self.max_records_per_part):
+                try:
+                    self._write_part(records[i:i + self.max_records_per_part])
+                except Exception as e:
+                    # keep the records that were not written, ahead of the ones added since, for the next flush
+                    unwritten = records[i:]
+                    with self._lock:
+                        self._records = unwritten + self._records
+                    self._write_error = e
+                    logger.error(f"_flush, could not write {len(unwritten)} records to {self.prefix}, "
+                                 f"they are kept for the next flush, exception={e}")
+                    return
+            self._write_error = None
+
+    def _raise_if_unwritten(self) -> None:
+        if self._write_error is not None:
+            with self._lock:
+                num_unwritten = len(self._records)
+            raise RuntimeError(f"{num_unwritten} records could not be written to "
+                               f"s3://{self.bucket}/{self.prefix}") from self._write_error
+
+    def flush(self) -> None:
+        """Writes every record added so far to S3 before returning, raises if some of them could not be written."""
+        self._flush()
+        self._raise_if_unwritten()
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            self._flush_requested.wait(timeout=self.max_seconds_per_part)
+            self._flush_requested.clear()
+            self._flush()
+
+    def close(self) -> List[str]:
+        """
+        Flushes everything that is still buffered, writes the parts manifest and returns the part keys.
+        Raises if some of the records or the manifest could not be written.
+        """
+        self._closed.set()
+        self._flush_requested.set()
+        self._thread.join()
+        self._flush()
+        # the manifest lists the part files that were written even if some records could not be
+        self._put(PARTS_MANIFEST_FNAME, json.dumps(self.part_keys, indent=2).encode('utf-8'))
+        self._raise_if_unwritten()
+        logger.info(f"close, {len(self.part_keys)} part files written to s3://{self.bucket}/{self.prefix}")
+        return self.part_keys
+
+
+def list_part_files(bucket: str, prefix: str) -> List[str]:
+    """Keys of the part files under the prefix, e.g. the ones written before a run was interrupted."""
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    part_keys: List[str] = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{nt_to_posix(prefix)}/part-"):
+        part_keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return sorted(part_keys)
+
+
+def create_results_sink(config: Dict, prefix: str, resume: bool = False) -> ResultsSink:
+    """
+    Creates a results sink for the given prefix using the optional `results_sink` section of the config,
+    with resume the part files already under the prefix are kept in the sink's list of part files.
+    """
+    sink_config: Dict = config.get('results_sink', {})
+    return ResultsSink(config['aws']['bucket'],
+                       prefix,
+                       fmt=sink_config.get('format', PART_FORMAT.JSONL),
+                       max_records_per_part=sink_config.get('max_records_per_part', DEFAULT_MAX_RECORDS_PER_PART),
+                       max_seconds_per_part=sink_config.get('max_seconds_per_part', DEFAULT_MAX_SECONDS_PER_PART),
+                       part_keys=list_part_files(config['aws']['bucket'], prefix) if resume else None)
+
+
+def _parse_part(content: bytes) -> List[Dict]:
+    # parquet files start with the PAR1 magic bytes, everything else is json lines
+    if content[:4] == b"PAR1":
+        return pd.read_parquet(io.BytesIO(content)).to_dict(orient='records')
+    return parse_json_records(content)
+
+
+def read_part_files(bucket: str, part_keys: Optional[List[str]] = None, prefix: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads the part files written by a ResultsSink into a dataframe. The part keys are
+    either provided or read from the parts manifest under the prefix.
+    """
+    if part_keys is None:
+        manifest_key = f"{nt_to_posix(prefix)}/{PARTS_MANIFEST_FNAME}"
+        s3_client = get_client('s3')
+        part_keys = json.loads(s3_client.get_object(Bucket=bucket, Key=manifest_key)['Body'].read())
+    logger.info(f"read_part_files, reading {len(part_keys)} part files from bucket={bucket}")
+    df, failures = read_s3_records_to_df(bucket, part_keys, parse_fn=_parse_part)
+    if failures:
+        logger.error(f"read_part_files, could not read part files {list(failures.keys())}")
+    return df
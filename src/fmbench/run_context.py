@@ -0,0 +1,231 @@
+"""
+Lazily initialized context for an FMBench run.
+
+The config file, the AWS account identity, the directory layout and the tokenizer are
+resolved the first time they are accessed rather than when `fmbench.globals` or
+`fmbench.utils` are imported, so importing either module never touches the network.
+A pre-built context (for example with an in-memory config and a fixed account id) can be
+installed with `set_run_context` for tests and offline use.
+
+Every run has a run id, derived from the time at which the run started. The metrics directory
+is derived from the run id, so the notebooks of a run (and a resumed run) share it.
+"""
+import os
+import yaml
+import boto3
+import logging
+import requests
+import threading
+from pathlib import Path
+from datetime import datetime
+from functools import cached_property
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE_ENV_VAR: str = "CONFIG_FILE_FMBENCH"
+CONFIG_FILEPATH_FNAME: str = "config_filepath.txt"
+# set by the fmbench cli so that every notebook of a run uses the same run id
+RUN_ID_ENV_VAR: str = "FMBENCH_RUN_ID"
+# set by the fmbench cli to continue a run from its progress journal
+RESUME_ENV_VAR: str = "FMBENCH_RESUME"
+RUN_ID_FORMAT: str = "%Y%m%d-%H%M%S"
+
+
+def new_run_id(start_time: Optional[datetime] = None) -> str:
+    return (start_time if start_time is not None else datetime.now()).strftime(RUN_ID_FORMAT)
+
+
+class RunContext:
+    """
+    Config, account identity, paths and tokenizer for a run, each resolved on first access.
+    Any of config_file, config, account_id, role_arn and region can be provided upfront,
+    whatever is provided is not looked up.
+    """
+
+    def __init__(self,
+                 config_file: Optional[str] = None,
+                 config: Optional[Dict] = None,
+                 account_id: Optional[str] = None,
+                 role_arn: Optional[str] = None,
+                 region: Optional[str] = None,
+                 tokenizer=None):
+        self._config_file = config_file
+        self._config = config
+        self._account_id = account_id
+        self._role_arn = role_arn
+        self._region = region
+        self._tokenizer = tokenizer
+        self._tokenizer_lock = threading.Lock()
+
+    ## --------------------- AWS session and account identity ---------------------------
+    @cached_property
+    def session(self) -> boto3.session.Session:
+        return boto3.session.Session()
+
+    @cached_property
+    def s3_client(self):
+        from fmbench.aws_clients import get_client
+        return get_client('s3')
+
+    @cached_property
+    def caller_identity(self) -> Dict:
+        if self._account_id is not None and self._role_arn is not None:
+            return dict(Account=self._account_id, Arn=self._role_arn)
+        logger.info(f"caller_identity, resolving the account identity")
+        from fmbench.aws_clients import get_client
+        return get_client('sts').get_caller_identity()
+
+    @property
+    def account_id(self) -> str:
+        return self.caller_identity.get('Account')
+
+    @property
+    def role_arn(self) -> str:
+        return self.caller_identity.get('Arn')
+
+    @property
+    def role_name(self) -> str:
+        return self.role_arn.split('/')[-1]
+
+    @property
+    def region(self) -> str:
+        return self._region if self._region is not None else self.session.region_name
+
+    ## --------------------- config file ---------------------------
+    @cached_property
+    def config_file(self) -> Optional[str]:
+        # there is no config file when a pre-built config was provided without one
+        if self._config_file is not None or self._config is not None:
+            return self._config_file
+        ## if the env var is set, use the config file from the cli
+        config_file = os.environ.get(CONFIG_FILE_ENV_VAR)
+        if config_file is None:
+            config_file = (Path.cwd() / CONFIG_FILEPATH_FNAME).read_text().strip()
+        print(f"config file current -> {config_file}")
+        return config_file
+
+    @cached_property
+    def config_content(self) -> str:
+        if self.config_file is None:
+            return yaml.safe_dump(self._config)
+        if self.config_file.startswith("s3://"):
+            bucket_name, key_path = self.config_file.replace("s3://", "").split("/", 1)
+            content = boto3.resource('s3').Object(bucket_name, key_path).get()['Body'].read().decode('utf-8')
+        elif self.config_file.startswith("https://"):
+            response = requests.get(self.config_file)
+            response.raise_for_status()  # Ensure we got a successful response
+            content = response.text
+        else:
+            content = Path(self.config_file).read_text()
+        return content.format(**self.config_params)
+
+    @property
+    def config_params(self) -> Dict:
+        """
+        Values of the parameters of a parameterized config file, a config file that is
+        not parameterized is not changed by them.
+        """
+        return dict(region=self.region,
+                    role_arn=self.role_arn,
+                    write_bucket=f"sagemaker-fmbench-write-{self.account_id}",
+                    read_bucket=f"sagemaker-fmbench-read-{self.account_id}")
+
+    @cached_property
+    def config(self) -> Dict:
+        if self._config is not None:
+            return self._config
+        config = yaml.safe_load(self.config_content)
+        print(f"Loaded config: {config}")
+        return config
+
+    ## --------------------- directories ---------------------------
+    @cached_property
+    def run_id(self) -> str:
+        run_id = os.environ.get(RUN_ID_ENV_VAR)
+        return run_id if run_id else new_run_id()
+
+    @property
+    def resume(self) -> bool:
+        return os.environ.get(RESUME_ENV_VAR, "no") == "yes"
+
+    @cached_property
+    def start_time(self) -> datetime:
+        return datetime.strptime(self.run_id, RUN_ID_FORMAT)
+
+    @cached_property
+    def per_account_dir(self) -> str:
+        return f"{self.config['general']['name']}-{self.role_name}"
+
+    @cached_property
+    def data_dir(self) -> str:
+        return self._makedirs(os.path.join(self.per_account_dir, self.config['dir_paths']['data_prefix']))
+
+    @cached_property
+    def prompts_dir(self) -> str:
+        return self._makedirs(os.path.join(self.data_dir, self.config['dir_paths']['prompts_prefix']))
+
+    @cached_property
+    def metrics_dir(self) -> str:
+        # metrics directory based on the date and time at which the run started
+        year, month, day, hour, minute = self.start_time.strftime("%Y/%m/%d/%H/%M").split('/')
+        return self._makedirs(f"{self.data_dir}/metrics/yyyy={year}/mm={month}/dd={day}/hh={hour}/mm={minute}")
+
+    @cached_property
+    def metrics_per_inference_dir(self) -> str:
+        return self._makedirs(os.path.join(self.metrics_dir, "per_inference"))
+
+    @cached_property
+    def metrics_per_chunk_dir(self) -> str:
+        return self._makedirs(os.path.join(self.metrics_dir, "per_chunk"))
+
+    @cached_property
+    def models_dir(self) -> str:
+        return self._makedirs(f"{self.data_dir}/models")
+
+    @property
+    def dir_list(self) -> List[str]:
+        return [self.data_dir, self.prompts_dir, self.metrics_dir, self.models_dir,
+                self.metrics_per_inference_dir, self.metrics_per_chunk_dir]
+
+    @staticmethod
+    def _makedirs(path: str) -> str:
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    ## --------------------- tokenizer ---------------------------
+    @property
+    def tokenizer(self):
+        # the tokenizer files are downloaded from s3 and transformers is imported only when
+        # tokens are counted for the first time
+        if self._tokenizer is None:
+            with self._tokenizer_lock:
+                if self._tokenizer is None:
+                    from fmbench.utils import CustomTokenizer
+                    from fmbench.globals import TOKENIZER
+                    self._tokenizer = CustomTokenizer(self.config['s3_read_data']['read_bucket'],
+                                                      self.config['s3_read_data']['tokenizer_prefix'],
+                                                      TOKENIZER,
+                                                      self.config.get('token_count_cache'))
+        return self._tokenizer
+
+
+_run_context: Optional[RunContext] = None
+_run_context_lock = threading.Lock()
+
+
+def get_run_context() -> RunContext:
+    """Returns the current run context, a default one (config from the env var or config_filepath.txt) is created on first use."""
+    global _run_context
+    if _run_context is None:
+        with _run_context_lock:
+            if _run_context is None:
+                _run_context = RunContext()
+    return _run_context
+
+
+def set_run_context(context: Optional[RunContext]) -> None:
+    """Installs a pre-built run context, None resets to a default context created on next use."""
+    global _run_context
+    with _run_context_lock:
+        _run_context = context
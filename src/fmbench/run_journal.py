@@ -0,0 +1,196 @@
+"""
+Durable progress journal of the inference step, used to resume an interrupted run.
+
+Every completed chunk of a (experiment, concurrency, payload file) combination and every
+completed combination is recorded in the journal, which is written to S3 under the metrics
+directory of the run as append-only part files, under a prefix of its own for every run id
+since runs started within the same minute share a metrics directory. The journal is flushed
+every `checkpoint_seconds` while a combination is running and whenever a combination completes,
+the results of a chunk are flushed to S3 before the journal entries of the chunk are, so a chunk
+in the journal always has its results:
+
+    run_journal:
+      checkpoint_seconds: 30    # interval between checkpoints of a running combination
+
+A chunk entry carries the index of every payload that completed in the chunk, since in the
+sliding-window and open-loop modes a chunk is a group of completions and not a fixed slice of the
+payload file, a resumed combination only sends the payloads that did not complete. The entry also
+carries the latencies of the chunk from which the early stopping decision is restored. Every level
+probed by a concurrency search is recorded as a completed combination with its step as the result,
+a resumed search replays these steps and continues with the next level.
+
+Every attempt at a run (the first one and every resume) has its own attempt id, which is
+stored in every result record along with the chunk the record belongs to. A chunk that was
+being benchmarked when the run was interrupted may have had some of its results written, it
+is run again when the run is resumed, so the final aggregation only keeps the records of the
+attempt that the journal credits with completing the chunk, and nothing is counted twice.
+"""
+import json
+import time
+import uuid
+import logging
+import threading
+import posixpath
+import pandas as pd
+from enum import Enum
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from fmbench.aws_clients import get_client
+from fmbench.globals import PAYLOAD_INDEX_KEY
+from fmbench.utils import write_to_s3, nt_to_posix, parse_json_records
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR: str = "_journal"
+# warm-up requests are recorded as chunk 0, measured chunks are numbered from 1
+WARMUP_CHUNK_INDEX: int = 0
+DEFAULT_CHECKPOINT_SECONDS: float = 30
+
+
+class JOURNAL_ENTRY(str, Enum):
+    CHUNK = 'chunk'
+    COMBINATION = 'combination'
+
+
+def chunk_key(experiment_name: str, concurrency: Optional[int], payload_file: str, chunk_index: int) -> Tuple:
+    return (experiment_name, concurrency, payload_file, chunk_index)
+
+
+def remaining_payloads(split_payload: List[List[Dict]], completed_indices: List[int], chunk_size: int) -> List[List[Dict]]:
+    """
+    The payloads of split_payload that did not complete, in chunks of chunk_size. A payload that occurs more than
+    once (e.g. to fill the last chunk) is dropped as many times as its index completed.
+    """
+    completed = Counter(completed_indices)
+    remaining: List[Dict] = []
+    for payload in (p for chunk in split_payload for p in chunk):
+        if completed[payload[PAYLOAD_INDEX_KEY]] > 0:
+            completed[payload[PAYLOAD_INDEX_KEY]] -= 1
+        else:
+            remaining.append(payload)
+    return [remaining[i:i + chunk_size] for i in range(0, len(remaining), chunk_size)]
+
+
+class RunJournal:
+    """Completed chunks and combinations of a run, replayed from S3 when the run is resumed."""
+
+    def __init__(self, bucket: str, metrics_dir: str, run_id: str, resume: bool = False,
+                 checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS):
+        self.bucket: str = bucket
+        self.prefix: str = posixpath.join(nt_to_posix(metrics_dir), JOURNAL_DIR, run_id)
+        self.run_id: str = run_id
+        self.attempt: str = uuid.uuid4().hex[:8]
+        self.checkpoint_seconds: float = checkpoint_seconds
+        # time of the last flush of every experiment
+        self._last_flush: Dict[str, float] = {}
+        # entry of every completed chunk, and result of every completed combination
+        self._chunks: Dict[Tuple, Dict] = {}
+        self._combinations: Dict[Tuple, Optional[Dict]] = {}
+        # entries not yet written to S3, per experiment since experiments run (and flush) independently
+        self._pending: Dict[str, List[Dict]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._seq: int = 0
+        if resume:
+            entries = self._read()
+            for entry in entries:
+                self._apply(entry)
+            logger.info(f"RunJournal, resuming run_id={run_id}, attempt={self.attempt}, replayed {len(entries)} entries, "
+                        f"{len(self._chunks)} chunks and {len(self._combinations)} combinations completed")
+        else:
+            logger.info(f"RunJournal, run_id={run_id}, attempt={self.attempt}")
+
+    def _read(self) -> List[Dict]:
+        s3_client = get_client('s3')
+        paginator = s3_client.get_paginator('list_objects_v2')
+        keys = sorted(obj['Key'] for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/")
+                      for obj in page.get('Contents', []))
+        # part file names start with the time at which they were written, so sorting them orders the entries
+        entries = [entry for key in keys
+                   for entry in parse_json_records(s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read())]
+        return [entry for entry in entries if entry.get('run_id') == self.run_id]
+
+    def _apply(self, entry: Dict) -> None:
+        kind = JOURNAL_ENTRY(entry['entry'])
+        if kind == JOURNAL_ENTRY.CHUNK:
+            self._chunks[chunk_key(entry['experiment_name'], entry['concurrency'],
+                                   entry['payload_file'], entry['chunk_index'])] = entry
+        else:
+            self._combinations[(entry['experiment_name'], entry['concurrency'], entry['payload_file'])] = entry.get('result')
+
+    def _add(self, entry: Dict) -> None:
+        entry = (dict(entry=entry['entry'].value, run_id=self.run_id, attempt=self.attempt)
+                 | {k: v for k, v in entry.items() if k != 'entry'})
+        with self._lock:
+            self._apply(entry)
+            self._pending[entry['experiment_name']].append(entry)
+
+    def record_chunk(self, experiment_name: str, concurrency: Optional[int], payload_file: str, chunk_index: int,
+                     responses: Optional[List[Dict]] = None) -> None:
+        """Records a completed chunk along with the payload index and the latency of its responses."""
+        responses = responses if responses is not None else []
+        self._add(dict(entry=JOURNAL_ENTRY.CHUNK, experiment_name=experiment_name, concurrency=concurrency,
+                       payload_file=payload_file, chunk_index=chunk_index,
+                       payload_indices=[r.get('payload_index') for r in responses],
+                       latencies=[r.get('latency') if r.get('completion') is not None else None for r in responses]))
+
+    def record_combination(self, experiment_name: str, concurrency: Optional[int], payload_file: str,
+                           result: Optional[Dict] = None) -> None:
+        """Records a completed combination, concurrency is None for the result of a concurrency search."""
+        self._add(dict(entry=JOURNAL_ENTRY.COMBINATION, experiment_name=experiment_name, concurrency=concurrency,
+                       payload_file=payload_file, result=result))
+
+    def is_combination_done(self, experiment_name: str, concurrency: Optional[int], payload_file: str) -> bool:
+        return (experiment_name, concurrency, payload_file) in self._combinations
+
+    def combination_result(self, experiment_name: str, concurrency: Optional[int], payload_file: str) -> Optional[Dict]:
+        return self._combinations.get((experiment_name, concurrency, payload_file))
+
+    def completed_chunks(self, experiment_name: str, concurrency: Optional[int], payload_file: str) -> int:
+        """Number of measured chunks of the combination that completed one after the other from the first one."""
+        n = 0
+        while chunk_key(experiment_name, concurrency, payload_file, n + 1) in self._chunks:
+            n += 1
+        return n
+
+    def completed_payloads(self, experiment_name: str, concurrency: Optional[int],
+                           payload_file: str) -> Tuple[List[int], List[Optional[float]]]:
+        """Indices of the payloads of the completed_chunks and the latencies of their requests, None if a request failed."""
+        entries = [self._chunks[chunk_key(experiment_name, concurrency, payload_file, i + 1)]
+                   for i in range(self.completed_chunks(experiment_name, concurrency, payload_file))]
+        return ([i for e in entries for i in e.get('payload_indices', [])],
+                [latency for e in entries for latency in e.get('latencies', [])])
+
+    def is_checkpoint_due(self, experiment_name: str) -> bool:
+        """True once checkpoint_seconds have passed since the last flush of the experiment."""
+        with self._lock:
+            last_flush = self._last_flush.setdefault(experiment_name, time.monotonic())
+        return time.monotonic() - last_flush >= self.checkpoint_seconds
+
+    def flush(self, experiment_name: str, sinks: List) -> None:
+        """Writes the results in the sinks and then the pending journal entries of the experiment to S3."""
+        for sink in sinks:
+            sink.flush()
+        with self._lock:
+            self._last_flush[experiment_name] = time.monotonic()
+            entries, self._pending[experiment_name] = self._pending[experiment_name], []
+            self._seq += 1
+            seq = self._seq
+        if not entries:
+            return
+        file_name = f"{time.time_ns()}-{self.attempt}-{seq:05d}.jsonl"
+        if write_to_s3("\n".join(json.dumps(e) for e in entries), self.bucket, "", self.prefix, file_name) is None:
+            raise RuntimeError(f"flush, could not write {len(entries)} journal entries to {self.prefix}/{file_name}")
+
+    def completed_records(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Keeps the result records of the attempt that completed their chunk, i.e. drops those of interrupted attempts."""
+        if df.empty or 'attempt' not in df.columns:
+            return df
+        # records of another run that shares the metrics directory
+        if 'run_id' in df.columns:
+            df = df[df['run_id'] == self.run_id]
+        keys = zip(df['experiment_name'], df['concurrency'], df['payload_file'], df['chunk_index'], df['attempt'])
+        keep = [self._chunks.get(chunk_key(e, None if pd.isna(c) else int(c), p, int(i)), {}).get('attempt') == a
+                for e, c, p, i, a in keys]
+        if not all(keep):
+            logger.info(f"completed_records, dropping {len(keep) - sum(keep)} of {len(keep)} records of interrupted attempts")
+        return df[keep]
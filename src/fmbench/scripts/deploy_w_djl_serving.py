@@ -7,7 +7,6 @@ Deploys a model from HuggingFace on Amazon SageMaker using the DJL DeepSpeek LMI
 """
 # Import necessary libraries
 import os
-import time
 import s3fs
 import boto3
 import logging
@@ -18,6 +17,8 @@ from pathlib import Path
 from sagemaker.utils import name_from_base
 from huggingface_hub import snapshot_download
 from typing import Dict, List, Tuple, Optional
+from fmbench.aws_clients import get_client
+from fmbench.deployment_scheduler import call_with_backoff, wait_for_endpoint
 
 
 # set a logger
@@ -46,7 +47,7 @@ default_bucket = sess.default_bucket()
 account_id: str = sess.account_id()
 
 # Initialize the sagemaker and sagemaker runtime clients
-sm_client = boto3.client("sagemaker")
+sm_client = get_client("sagemaker", region)
 
 
 def _download_model(model_id: str,
@@ -115,7 +116,8 @@ def _create_model(experiment_config: Dict,
     else:
         pc = dict(Image=inference_image_uri,
                   ModelDataUrl=s3_model_artifact)
-    create_model_response = sm_client.create_model(
+    create_model_response = call_with_backoff(
+        sm_client.create_model,
         ModelName=model_name,
         ExecutionRoleArn=role_arn,
         PrimaryContainer=pc,
@@ -131,7 +133,8 @@ def _deploy_endpoint(experiment_config: Dict,
     endpoint_config_name = f"{model_name}-config"
     endpoint_name = f"{model_name}-endpoint"
 
-    _ = sm_client.create_endpoint_config(
+    _ = call_with_backoff(
+        sm_client.create_endpoint_config,
         EndpointConfigName=endpoint_config_name,
         ProductionVariants=[
             {
@@ -145,23 +148,18 @@ def _deploy_endpoint(experiment_config: Dict,
         ],
     )
 
-    create_endpoint_response = sm_client.create_endpoint(
+    create_endpoint_response = call_with_backoff(
+        sm_client.create_endpoint,
         EndpointName=endpoint_name, EndpointConfigName=endpoint_config_name
     )
     return endpoint_name, create_endpoint_response['EndpointArn']
 
 
-def _check_endpoint_status(endpoint_name: str) -> str:
+def _check_endpoint_status(endpoint_name: str, readiness_polling: Optional[Dict] = None) -> Dict:
     """
-    Function to check the status of the endpoint
+    Function to wait for the endpoint to be ready, polled with a jittered exponential backoff
     """
-    resp = sm_client.describe_endpoint(EndpointName=endpoint_name)
-    status = resp["EndpointStatus"]
-    while status == "Creating":
-        time.sleep(60)
-        resp = sm_client.describe_endpoint(EndpointName=endpoint_name)
-        status = resp["EndpointStatus"]
-    return status
+    return wait_for_endpoint(sm_client, endpoint_name, readiness_polling)
 
 
 def deploy(experiment_config: Dict, role_arn: str) -> Dict:
@@ -218,8 +216,9 @@ def deploy(experiment_config: Dict, role_arn: str) -> Dict:
     logger.info(f"deploying endpoint: {endpoint_name}")
 
     # check model deployment status
-    status = _check_endpoint_status(endpoint_name)
-    logger.info(f"Endpoint status: {status}")
+    readiness = _check_endpoint_status(endpoint_name, experiment_config.get('readiness_polling'))
+    status = readiness['status']
+    logger.info(f"Endpoint status: {status}, ready in {readiness['ready_seconds']} seconds")
 
     if status == 'InService':
         logger.info("endpoint is in service")
@@ -227,4 +226,5 @@ def deploy(experiment_config: Dict, role_arn: str) -> Dict:
         logger.info("endpoint is not in service.")
 
     return dict(endpoint_name=endpoint_name,
-                experiment_name=experiment_config['name'])
\ No newline at end of file
+                experiment_name=experiment_config['name'],
+                ready_seconds=readiness['ready_seconds'])
\ No newline at end of file
@@ -1,14 +1,15 @@
 # Import necessary libraries
 import os
 import json
-import time
 import boto3
 import logging
 import sagemaker
-from typing import Dict
+from typing import Dict, Optional
 from pathlib import Path
 from sagemaker.huggingface import HuggingFaceModel
 from sagemaker.huggingface import get_huggingface_llm_image_uri
+from fmbench.aws_clients import get_client
+from fmbench.deployment_scheduler import wait_for_endpoint
 
 # globals
 HF_TOKEN_FNAME: str = os.path.join(os.path.dirname(os.path.realpath(__file__)), "hf_token.txt")
@@ -21,8 +22,8 @@ logger = logging.getLogger(__name__)
 s3_client = boto3.client('s3')
 
 # Initialize the sagemaker and sagemaker runtime clients 
-sm_client = boto3.client("sagemaker")
-smr_client = boto3.client("sagemaker-runtime")
+sm_client = get_client("sagemaker")
+smr_client = get_client("sagemaker-runtime")
 
 # Function to create the llm hugging face model
 def create_hugging_face_model(experiment_config: Dict, role_arn: str) -> HuggingFaceModel:
@@ -44,23 +45,19 @@ def create_hugging_face_model(experiment_config: Dict, role_arn: str) -> Hugging
     print(f"Hugging face model defined using {model_config} -> {llm_model}")
     return llm_model
 
-## Function to check the status of the endpoint
-def check_endpoint_status(endpoint_name: str) -> str:
-    resp = sm_client.describe_endpoint(EndpointName=endpoint_name)
-    status = resp["EndpointStatus"]
-    while status == "Creating":
-        time.sleep(60)
-        resp = sm_client.describe_endpoint(EndpointName=endpoint_name)
-        status = resp["EndpointStatus"]
-    return status
+## Function to wait for the endpoint to be ready, polled with a jittered exponential backoff
+def check_endpoint_status(endpoint_name: str, readiness_polling: Optional[Dict] = None) -> Dict:
+    return wait_for_endpoint(sm_client, endpoint_name, readiness_polling)
 
 # Deploy the hugging face model
 def deploy_hugging_face_model(experiment_config: Dict, llm_model: HuggingFaceModel) -> str:   
     tmout: int = experiment_config['env']['HEALTH_CHECK_TIMEOUT']
-    llm = llm_model.deploy(initial_instance_count=experiment_config['env']['INSTANCE_COUNT'],
-                           instance_type=experiment_config['instance_type'],
-                           container_startup_health_check_timeout=tmout,)
-    return llm.endpoint_name
+    llm_model.deploy(initial_instance_count=experiment_config['env']['INSTANCE_COUNT'],
+                     instance_type=experiment_config['instance_type'],
+                     container_startup_health_check_timeout=tmout,
+                     # readiness is polled by check_endpoint_status
+                     wait=False)
+    return llm_model.endpoint_name
 
 # Function to deploy the model and create the endpoint
 def deploy(experiment_config: Dict, role_arn: str) -> Dict[str, str]:
@@ -74,7 +71,8 @@ def deploy(experiment_config: Dict, role_arn: str) -> Dict[str, str]:
     llm_endpoint = deploy_hugging_face_model(experiment_config, llm_model)
     logger.info("Deploying the model now ....")
 
-    status = check_endpoint_status(llm_endpoint)
-    logger.info(f"Endpoint status: {status}")
+    readiness = check_endpoint_status(llm_endpoint, experiment_config.get('readiness_polling'))
+    logger.info(f"Endpoint status: {readiness['status']}, ready in {readiness['ready_seconds']} seconds")
 
-    return dict(endpoint_name=llm_endpoint, experiment_name=experiment_config['name'])
\ No newline at end of file
+    return dict(endpoint_name=llm_endpoint, experiment_name=experiment_config['name'],
+                ready_seconds=readiness['ready_seconds'])
\ No newline at end of file
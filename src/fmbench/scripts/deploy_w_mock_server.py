@@ -0,0 +1,106 @@
+# Deploys the mock inference server (see mock_inference_server.py) so that the benchmarking
+# steps can run without a SageMaker endpoint. The server is started as a separate process so
+# that it keeps running across the deploy and the inference steps, the endpoint description
+# returned by deploy has the same shape as the SageMaker describe calls so that endpoints.json
+# and the rest of the pipeline work unchanged.
+import sys
+import json
+import time
+import logging
+import requests
+import subprocess
+from typing import Dict, Optional
+from datetime import datetime, timezone
+from fmbench.scripts.mock_inference_server import (MOCK_SERVER_IMAGE, DEFAULT_PORT, DEFAULT_LATENCY_SPEC,
+                                                   HEALTH_PATH, SHUTDOWN_PATH)
+
+# set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# time to wait for the mock server to start accepting requests
+STARTUP_TIMEOUT_SECONDS: int = 30
+
+# latency spec of every mock server started by this process, by url
+_started_servers: Dict[str, Dict] = {}
+
+def _running_latency_spec(url: str) -> Optional[Dict]:
+    """Latency spec reported by the health check of the server at url, None if no server is running there."""
+    try:
+        resp = requests.get(url + HEALTH_PATH, timeout=1)
+        return resp.json()['latency_spec'] if resp.status_code == 200 else None
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        return None
+
+def _is_healthy(url: str) -> bool:
+    return _running_latency_spec(url) is not None
+
+def _wait_for(url: str, healthy: bool) -> None:
+    deadline = time.time() + STARTUP_TIMEOUT_SECONDS
+    while _is_healthy(url) is not healthy:
+        if time.time() > deadline:
+            raise TimeoutError(f"mock inference server did not {'start' if healthy else 'stop'} at {url} "
+                               f"in {STARTUP_TIMEOUT_SECONDS} seconds")
+        time.sleep(0.5)
+
+def _start_server(host: str, port: int, latency_spec: Dict) -> None:
+    cmd = [sys.executable, "-m", "fmbench.scripts.mock_inference_server",
+           "--host", host, "--port", str(port), "--latency-spec", json.dumps(latency_spec)]
+    logger.info(f"starting the mock inference server, cmd={cmd}")
+    # a new session so that the server outlives the notebook kernel that started it
+    subprocess.Popen(cmd, start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def endpoint_description(experiment_config: Dict, url: str, latency_spec: Dict) -> Dict:
+    """Description of the mock endpoint in the shape of the SageMaker describe_endpoint/endpoint_config/model calls."""
+    name: str = experiment_config.get('ep_name', experiment_config['name'])
+    creation_time: str = datetime.now(timezone.utc).isoformat()
+    return dict(endpoint=dict(EndpointName=url,
+                              EndpointConfigName=name,
+                              EndpointStatus="InService",
+                              CreationTime=creation_time),
+                endpoint_config=dict(EndpointConfigName=name,
+                                     ProductionVariants=[dict(VariantName="AllTraffic",
+                                                              ModelName=name,
+                                                              InstanceType=experiment_config['instance_type'],
+                                                              InitialInstanceCount=experiment_config.get('instance_count', 1))],
+                                     CreationTime=creation_time),
+                model_config=dict(ModelName=name,
+                                  PrimaryContainer=dict(Image=MOCK_SERVER_IMAGE,
+                                                        Environment={k: str(v) for k, v in latency_spec.items()}),
+                                  CreationTime=creation_time))
+
+# Function to deploy the model and create the endpoint
+def deploy(experiment_config: Dict, role_arn: str) -> Dict:
+    mock_server_config: Dict = experiment_config.get('mock_server', {})
+    host: str = mock_server_config.get('host', "127.0.0.1")
+    port: int = mock_server_config.get('port', DEFAULT_PORT)
+    latency_spec: Dict = mock_server_config.get('latency_spec', {})
+    url: str = f"http://{host}:{port}"
+    # the spec as the server reports it, i.e. with the defaults filled in and after a json round trip
+    expected_spec: Dict = json.loads(json.dumps(DEFAULT_LATENCY_SPEC | latency_spec))
+
+    running_spec = _running_latency_spec(url)
+    if running_spec == expected_spec:
+        logger.info(f"mock inference server already running at {url}")
+    else:
+        if running_spec is not None:
+            # another experiment of this run is benchmarking against this server, restarting it would change its results
+            if url in _started_servers:
+                raise ValueError(f"mock inference server at {url} was started with latency_spec={running_spec} for another "
+                                 f"experiment, use a different mock_server.port for latency_spec={expected_spec}")
+            logger.warning(f"mock inference server at {url} runs with latency_spec={running_spec}, "
+                           f"restarting it with latency_spec={expected_spec}")
+            shutdown(url)
+            _wait_for(url, healthy=False)
+        _start_server(host, port, latency_spec)
+        _wait_for(url, healthy=True)
+        _started_servers[url] = expected_spec
+    logger.info(f"mock inference server is ready at {url}")
+
+    return dict(endpoint_name=url,
+                experiment_name=experiment_config['name'],
+                endpoint_info=endpoint_description(experiment_config, url, latency_spec))
+
+def shutdown(url: str) -> None:
+    """Stops a mock inference server started by deploy."""
+    requests.post(url + SHUTDOWN_PATH, timeout=5)
@@ -12,6 +12,15 @@ class FMBenchPredictor(ABC):
     def endpoint_name(self) -> str:
         """The endpoint name property."""
         pass
+
+    # predictors that can do non-blocking I/O set this to True and provide
+    # `async def get_prediction_async(self, payload)`, the inference runner then awaits
+    # it directly instead of calling get_prediction in a thread
+    supports_async: bool = False
+
+    async def aclose(self) -> None:
+        """Releases the resources (e.g. HTTP sessions) used by get_prediction_async."""
+        pass
     
 class FMBenchPredictionResponse(dict):
    def __init__(self, *k, **kwargs):
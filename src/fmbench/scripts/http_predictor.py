@@ -0,0 +1,125 @@
+import time
+import json
+import logging
+import requests
+from enum import Enum
+from typing import Dict
+from requests.adapters import HTTPAdapter
+from fmbench.aws_clients import pool_size
+from fmbench.async_http import LoopBoundSession
+from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
+                                               FMBenchPredictionResponse)
+
+## set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class HTTP_API(str, Enum):
+    TGI = 'tgi'
+    VLLM = 'vllm'
+    OPENAI = 'openai'
+
+# request path for each API, relative to the endpoint url
+API_PATHS: Dict[HTTP_API, str] = {HTTP_API.TGI: "/generate",
+                                  HTTP_API.VLLM: "/generate",
+                                  HTTP_API.OPENAI: "/v1/completions"}
+
+class HTTPPredictor(FMBenchPredictor):
+    """
+    Predictor for models served over HTTP by TGI, vLLM or an OpenAI compatible server. The endpoint
+    name is the base url of the server, the inference_spec can provide:
+      api: tgi (default) | vllm | openai
+      model: model name sent in OpenAI requests
+      headers: extra request headers, e.g. for authorization
+    Connections are reused across requests by both the blocking and the async interface.
+    """
+    supports_async: bool = True
+
+    # overriding abstract method
+    def __init__(self, endpoint_name: str, inference_spec: Dict | None):
+        self._endpoint_name: str = endpoint_name
+        self._inference_spec: Dict = inference_spec if inference_spec is not None else {}
+        self._api: HTTP_API = HTTP_API(self._inference_spec.get("api", HTTP_API.TGI))
+        self._url: str = endpoint_name.rstrip("/") + API_PATHS[self._api]
+        self._headers: Dict = {'Content-Type': 'application/json'} | self._inference_spec.get("headers", {})
+        # connection pool sized for the benchmark concurrency, shared by the threads sending requests
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size())
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._http_session = LoopBoundSession()
+        logger.info(f"__init__, url={self._url}, api={self._api.value}")
+
+    def _create_request_body(self, payload: Dict) -> Dict:
+        if self._api == HTTP_API.TGI:
+            return payload
+        parameters: Dict = dict(payload.get("parameters", {}))
+        # both vLLM and OpenAI use max_tokens instead of max_new_tokens and do not know about truncate
+        parameters.pop("truncate", None)
+        if "max_new_tokens" in parameters:
+            parameters["max_tokens"] = parameters.pop("max_new_tokens")
+        if self._api == HTTP_API.VLLM:
+            return dict(prompt=payload["inputs"], **parameters)
+        return dict(model=self._inference_spec.get("model"),
+                    prompt=payload["inputs"],
+                    **{k: v for k, v in parameters.items() if k in ("max_tokens", "temperature", "top_p")})
+
+    def _parse_response(self, payload: Dict, response: bytes) -> Dict:
+        response_json = json.loads(response)
+        if self._api == HTTP_API.TGI:
+            if isinstance(response_json, list):
+                response_json = response_json[0]
+            return response_json
+        if self._api == HTTP_API.VLLM:
+            # the vLLM api server returns the prompt followed by the completion
+            text: str = response_json["text"][0]
+            return dict(generated_text=text[len(payload["inputs"]):] if text.startswith(payload["inputs"]) else text)
+        return dict(generated_text=response_json["choices"][0]["text"])
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        response_json = None
+        latency = None
+        response = None
+        try:
+            body = self._create_request_body(payload)
+            st = time.perf_counter()
+            resp = self._session.post(self._url, json=body, headers=self._headers)
+            response = resp.content
+            latency = time.perf_counter() - st
+            resp.raise_for_status()
+            response_json = self._parse_response(payload, response)
+        except Exception as e:
+            logger.error(f"get_prediction, exception occurred while getting prediction for payload={payload} "
+                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+            latency = None
+        return FMBenchPredictionResponse(response_json=response_json, latency=latency)
+
+    async def get_prediction_async(self, payload: Dict) -> FMBenchPredictionResponse:
+        response_json = None
+        latency = None
+        response = None
+        try:
+            body = self._create_request_body(payload)
+            session = await self._http_session.get()
+            st = time.perf_counter()
+            async with session.post(self._url, json=body, headers=self._headers) as resp:
+                response = await resp.read()
+                latency = time.perf_counter() - st
+                resp.raise_for_status()
+            response_json = self._parse_response(payload, response)
+        except Exception as e:
+            logger.error(f"get_prediction_async, exception occurred while getting prediction for payload={payload} "
+                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+            latency = None
+        return FMBenchPredictionResponse(response_json=response_json, latency=latency)
+
+    async def aclose(self) -> None:
+        await self._http_session.close()
+
+    @property
+    def endpoint_name(self) -> str:
+        """The endpoint name property."""
+        return self._endpoint_name
+
+def create_predictor(endpoint_name: str, inference_spec: Dict | None):
+    return HTTPPredictor(endpoint_name, inference_spec)
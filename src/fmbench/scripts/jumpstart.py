@@ -2,6 +2,8 @@ import time
 from typing import Dict
 from sagemaker.predictor import Predictor
 from sagemaker.jumpstart.model import JumpStartModel
+from fmbench.aws_clients import get_client
+from fmbench.deployment_scheduler import wait_for_endpoint
 
 def deploy(experiment_config: Dict, role_arn: str) -> Dict:
     model = JumpStartModel(
@@ -20,9 +22,17 @@ def deploy(experiment_config: Dict, role_arn: str) -> Dict:
     if accept_eula is not None:
         predictor = model.deploy(initial_instance_count=experiment_config['instance_count'],
                                  accept_eula=accept_eula,
-                                 endpoint_name=ep_name)
+                                 endpoint_name=ep_name,
+                                 wait=False)
     else:
         predictor = model.deploy(initial_instance_count=experiment_config['instance_count'],
-                                 endpoint_name=ep_name)
+                                 endpoint_name=ep_name,
+                                 wait=False)
 
-    return dict(endpoint_name=predictor.endpoint_name, experiment_name=experiment_config['name'])
+    # poll for readiness with a jittered exponential backoff instead of the SDK waiter,
+    # in the region the endpoint was deployed in
+    region_name = predictor.sagemaker_session.boto_region_name
+    readiness = wait_for_endpoint(get_client('sagemaker', region_name), predictor.endpoint_name,
+                                  experiment_config.get('readiness_polling'))
+    return dict(endpoint_name=predictor.endpoint_name, experiment_name=experiment_config['name'],
+                ready_seconds=readiness['ready_seconds'])
@@ -0,0 +1,137 @@
+"""
+Mock model server for benchmarking without a real endpoint.
+
+The server speaks the TGI (`/generate`, `/invocations`) and the OpenAI completions
+(`/v1/completions`) APIs. It does not run a model: it sleeps for a latency computed
+from the number of prompt and completion tokens and returns a completion with the
+requested number of tokens. The latency model is
+
+    latency = base_latency_seconds
+              + prompt_token_latency_seconds * prompt_tokens
+              + completion_token_latency_seconds * completion_tokens
+
+multiplied by a uniformly distributed factor in [1 - jitter, 1 + jitter]. A fraction
+`error_rate` of the requests fail with a 500. Tokens are approximated by words.
+
+Run it standalone with `python -m fmbench.scripts.mock_inference_server --port 8080`.
+"""
+import json
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+from typing import Dict, Optional
+
+## set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# image name recorded in the endpoint description of mock endpoints, used by the cleanup step
+MOCK_SERVER_IMAGE: str = "fmbench-mock-inference-server"
+DEFAULT_PORT: int = 8080
+DEFAULT_MAX_NEW_TOKENS: int = 100
+HEALTH_PATH: str = "/health"
+SHUTDOWN_PATH: str = "/shutdown"
+
+DEFAULT_LATENCY_SPEC: Dict = dict(base_latency_seconds=0.05,
+                                  prompt_token_latency_seconds=0.0001,
+                                  completion_token_latency_seconds=0.01,
+                                  jitter=0.1,
+                                  error_rate=0.0,
+                                  seed=None)
+
+
+class MockModel:
+    """Latency and error model of the mock server."""
+
+    def __init__(self, latency_spec: Optional[Dict] = None):
+        self.spec: Dict = DEFAULT_LATENCY_SPEC | (latency_spec if latency_spec is not None else {})
+        # seeded so that a benchmark against the mock server is repeatable
+        self._random = random.Random(self.spec['seed'])
+
+    def latency(self, prompt_tokens: int, completion_tokens: int) -> float:
+        latency = (self.spec['base_latency_seconds']
+                   + self.spec['prompt_token_latency_seconds'] * prompt_tokens
+                   + self.spec['completion_token_latency_seconds'] * completion_tokens)
+        jitter = self.spec['jitter']
+        return max(0.0, latency * self._random.uniform(1 - jitter, 1 + jitter))
+
+    def fails(self) -> bool:
+        return self._random.random() < self.spec['error_rate']
+
+    async def generate(self, prompt: str, max_new_tokens: int) -> Optional[str]:
+        """Waits for the modelled latency and returns a completion, None for a failed request."""
+        prompt_tokens = len(prompt.split())
+        await asyncio.sleep(self.latency(prompt_tokens, max_new_tokens))
+        if self.fails():
+            return None
+        return " ".join(["token"] * max_new_tokens)
+
+
+def create_app(latency_spec: Optional[Dict] = None) -> web.Application:
+    model = MockModel(latency_spec)
+
+    async def tgi_generate(request: web.Request) -> web.Response:
+        body = await request.json()
+        parameters = body.get('parameters', {})
+        completion = await model.generate(body['inputs'], int(parameters.get('max_new_tokens', DEFAULT_MAX_NEW_TOKENS)))
+        if completion is None:
+            return web.json_response(dict(error="mock inference error"), status=500)
+        return web.json_response([dict(generated_text=completion)])
+
+    async def openai_completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        completion_tokens = int(body.get('max_tokens', DEFAULT_MAX_NEW_TOKENS))
+        completion = await model.generate(body['prompt'], completion_tokens)
+        if completion is None:
+            return web.json_response(dict(error=dict(message="mock inference error")), status=500)
+        return web.json_response(dict(object="text_completion",
+                                      model=body.get('model'),
+                                      choices=[dict(index=0, text=completion, finish_reason="length")],
+                                      usage=dict(prompt_tokens=len(body['prompt'].split()),
+                                                 completion_tokens=completion_tokens)))
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(dict(status="ok", latency_spec=model.spec))
+
+    async def shutdown(request: web.Request) -> web.Response:
+        # stop the server once this response has been sent
+        asyncio.get_running_loop().call_later(0.1, request.app['stop'].set)
+        return web.json_response(dict(status="shutting down"))
+
+    app = web.Application()
+    app.add_routes([web.post("/generate", tgi_generate),
+                    web.post("/invocations", tgi_generate),
+                    web.post("/v1/completions", openai_completions),
+                    web.get(HEALTH_PATH, health),
+                    web.post(SHUTDOWN_PATH, shutdown)])
+    return app
+
+
+async def serve(host: str, port: int, latency_spec: Optional[Dict] = None) -> None:
+    app = create_app(latency_spec)
+    app['stop'] = asyncio.Event()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"serve, mock inference server listening on http://{host}:{port}, latency_spec={latency_spec}")
+    try:
+        await app['stop'].wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock model server for benchmarking without a real endpoint.')
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency-spec', type=str, default=None,
+                        help=f'JSON with any of {list(DEFAULT_LATENCY_SPEC.keys())}')
+    args = parser.parse_args()
+    latency_spec = json.loads(args.latency_spec) if args.latency_spec is not None else None
+    asyncio.run(serve(args.host, args.port, latency_spec))
+
+
+if __name__ == "__main__":
+    main()
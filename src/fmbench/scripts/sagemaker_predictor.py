@@ -1,10 +1,16 @@
 import time
 import json
+import random
+import asyncio
+import aiohttp
 import logging
 import sagemaker
-from typing import Dict, Union
+from typing import Dict, Optional, Union
+from urllib.parse import quote
 from sagemaker.predictor import Predictor
 from sagemaker.serializers import JSONSerializer
+from fmbench.async_http import LoopBoundSession
+from fmbench.aws_clients import get_sagemaker_session, sign_request, max_retry_attempts
 from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
                                                FMBenchPredictionResponse)
 
@@ -12,6 +18,15 @@ from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+## the native async path retries like the standard retry mode of botocore does: throttling errors,
+## 5xx responses and connection errors, with a jittered exponential backoff capped at 20 seconds
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded'}
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+MAX_RETRY_BACKOFF_SECONDS: float = 20
+
+class _RetryableError(Exception):
+    pass
+
 class SageMakerPredictor(FMBenchPredictor):
     # overriding abstract method
     def __init__(self, endpoint_name: str, inference_spec: Dict | None):
@@ -22,43 +37,129 @@ class SageMakerPredictor(FMBenchPredictor):
             # Create a SageMaker Predictor object
             self._predictor = Predictor(
                 endpoint_name=self._endpoint_name,
-                sagemaker_session=sagemaker.Session(),
+                sagemaker_session=get_sagemaker_session(),
                 serializer=JSONSerializer()
             )
         except Exception as e:
             logger.error(f"create_predictor, exception occured while creating predictor for endpoint_name={self._endpoint_name}, exception={e}")
+        self._http_session = LoopBoundSession()
         logger.info(f"__init__ self._predictor={self._predictor}")
+
+    def _split_input_and_inference_params(self) -> bool:
+        if self._inference_spec is None:
+            return False
+        return self._inference_spec.get("split_input_and_parameters") is True
+
+    def _native_async(self) -> bool:
+        # opt-in, requests are sent through boto3 from a thread pool by default
+        if self._inference_spec is None:
+            return False
+        return self._inference_spec.get("native_async") is True
+
+    @staticmethod
+    def _error_code(headers, body: bytes) -> Optional[str]:
+        # the error code is in the x-amzn-ErrorType header (e.g. "ThrottlingException:http://...") or in the body
+        error_type = headers.get('x-amzn-ErrorType')
+        if error_type:
+            return error_type.split(':')[0]
+        try:
+            error = json.loads(body)
+            return error.get('__type', error.get('code')) if isinstance(error, dict) else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_response(response) -> Dict:
+        if isinstance(response, bytes):
+            response = response.decode('utf-8')
+        response_json = json.loads(response)
+
+        if isinstance(response_json, list):
+            response_json = response_json[0]
+        # add a key called completion, if not there
+        if response_json.get("generated_text") is None:
+            if response_json.get("predicted_label") is not None:
+                response_json["generated_text"] = response_json.get("predicted_label")
+        return response_json
         
     def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
         response_json = None
         latency = None
         try:
             st = time.perf_counter()
-            split_input_and_inference_params = None
-            if self._inference_spec is not None:
-                split_input_and_inference_params = self._inference_spec.get("split_input_and_parameters")
             response = None
-            if split_input_and_inference_params is True:
+            if self._split_input_and_inference_params() is True:
                 response = self._predictor.predict(payload["inputs"], payload["parameters"])
             else:
                 response = self._predictor.predict(payload)
             
             latency = time.perf_counter() - st
-            if isinstance(response, bytes):
-                response = response.decode('utf-8')
-            response_json = json.loads(response)
-            
-            if isinstance(response_json, list):
-                response_json = response_json[0]
-            # add a key called completion, if not there
-            if response_json.get("generated_text") is None:            
-                if response_json.get("predicted_label") is not None:                    
-                    response_json["generated_text"] = response_json.get("predicted_label")
+            response_json = self._parse_response(response)
                  
         except Exception as e:
             logger.error(f"get_prediction, exception occurred while getting prediction for payload={payload} "
                          f"from predictor={self._endpoint_name}, response={response}, exception={e}")
         return FMBenchPredictionResponse(response_json=response_json, latency=latency)
+
+    async def _invoke_async(self, session: aiohttp.ClientSession, url: str, region: str, body: bytes) -> bytes:
+        # the request is signed for every attempt since the signature includes the time
+        headers = sign_request('sagemaker', region, 'POST', url, body,
+                               {'Content-Type': 'application/json', 'Accept': 'application/json'})
+        try:
+            async with session.post(url, data=body, headers=headers) as resp:
+                response = await resp.read()
+                if resp.status == 200:
+                    return response
+                error_code = self._error_code(resp.headers, response)
+                error = f"status={resp.status}, error_code={error_code}, response={response[:200]}"
+                if resp.status in RETRYABLE_STATUS_CODES or error_code in THROTTLING_ERROR_CODES:
+                    raise _RetryableError(error)
+                raise RuntimeError(error)
+        except aiohttp.ClientConnectionError as e:
+            raise _RetryableError(f"connection error={e}")
+
+    async def get_prediction_async(self, payload: Dict) -> FMBenchPredictionResponse:
+        # invokes the endpoint over aiohttp with a SigV4 signed request so that the event loop
+        # is not blocked and the number of requests in flight is not capped by a thread pool,
+        # the latency includes the retries as it does for requests sent through boto3
+        response_json = None
+        latency = None
+        response = None
+        try:
+            # the endpoint url is resolved by botocore, it differs across partitions (e.g. aws-cn)
+            runtime_client = self._predictor.sagemaker_session.sagemaker_runtime_client
+            region = runtime_client.meta.region_name
+            url = f"{runtime_client.meta.endpoint_url}/endpoints/{quote(self._endpoint_name, safe='')}/invocations"
+            body = json.dumps(payload).encode('utf-8')
+            session = await self._http_session.get()
+            retries = max_retry_attempts()
+            st = time.perf_counter()
+            for attempt in range(retries + 1):
+                try:
+                    response = await self._invoke_async(session, url, region, body)
+                    break
+                except _RetryableError as e:
+                    if attempt == retries:
+                        raise
+                    delay = min(MAX_RETRY_BACKOFF_SECONDS, random.random() * 2 ** attempt)
+                    logger.warning(f"get_prediction_async, endpoint={self._endpoint_name}, retry {attempt + 1}/{retries} "
+                                   f"in {delay:.2f}s, error={e}")
+                    await asyncio.sleep(delay)
+            latency = time.perf_counter() - st
+            response_json = self._parse_response(response)
+        except Exception as e:
+            logger.error(f"get_prediction_async, exception occurred while getting prediction for payload={payload} "
+                         f"from predictor={self._endpoint_name}, response={response}, exception={e}")
+            latency = None
+        return FMBenchPredictionResponse(response_json=response_json, latency=latency)
+
+    @property
+    def supports_async(self) -> bool:
+        # the inputs and parameters are sent separately through the sagemaker sdk in this case
+        return self._native_async() is True and self._split_input_and_inference_params() is False
+
+    async def aclose(self) -> None:
+        await self._http_session.close()
     
     @property
     def endpoint_name(self) -> str:
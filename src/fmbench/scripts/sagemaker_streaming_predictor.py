@@ -0,0 +1,71 @@
+import time
+import json
+import logging
+from typing import Dict, Optional
+from fmbench.aws_clients import get_client
+from fmbench.scripts.token_stream import TokenStreamParser
+from fmbench.scripts.fmbench_predictor import (FMBenchPredictor,
+                                               FMBenchPredictionResponse)
+
+## set a logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SageMakerStreamingPredictor(FMBenchPredictor):
+    """
+    Predictor for SageMaker endpoints that support response streaming (TGI, DJL LMI, TRT-LLM).
+    Besides the end to end latency this records the time to first token, the inter-token
+    latency distribution and the decode throughput for every request.
+    """
+    # overriding abstract method
+    def __init__(self, endpoint_name: str, inference_spec: Dict | None):
+        self._endpoint_name: str = endpoint_name
+        self._inference_spec = inference_spec
+        self._sm_runtime_client = None
+        try:
+            self._sm_runtime_client = get_client('sagemaker-runtime')
+        except Exception as e:
+            logger.error(f"create_predictor, exception occured while creating predictor for endpoint_name={self._endpoint_name}, exception={e}")
+        logger.info(f"__init__ self._sm_runtime_client={self._sm_runtime_client}")
+
+    def _create_request_body(self, payload: Dict) -> str:
+        # the TGI and LMI containers only stream the response if asked to do so in the payload,
+        # this can be turned off through the inference_spec for containers that always stream
+        add_stream_parameter: bool = True
+        if self._inference_spec is not None:
+            add_stream_parameter = self._inference_spec.get("add_stream_parameter", True)
+        if add_stream_parameter is True:
+            payload = payload | dict(stream=True)
+        return json.dumps(payload)
+
+    def get_prediction(self, payload: Dict) -> FMBenchPredictionResponse:
+        response_json = None
+        latency = None
+        stream_metrics: Dict = {}
+        parser = TokenStreamParser()
+        try:
+            body = self._create_request_body(payload)
+            st = time.perf_counter()
+            response = self._sm_runtime_client.invoke_endpoint_with_response_stream(EndpointName=self._endpoint_name,
+                                                                                    Body=body,
+                                                                                    ContentType="application/json")
+            for event in response['Body']:
+                payload_part: Optional[Dict] = event.get('PayloadPart')
+                if payload_part is not None:
+                    parser.feed(payload_part['Bytes'], time.perf_counter())
+            parser.close(time.perf_counter())
+            latency = time.perf_counter() - st
+            stream_metrics = parser.metrics(st)
+            response_json = dict(generated_text=parser.generated_text)
+        except Exception as e:
+            logger.error(f"get_prediction, exception occurred while getting prediction for payload={payload} "
+                         f"from predictor={self._endpoint_name}, exception={e}")
+        return FMBenchPredictionResponse(response_json=response_json, latency=latency, **stream_metrics)
+
+    @property
+    def endpoint_name(self) -> str:
+        """The endpoint name property."""
+        return self._endpoint_name
+
+def create_predictor(endpoint_name: str, inference_spec: Dict | None):
+    return SageMakerStreamingPredictor(endpoint_name, inference_spec)
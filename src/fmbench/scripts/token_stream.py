@@ -0,0 +1,121 @@
+"""
+Incremental parser for the token streams returned by streaming inference endpoints.
+
+Handles server sent events (`data:{...}`) as returned by TGI and JSON lines as returned
+by the DJL LMI containers (including TensorRT-LLM), the bytes can arrive split across
+arbitrary boundaries so lines are buffered until they are complete.
+"""
+import json
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SSE_DATA_PREFIX: str = "data:"
+SSE_DONE_MARKER: str = "[DONE]"
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest rank percentile, q is between 0 and 100."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _parse_event(event: Dict) -> Tuple[List[str], Optional[str]]:
+    """Returns the list of token texts and the final generated text (if any) contained in one event."""
+    tokens: List[str] = []
+    token = event.get("token")
+    if isinstance(token, dict):
+        if token.get("special") is not True:
+            tokens.append(token.get("text", ""))
+    elif isinstance(event.get("outputs"), list):
+        tokens.extend([str(o) for o in event["outputs"]])
+    elif isinstance(event.get("choices"), list):
+        for choice in event["choices"]:
+            text = choice.get("text")
+            if text is None:
+                text = choice.get("delta", {}).get("content")
+            if text:
+                tokens.append(text)
+    return tokens, event.get("generated_text")
+
+
+class TokenStreamParser:
+    """Parses a token stream incrementally and records the arrival time of every token."""
+
+    def __init__(self):
+        self._buffer: bytes = b""
+        self._token_texts: List[str] = []
+        self._generated_text: Optional[str] = None
+        self.token_times: List[float] = []
+
+    def _parse_line(self, line: bytes, t: float) -> None:
+        line = line.strip()
+        if not line:
+            return
+        text = line.decode("utf-8")
+        if text.startswith(SSE_DATA_PREFIX):
+            text = text[len(SSE_DATA_PREFIX):].strip()
+        elif text.startswith(":") or text.startswith("event:"):
+            # sse comments and event names carry no tokens
+            return
+        if text == SSE_DONE_MARKER:
+            return
+        try:
+            event = json.loads(text)
+        except json.JSONDecodeError:
+            logger.debug(f"_parse_line, ignoring non json line={text}")
+            return
+        if not isinstance(event, dict):
+            return
+        tokens, generated_text = _parse_event(event)
+        for token_text in tokens:
+            self._token_texts.append(token_text)
+            self.token_times.append(t)
+        if generated_text is not None:
+            self._generated_text = generated_text
+
+    def feed(self, data: bytes, t: float) -> None:
+        """Feeds a chunk of bytes received at time t (as returned by time.perf_counter)."""
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._parse_line(line, t)
+
+    def close(self, t: float) -> None:
+        """Parses whatever is left in the buffer once the stream has ended."""
+        if self._buffer:
+            self._parse_line(self._buffer, t)
+            self._buffer = b""
+
+    @property
+    def generated_text(self) -> str:
+        if self._generated_text is not None:
+            return self._generated_text
+        return "".join(self._token_texts)
+
+    def metrics(self, start: float) -> Dict:
+        """
+        Time to first token, inter-token latency distribution and decode throughput
+        for a stream that was requested at time `start`.
+        """
+        if not self.token_times:
+            return dict(time_to_first_token=None,
+                        inter_token_latency_mean=None,
+                        inter_token_latency_p50=None,
+                        inter_token_latency_p90=None,
+                        inter_token_latency_p99=None,
+                        decode_tokens_per_second=None)
+        inter_token_latencies = sorted([t2 - t1 for t1, t2 in zip(self.token_times, self.token_times[1:])])
+        decode_time = self.token_times[-1] - self.token_times[0]
+        itl_mean = sum(inter_token_latencies) / len(inter_token_latencies) if inter_token_latencies else None
+        decode_tokens_per_second = (len(self.token_times) - 1) / decode_time if decode_time > 0 else None
+        return dict(time_to_first_token=self.token_times[0] - start,
+                    inter_token_latency_mean=itl_mean,
+                    inter_token_latency_p50=_percentile(inter_token_latencies, 50),
+                    inter_token_latency_p90=_percentile(inter_token_latencies, 90),
+                    inter_token_latency_p99=_percentile(inter_token_latencies, 99),
+                    decode_tokens_per_second=decode_tokens_per_second)
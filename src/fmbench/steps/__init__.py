@@ -0,0 +1,13 @@
+"""
+The steps of an FMBench run as plain functions of a PipelineContext, called by the notebooks and by the
+in-process mode of main.py (see fmbench.pipeline) so that both run the same code.
+"""
+from fmbench.steps.context import PipelineContext
+from fmbench.steps.setup import setup
+from fmbench.steps.generate_data import generate_data
+from fmbench.steps.deploy import deploy
+from fmbench.steps.run_inference import run_inference
+from fmbench.steps.analyze import analyze
+from fmbench.steps.cleanup import cleanup
+
+__all__ = ["PipelineContext", "setup", "generate_data", "deploy", "run_inference", "analyze", "cleanup"]
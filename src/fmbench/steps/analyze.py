@@ -0,0 +1,387 @@
+"""
+Analyze step: summarizes the metrics of the run, plots the latency and the error rates of every instance type and
+concurrency level, scores the price performance of every option and writes the report to the metrics directory.
+"""
+import io
+import os
+import glob
+import logging
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from pathlib import Path
+from tomark import Tomark
+from datetime import datetime
+import matplotlib.pyplot as plt
+from typing import Dict, List, Optional, Tuple
+from fmbench.globals import (METRICS_PATH_FNAME, LATENCY_BUDGET, LATENCY_BUDGET_PERCENTILE, PLACE_HOLDER, RESULTS_DIR,
+                             OVERALL_RESULTS_MD, RESULT_DESC, RESULT_ROW, RESULT_FAILURE_DESC, RESULTS_DESC_MD_FNAME,
+                             COUNTS_FNAME, ERROR_RATES_FNAME, STREAMING_METRICS_FNAME, INSTANCE_PRICING_PER_HOUR_FNAME,
+                             SUMMARY_METRICS_W_PRICING_FNAME, SUMMARY_METRICS_FOR_DATASET_W_SCORES_FNAME,
+                             SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_FNAME,
+                             SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_EACH_INSTANCE_TYPE_FNAME,
+                             SUMMARY_MODEL_ENDPOINT_COST_PER_INSTANCE, BUSINESS_SUMMARY_PLOT_FNAME,
+                             ERROR_RATES_PLOT_TEXT, ERROR_RATES_PLOT_FNAME, TOKENS_VS_LATENCY_PLOT_TEXT,
+                             TOKENS_VS_LATENCY_PLOT_FNAME, CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_TEXT,
+                             CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_FNAME)
+from fmbench.utils import get_s3_object, write_to_s3, download_multiple_files_from_s3
+from fmbench.histogram import latency_percentiles, percentile_col, LATENCY_PERCENTILES, LATENCY_HISTOGRAM_COL
+from fmbench.steps.context import PipelineContext
+
+logger = logging.getLogger(__name__)
+
+# columns of the summary metrics, the streaming metrics columns are not present in results from older runs
+SUMMARY_COLS: List[str] = ['experiment_name', 'payload_file', 'instance_type', 'concurrency', 'error_rate',
+                           'prompt_token_count_mean', 'prompt_token_throughput', 'completion_token_count_mean',
+                           'completion_token_throughput', 'latency_mean', 'transactions_per_minute',
+                           'time_to_first_token_mean', 'inter_token_latency_mean', 'decode_tokens_per_second_mean']
+GROUP_BY_COLS: List[str] = ['experiment_name', 'payload_file', 'instance_type', 'concurrency']
+INT_COLS: List[str] = ['prompt_token_count_mean', 'prompt_token_throughput', 'completion_token_count_mean',
+                       'completion_token_throughput', 'transactions_per_minute']
+
+BUSINESS_SUMMARY: str = """We did performance benchmarking for the `{model_name}` model on "{instance_types}" instance{plural} on multiple datasets and based on the test results the best price performance for dataset `{ds}` is provided by the `{selected_instance_type}` instance type.  {mkdn_table}
+
+The price performance comparison for different instance types is presented below:
+
+![Price performance comparison]({business_summary_plot_fpath})
+
+The configuration used for these tests is available in the [`config`]({cfg_file_path}) file.
+
+The cost to run each experiment is provided in the table below. The total cost for running all experiments is {total_cost_as_str}.
+
+{cost_table}
+
+"""
+
+OVERALL_RESULTS_PLOTS_MD: str = """
+
+## Plots
+
+The following plots provide insights into the results from the different experiments run.
+
+![{plot1_text}]({plot1_fname})
+
+![{plot2_text}]({plot2_fname})
+
+![{plot3_text}]({plot3_fname})
+"""
+
+
+def read_metrics_csv(bucket: str, metrics_dir: str, file_name: str) -> pd.DataFrame:
+    key = os.path.join(metrics_dir, file_name)
+    df = pd.read_csv(io.StringIO(get_s3_object(bucket, key)))
+    logger.info(f"read_metrics_csv, {key} read into dataframe of shape {df.shape}")
+    return df
+
+
+def write_csv(df: pd.DataFrame, bucket: str, metrics_dir: str, file_name: str) -> None:
+    csv_buffer = io.StringIO()
+    df.to_csv(csv_buffer, index=False)
+    write_to_s3(csv_buffer.getvalue(), bucket, "", metrics_dir, file_name)
+    logger.info(f"write_csv, dataframe of shape={df.shape} saved to s3://{bucket}/{metrics_dir}/{file_name}")
+
+
+def save_plot(figure, bucket: str, metrics_dir: str, file_name: str) -> None:
+    # every plot is saved to a buffer of its own, a reused buffer would carry the bytes of the previous plot
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    write_to_s3(buffer.getvalue(), bucket, "", metrics_dir, file_name)
+    logger.info(f"save_plot, plot saved to s3://{bucket}/{metrics_dir}/{file_name}")
+
+
+def load_results(ctx: PipelineContext) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    """
+    Returns the per inference results, the per chunk metrics and the metrics directory of the run, from the
+    run inference step or else from the files it wrote to S3 (the metrics directory is in metrics_path.txt).
+    """
+    config = ctx.config
+    metrics_dir = ctx.metrics_dir
+    if metrics_dir is None:
+        metrics_path_file = os.path.join(config['dir_paths']['metadata_dir'], METRICS_PATH_FNAME)
+        metrics_dir = Path(metrics_path_file).read_text().strip()
+        logger.info(f"load_results, metrics_path_file={metrics_path_file}, metrics_dir={metrics_dir}")
+    df_per_inference, df_all_metrics = ctx.df_responses, ctx.df_metrics
+    if df_per_inference is None:
+        df_per_inference = read_metrics_csv(config['aws']['bucket'], metrics_dir, config["report"]["per_inference_request_file"])
+    if df_all_metrics is None:
+        df_all_metrics = read_metrics_csv(config['aws']['bucket'], metrics_dir, config["report"]["all_metrics_file"])
+    # warm-up requests are left out of the analysis unless report.include_warmup is set
+    if 'warmup' in df_per_inference.columns and not config['report'].get('include_warmup', False):
+        df_per_inference = df_per_inference[df_per_inference.warmup != True]
+        logger.info(f"load_results, excluded the warm-up requests, {df_per_inference.shape[0]} requests left for the analysis")
+    return df_per_inference, df_all_metrics, metrics_dir
+
+
+def plot_tokens_vs_latency(df_per_inference: pd.DataFrame, config: Dict):
+    """Scatter plot of the latency against the prompt length for every instance type and concurrency level."""
+    df = df_per_inference.rename(columns={"instance_type": "instance"})
+    if df.latency.min() < 1:
+        latency_units, multiplier, step_size = "milliseconds", 1000, 500
+        df.latency = df.latency * 1000
+    else:
+        latency_units, multiplier, step_size = "seconds", 10, 5
+
+    chart_spec = config['report'].get('latency_vs_token_len_chart') or {}
+    yticks: Optional[List] = chart_spec.get('y_ticks')
+    title: str = chart_spec.get('title') or "Effect of token length on inference latency"
+
+    if len(df.instance.unique()) == 1:
+        g = sns.FacetGrid(df, col="concurrency", hue="instance", height=3.5, aspect=1.25, col_wrap=3)
+    else:
+        g = sns.FacetGrid(df, col="concurrency", row="instance", hue="instance", height=3.5, aspect=1.25)
+    g.fig.suptitle(title)
+    g.map(sns.scatterplot, "prompt_tokens", "latency")
+    g.set_ylabels(f"Latency ({latency_units})")
+    if yticks is None:
+        # y-axis ticks based on the maximum latency
+        yticks = list(range(0, (int(df.latency.max()) // multiplier + 2) * multiplier, step_size))
+    g.set(yticks=yticks)
+    g.set_xlabels("Prompt length (tokens)")
+    return g.figure
+
+
+def streaming_metrics(df_per_inference: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """
+    Time to first token, inter-token latency and decode throughput of every combination, these are only recorded
+    when the experiments use a streaming predictor such as sagemaker_streaming_predictor.py.
+    """
+    streaming_cols = [c for c in ['time_to_first_token', 'inter_token_latency_mean', 'decode_tokens_per_second']
+                      if c in df_per_inference.columns]
+    df_streaming = df_per_inference.dropna(subset=streaming_cols[:1]) if streaming_cols else pd.DataFrame()
+    if df_streaming.shape[0] == 0:
+        return None
+    return df_streaming.rename(columns={"instance_type": "instance"}).groupby(['experiment_name', 'instance', 'concurrency']).agg(
+        time_to_first_token_mean=('time_to_first_token', 'mean'),
+        time_to_first_token_p50=('time_to_first_token', lambda x: x.quantile(0.5)),
+        time_to_first_token_p90=('time_to_first_token', lambda x: x.quantile(0.9)),
+        time_to_first_token_p99=('time_to_first_token', lambda x: x.quantile(0.99)),
+        inter_token_latency_mean=('inter_token_latency_mean', 'mean'),
+        decode_tokens_per_second_mean=('decode_tokens_per_second', 'mean')).reset_index().round(4)
+
+
+def plot_error_rates(df_error_rates: pd.DataFrame):
+    df = df_error_rates.rename(columns={"instance_type": "instance", "payload_file": "dataset"})
+    # the dataset names without the json file extension and prefix
+    df.dataset = df.dataset.map(lambda x: x.replace(".jsonl", "").replace("payload_", ""))
+    g = sns.FacetGrid(df, col="instance", row="dataset", hue="instance", height=3.5, aspect=1.25)
+    g.map(sns.scatterplot, "concurrency", "error_rate")
+    g.fig.suptitle("Inference error rates for different concurrency levels and instance types")
+    g.set_ylabels("Error rate (failed / total inferences)")
+    g.set_xlabels("Concurrency level")
+    return g.figure
+
+
+def plot_concurrency_vs_latency(df_all_metrics: pd.DataFrame, ds: str):
+    df = df_all_metrics.rename(columns={"instance_type": "instance", "payload_file": "dataset"})
+    df.dataset = df.dataset.map(lambda x: x.replace(".jsonl", "").replace("payload_", ""))
+    df = df[df.dataset.str.contains(ds)]
+    row_order = list(df[["instance", "latency_mean"]].groupby("instance").mean("latency_mean").reset_index()["instance"])
+    g = sns.catplot(data=df, x='concurrency', y='latency_mean', col='instance', kind='box',
+                    col_wrap=len(row_order), hue="instance", row_order=row_order)
+    g._legend.remove()
+    g.fig.suptitle(f"Effect of concurrency on inference latency for each instance type for the {ds} dataset\n\n")
+    g.set_ylabels("Latency (seconds)")
+    g.set_xlabels("Concurrency level")
+    g.fig.subplots_adjust(top=0.8)
+    return g.figure
+
+
+def summarize_metrics(df_all_metrics: pd.DataFrame, config: Dict) -> Tuple[pd.DataFrame, str, str]:
+    """
+    Returns the mean of the metrics of every combination with its tail latencies and its stop reason, the column
+    the latency budget applies to and the name of its statistic.
+    """
+    relevant_cols = [c for c in SUMMARY_COLS if c in df_all_metrics.columns]
+    df_summary_metrics = df_all_metrics[relevant_cols].groupby(GROUP_BY_COLS).mean().reset_index()
+
+    # the latency budget applies to the mean latency unless a percentile is configured
+    latency_budget_percentile: Optional[float] = config['report'].get('latency_budget_percentile', LATENCY_BUDGET_PERCENTILE)
+    latency_col: str = "latency_mean"
+    latency_stat: str = "mean"
+
+    # tail latencies from the merged latency histograms of the chunks, results from older runs do not have them
+    if LATENCY_HISTOGRAM_COL in df_all_metrics.columns:
+        percentiles = sorted(set(LATENCY_PERCENTILES + ([latency_budget_percentile] if latency_budget_percentile is not None else [])))
+        df_latency_percentiles = latency_percentiles(df_all_metrics, GROUP_BY_COLS, percentiles)
+        df_summary_metrics = pd.merge(df_summary_metrics, df_latency_percentiles, how='left', on=GROUP_BY_COLS)
+        if latency_budget_percentile is not None:
+            latency_col = percentile_col(latency_budget_percentile)
+            latency_stat = f"p{latency_budget_percentile:g}"
+    elif latency_budget_percentile is not None:
+        logger.warning(f"summarize_metrics, no latency histograms in the metrics, latency_budget_percentile={latency_budget_percentile} "
+                       f"cannot be used, the latency budget applies to the mean latency")
+
+    # number of requests sent for each combination and why it stopped, with early stopping a combination
+    # stops before the end of the payload file once the latency estimate has converged
+    if 'sample_count' in df_all_metrics.columns:
+        df_stopping = df_all_metrics.groupby(GROUP_BY_COLS).agg(sample_count=('sample_count', 'max'),
+                                                                stop_reason=('stop_reason', 'first')).reset_index()
+        df_summary_metrics = pd.merge(df_summary_metrics, df_stopping, how='left', on=GROUP_BY_COLS)
+
+    df_summary_metrics.fillna(PLACE_HOLDER, inplace=True)
+    for ic in INT_COLS:
+        df_summary_metrics[ic] = df_summary_metrics[ic].astype(int)
+    df_summary_metrics.replace(PLACE_HOLDER, np.nan, inplace=True)
+    for c in ['latency_mean', 'error_rate'] + [c for c in df_summary_metrics.columns if c.startswith("latency_p")]:
+        df_summary_metrics[c] = df_summary_metrics[c].round(2)
+    return df_summary_metrics, latency_col, latency_stat
+
+
+def score_options(df_summary_metrics_dataset: pd.DataFrame, df_pricing: pd.DataFrame) -> pd.DataFrame:
+    """The price per transaction and the price performance score of every option."""
+    df = pd.merge(df_summary_metrics_dataset, df_pricing, how='left')
+    df['price_per_txn'] = (df['price_per_hour'] / 60) / df['transactions_per_minute']
+    df['score'] = 0.5 * (1 / df['price_per_txn']) + 0.5 * (1 / df['latency_mean'])
+    return df.sort_values(by="score", ascending=False)
+
+
+def plot_business_summary(df_best_option_per_instance_type: pd.DataFrame, num_instance_types: int, config: Dict):
+    """Bar plot of the cost of report.txn_count_for_showing_cost transactions with the best option of every instance type."""
+    txn_count_for_showing_cost: int = config["report"]["txn_count_for_showing_cost"]
+    price_tx_col_name = f"price_per_tx_{txn_count_for_showing_cost}_txn"
+    df = df_best_option_per_instance_type
+    ax = sns.barplot(df, x="instance_type", y=price_tx_col_name, hue="instance_type")
+    title: str = (f"Comparing performance of {config['general']['model_name']} across instance types for "
+                  f"{config['metrics']['dataset_of_interest']} dataset")
+    ax.set(xlabel="Instance type", ylabel=f"Cost per {txn_count_for_showing_cost:,} transactions (USD)", title=title)
+    v_shift = config["report"]["v_shift_w_single_instance" if num_instance_types == 1 else "v_shift_w_gt_one_instance"]
+    for _, r in df.iterrows():
+        text = f"{r['transactions_per_minute']} txn/min, {r['latency_mean']}s per txn"
+        ax.text(r['instance_type'], r[price_tx_col_name] + v_shift, text, fontsize=8, color="red", ha="center", va="center")
+    return ax.figure
+
+
+def results_rows(df_summary_metrics: pd.DataFrame, latency_budget: float, latency_col: str, latency_stat: str) -> List[str]:
+    """One row of the report for every instance type and dataset, with the highest concurrency within the latency budget."""
+    df_no_errors = df_summary_metrics[df_summary_metrics.error_rate == 0]
+    logger.info(f"results_rows, there are {len(df_no_errors)} entries out of {len(df_summary_metrics)} in the summary data "
+                f"for which error rate is 0")
+    result_rows: List[str] = []
+    for _, row in df_summary_metrics[['instance_type', 'payload_file']].drop_duplicates().iterrows():
+        instance_type, dataset = row['instance_type'], row['payload_file']
+        df_subset = df_no_errors[(df_no_errors.instance_type == instance_type) &
+                                 (df_no_errors.payload_file == dataset) &
+                                 (df_no_errors[latency_col] <= latency_budget)]
+        if df_subset.shape[0] > 0:
+            best = df_subset[df_subset.concurrency == df_subset.concurrency.max()].to_dict(orient='records')[0]
+            result_desc = RESULT_DESC.format(latency_budget=latency_budget,
+                                             latency_stat=latency_stat,
+                                             instance_type=instance_type,
+                                             dataset=dataset,
+                                             concurrency=best['concurrency'],
+                                             latency=best[latency_col],
+                                             prompt_size=int(best['prompt_token_count_mean']),
+                                             completion_size=int(best['completion_token_count_mean']),
+                                             tpm=int(best['transactions_per_minute']))
+        else:
+            logger.info(f"results_rows, there are NO options to choose from for instance_type={instance_type}, dataset={dataset}")
+            result_desc = RESULT_FAILURE_DESC.format(latency_budget=latency_budget,
+                                                     latency_stat=latency_stat,
+                                                     instance_type=instance_type,
+                                                     dataset=dataset)
+        result_rows.append(RESULT_ROW.format(instance_type=instance_type, dataset=dataset, desc=result_desc))
+    return result_rows
+
+
+def analyze(ctx: PipelineContext) -> str:
+    """
+    Writes the summary metrics, the plots and the report of the run to the metrics directory and downloads them into
+    the results directory. Sets ctx.df_summary_metrics, ctx.df_best_option_per_instance_type and ctx.report, returns
+    the report.
+    """
+    config = ctx.config
+    bucket = config['aws']['bucket']
+    ds: str = config['metrics']['dataset_of_interest']
+    df_per_inference, df_all_metrics, metrics_dir = load_results(ctx)
+    logger.info(f"analyze, {len(df_all_metrics.experiment_name.unique())} experiments, "
+                f"{len(df_all_metrics.instance_type.unique())} instance types")
+
+    with plt.rc_context({'figure.figsize': (10, 6)}):
+        save_plot(plot_tokens_vs_latency(df_per_inference, config), bucket, metrics_dir, TOKENS_VS_LATENCY_PLOT_FNAME)
+
+        df_streaming_metrics = streaming_metrics(df_per_inference)
+        if df_streaming_metrics is not None:
+            write_csv(df_streaming_metrics, bucket, metrics_dir, STREAMING_METRICS_FNAME)
+        else:
+            logger.info("analyze, no streaming metrics found in the per inference results, skipping")
+
+        # number of chunks and mean error rate of every combination
+        write_csv(df_all_metrics[GROUP_BY_COLS].value_counts().reset_index(), bucket, metrics_dir, COUNTS_FNAME)
+        df_error_rates = df_all_metrics.groupby(GROUP_BY_COLS).agg({'error_rate': 'mean'}).reset_index().round(2)
+        write_csv(df_error_rates, bucket, metrics_dir, ERROR_RATES_FNAME)
+        save_plot(plot_error_rates(df_error_rates), bucket, metrics_dir, ERROR_RATES_PLOT_FNAME)
+
+        latency_budget: float = config['report'].get('latency_budget', LATENCY_BUDGET)
+        df_summary_metrics, latency_col, latency_stat = summarize_metrics(df_all_metrics, config)
+        logger.info(f"analyze, latency_budget={latency_budget} seconds applies to {latency_col}")
+        summary_file_name = config["report"]["all_metrics_file"].replace("all_metrics", "all_metrics_summary")
+        write_csv(df_summary_metrics, bucket, metrics_dir, summary_file_name)
+        ctx.df_summary_metrics = df_summary_metrics
+
+        df_summary_metrics_dataset = df_summary_metrics[df_summary_metrics.payload_file.str.contains(ds)]
+        write_csv(df_summary_metrics_dataset, bucket, metrics_dir, SUMMARY_METRICS_W_PRICING_FNAME)
+        save_plot(plot_concurrency_vs_latency(df_all_metrics, ds), bucket, metrics_dir, CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_FNAME)
+
+        df_pricing = pd.DataFrame.from_dict(config['pricing'], orient='index').reset_index()
+        df_pricing.columns = ['instance_type', 'price_per_hour']
+        write_csv(df_pricing, bucket, metrics_dir, INSTANCE_PRICING_PER_HOUR_FNAME)
+
+        # the best option overall and for each instance type
+        df_scores = score_options(df_summary_metrics_dataset, df_pricing)
+        write_csv(df_scores, bucket, metrics_dir, SUMMARY_METRICS_FOR_DATASET_W_SCORES_FNAME)
+        df_best_option = df_scores[df_scores.score == df_scores.score.max()]
+        write_csv(df_best_option, bucket, metrics_dir, SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_FNAME)
+        df_scores = df_scores.dropna()
+        df_best_option_per_instance_type = df_scores.loc[df_scores.groupby(['instance_type']).score.idxmax()].copy()
+        write_csv(df_best_option_per_instance_type, bucket, metrics_dir,
+                  SUMMARY_METRICS_FOR_DATASET_W_SCORES_BEST_OPTION_EACH_INSTANCE_TYPE_FNAME)
+
+        txn_count_for_showing_cost: int = config["report"]["txn_count_for_showing_cost"]
+        price_tx_col_name = f"price_per_tx_{txn_count_for_showing_cost}_txn"
+        df_best_option_per_instance_type[price_tx_col_name] = (df_best_option_per_instance_type.price_per_txn *
+                                                               txn_count_for_showing_cost).round(2)
+        df_best_option_per_instance_type = df_best_option_per_instance_type.sort_values(by=price_tx_col_name)
+        ctx.df_best_option_per_instance_type = df_best_option_per_instance_type
+        business_summary_plot = plot_business_summary(df_best_option_per_instance_type,
+                                                      len(df_scores.instance_type.unique()), config)
+        save_plot(business_summary_plot, bucket, metrics_dir, BUSINESS_SUMMARY_PLOT_FNAME)
+
+    df_cost = ctx.df_cost if ctx.df_cost is not None else read_metrics_csv(bucket, metrics_dir, SUMMARY_MODEL_ENDPOINT_COST_PER_INSTANCE)
+    cost_mkdn_table = Tomark.table(df_cost.to_dict(orient='records'))
+
+    best_instance_type_info = df_best_option.round(6).to_dict(orient='records')[0]
+    del best_instance_type_info["score"]
+    mkdn_table = Tomark.table([{"Information": k, "Value": v} for k, v in best_instance_type_info.items()])
+    instance_types = df_summary_metrics.instance_type.unique()
+    business_summary: str = BUSINESS_SUMMARY.format(model_name=config['general']['model_name'],
+                                                    instance_types=", ".join([f"`{it}`" for it in instance_types]),
+                                                    plural="s" if len(instance_types) > 1 else "",
+                                                    ds=ds,
+                                                    selected_instance_type=best_instance_type_info['instance_type'],
+                                                    mkdn_table="\n" + mkdn_table,
+                                                    cfg_file_path=os.path.basename(ctx.run_context.config_file),
+                                                    business_summary_plot_fpath=BUSINESS_SUMMARY_PLOT_FNAME,
+                                                    cost_table=cost_mkdn_table,
+                                                    total_cost_as_str=f"${df_cost.cost.astype(float).sum():.2f}")
+
+    datasets_used = ", ".join([f"`{d}`" for d in config['s3_read_data']['source_data_files']])
+    report = OVERALL_RESULTS_MD.format(dttm=str(datetime.utcnow()), business_summary=business_summary, datasets=datasets_used)
+    report += "\n".join(results_rows(df_summary_metrics, latency_budget, latency_col, latency_stat))
+    report += OVERALL_RESULTS_PLOTS_MD.format(plot1_text=ERROR_RATES_PLOT_TEXT,
+                                              plot1_fname=ERROR_RATES_PLOT_FNAME,
+                                              plot2_text=TOKENS_VS_LATENCY_PLOT_TEXT,
+                                              plot2_fname=TOKENS_VS_LATENCY_PLOT_FNAME,
+                                              plot3_text=CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_TEXT,
+                                              plot3_fname=CONCURRENCY_VS_INFERENCE_LATENCY_PLOT_FNAME)
+    os.makedirs(metrics_dir, exist_ok=True)
+    Path(metrics_dir, RESULTS_DESC_MD_FNAME).write_text(report)
+    write_to_s3(report, bucket, "", metrics_dir, RESULTS_DESC_MD_FNAME)
+    logger.info(f"analyze, report saved to s3://{bucket}/{metrics_dir}/{RESULTS_DESC_MD_FNAME}")
+    ctx.report = report
+
+    # all the metrics and report files are downloaded locally
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    download_multiple_files_from_s3(bucket, metrics_dir, RESULTS_DIR)
+    logger.info(f"analyze, downloaded the metrics and reports into {RESULTS_DIR}:\n"
+                + "\n".join(glob.glob(os.path.join(RESULTS_DIR, "**"), recursive=True)))
+    return report
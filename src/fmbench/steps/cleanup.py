@@ -0,0 +1,32 @@
+"""
+Cleanup step: deletes the endpoints left deployed by the run.
+"""
+import os
+import json
+import logging
+from typing import Dict, List
+from fmbench.utils import get_s3_object
+from fmbench.globals import ENDPOINT_LIST_FNAME
+from fmbench.endpoints import delete_endpoint
+from fmbench.steps.context import PipelineContext
+
+logger = logging.getLogger(__name__)
+
+
+def cleanup(ctx: PipelineContext) -> List[Dict]:
+    """
+    Deletes every endpoint in ctx.endpoints, or else in endpoints.json, and returns them. In the pipelined mode
+    the endpoints have already been deleted by the inference step and only the ones it could not delete are left.
+    """
+    endpoint_info_list = ctx.endpoints
+    if endpoint_info_list is None:
+        endpoint_list_path = os.path.join(ctx.run_context.models_dir, ENDPOINT_LIST_FNAME)
+        endpoint_info_list = json.loads(get_s3_object(ctx.config['aws']['bucket'], endpoint_list_path))
+        logger.info(f"cleanup, found information for {len(endpoint_info_list)} endpoints, "
+                    f"bucket={ctx.config['aws']['bucket']}, key={endpoint_list_path}")
+    for item in endpoint_info_list:
+        try:
+            delete_endpoint(item)
+        except Exception as e:
+            logger.error(f"cleanup, error deleting endpoint={item['endpoint']['EndpointName']}, exception={e}")
+    return endpoint_info_list
@@ -0,0 +1,44 @@
+"""
+State shared by the steps of an FMBench run.
+"""
+import pandas as pd
+from functools import cached_property
+from typing import Dict, List, Optional
+from fmbench.utils import load_config
+from fmbench.run_context import RunContext, get_run_context
+
+
+class PipelineContext:
+    """
+    The config, the tokenizer, the endpoints and the DataFrames of a run. The config and the tokenizer
+    come from the run context, the other attributes are set by the step that creates them and are None
+    until then. A step whose inputs were not set by an earlier step (e.g. when every step runs in its own
+    notebook kernel) reads them from S3, where the earlier step wrote them.
+    """
+
+    def __init__(self, run_context: Optional[RunContext] = None):
+        self.run_context: RunContext = run_context if run_context is not None else get_run_context()
+        # prompt count and prompt length of every payload file, set by generate_data
+        self.df_payload_file_stats: Optional[pd.DataFrame] = None
+        # info of the endpoints that are deployed, set by deploy and in the pipelined mode by run_inference
+        # (to the endpoints it could not delete)
+        self.endpoints: Optional[List[Dict]] = None
+        self.df_deployment_times: Optional[pd.DataFrame] = None
+        # per inference and per chunk results merged with the endpoint info, set by run_inference
+        self.df_responses: Optional[pd.DataFrame] = None
+        self.df_metrics: Optional[pd.DataFrame] = None
+        self.df_cost: Optional[pd.DataFrame] = None
+        self.df_concurrency_search: Optional[pd.DataFrame] = None
+        self.metrics_dir: Optional[str] = None
+        # summary of the results and the report, set by analyze
+        self.df_summary_metrics: Optional[pd.DataFrame] = None
+        self.df_best_option_per_instance_type: Optional[pd.DataFrame] = None
+        self.report: Optional[str] = None
+
+    @cached_property
+    def config(self) -> Dict:
+        return load_config(self.run_context.config_file)
+
+    @property
+    def tokenizer(self):
+        return self.run_context.tokenizer
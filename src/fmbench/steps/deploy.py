@@ -0,0 +1,79 @@
+"""
+Deploy step: deploys the endpoints of every experiment and writes the info of the endpoints that came in
+service to endpoints.json in the models directory.
+"""
+import json
+import time
+import logging
+import pandas as pd
+from typing import Dict, List
+from fmbench.utils import write_to_s3
+from fmbench.globals import ENDPOINT_LIST_FNAME
+from fmbench.experiment_scheduler import is_pipelined
+from fmbench.steps.context import PipelineContext
+from fmbench.steps.setup import resolve_execution_role
+from fmbench.deployment_scheduler import run_deployments, deployment_scheduler_spec
+from fmbench.endpoints import deploy_model, get_all_info_for_endpoint, is_in_service, delete_endpoint
+
+logger = logging.getLogger(__name__)
+
+
+async def async_deploy_all_models(config: Dict) -> List[Dict]:
+    """
+    Deploys all of the models with up to deployment_scheduler.max_in_flight deployments in progress at a time,
+    the next deployment starts as soon as one completes and throttled deployments are retried with backoff.
+    """
+    spec: Dict = deployment_scheduler_spec(config)
+    deploy_fn = lambda experiment: deploy_model(experiment,
+                                                config['aws']['region'],
+                                                config['aws']['sagemaker_execution_role'])
+    return await run_deployments(config['experiments'], deploy_fn, spec['max_in_flight'], spec['max_throttling_retries'])
+
+
+def in_service_endpoints(endpoint_names: List[Dict]) -> List[Dict]:
+    """
+    Returns the info of the deployed endpoints, endpoints that were created but did not come in service are deleted
+    and left out. The deletion of an endpoint that is still being created (its readiness polling timed out) waits
+    until it can be deleted.
+    """
+    all_info = [info for info in map(get_all_info_for_endpoint, [ep for ep in endpoint_names if ep is not None])
+                if info is not None]
+    for info in [info for info in all_info if not is_in_service(info)]:
+        logger.error(f"in_service_endpoints, endpoint={info['endpoint']['EndpointName']} for "
+                     f"experiment={info['experiment_name']} is {info['endpoint'].get('EndpointStatus')}, deleting it")
+        try:
+            delete_endpoint(info)
+        except Exception as e:
+            logger.error(f"in_service_endpoints, error deleting endpoint={info['endpoint']['EndpointName']}, exception={e}")
+    return [info for info in all_info if is_in_service(info)]
+
+
+async def deploy(ctx: PipelineContext) -> List[Dict]:
+    """
+    Deploys the endpoints and sets ctx.endpoints and ctx.df_deployment_times. In the pipelined mode every endpoint
+    is deployed (and deleted) by the inference step instead and no endpoint is deployed here.
+    """
+    config = ctx.config
+    if config['aws'].get('sagemaker_execution_role') is None:
+        resolve_execution_role(ctx)
+    s = time.perf_counter()
+    if is_pipelined(config):
+        logger.info("deploy, experiment_scheduler.pipelined is set, the endpoints are deployed by the inference step")
+        endpoint_names = []
+    else:
+        endpoint_names = await async_deploy_all_models(config)
+    logger.info(f"deploy, endpoint_names -> {endpoint_names}, deployed in {time.perf_counter() - s:0.2f} seconds")
+
+    # time taken by every deployment and by every endpoint to become ready after it was created
+    ctx.df_deployment_times = pd.DataFrame([dict(experiment_name=ep['experiment_name'],
+                                                 endpoint_name=ep['endpoint_name'],
+                                                 deployment_seconds=ep.get('deployment_seconds'),
+                                                 ready_seconds=ep.get('ready_seconds'))
+                                            for ep in endpoint_names if ep is not None])
+    logger.info(f"deploy, deployment times:\n{ctx.df_deployment_times}")
+
+    ctx.endpoints = in_service_endpoints(endpoint_names)
+    endpoint_s3_path = write_to_s3(json.dumps(ctx.endpoints, indent=2, default=str),
+                                   config['aws']['bucket'], ctx.run_context.models_dir, "", ENDPOINT_LIST_FNAME)
+    logger.info(f"deploy, the s3 endpoints that are deployed are sent to this file --> {endpoint_s3_path}")
+    return ctx.endpoints
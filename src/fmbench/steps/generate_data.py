@@ -0,0 +1,78 @@
+"""
+Generate data step: converts the source data set into prompts and writes the payload files of every
+filter in datasets.filters to S3.
+"""
+import os
+import logging
+import pandas as pd
+from pathlib import Path
+from typing import List
+import importlib.resources as pkg_resources
+from fmbench.aws_clients import get_client
+from fmbench.globals import FMBENCH_PACKAGE_NAME
+from fmbench.dataset import update_payload_files
+from fmbench.steps.context import PipelineContext
+from fmbench.utils import count_tokens, read_from_s3, token_count_cache_stats
+
+logger = logging.getLogger(__name__)
+
+
+def load_prompt_template(ctx: PipelineContext) -> str:
+    """Returns the prompt template from S3, or the version packaged with fmbench if there is none in S3."""
+    s3_read_data = ctx.config['s3_read_data']
+    s3_file_path = "/".join([s3_read_data['prompt_template_dir'], s3_read_data['prompt_template_file']])
+    prompt_template = read_from_s3(s3_read_data['read_bucket'], s3_file_path)
+    if prompt_template is None:
+        prompt_template_dir = Path(pkg_resources.files(FMBENCH_PACKAGE_NAME), s3_read_data['prompt_template_dir'])
+        prompt_template = Path(prompt_template_dir, s3_read_data['prompt_template_file']).read_text()
+        logger.info(f"load_prompt_template, using the default local prompt template --> {prompt_template}")
+    else:
+        logger.info(f"load_prompt_template, using the prompt template from S3 --> {prompt_template}")
+    prompt_template = prompt_template.strip()
+
+    # number of tokens in the prompt template without any of its keys
+    empty_prompt_template = prompt_template.format(**{k: "" for k in ctx.config['datasets']['prompt_template_keys']})
+    logger.info(f"load_prompt_template, empty prompt template=\"{empty_prompt_template}\", "
+                f"length={count_tokens(empty_prompt_template)} tokens")
+    return prompt_template
+
+
+def list_source_files(ctx: PipelineContext) -> List[str]:
+    """Returns the S3 keys of the source data files selected in s3_read_data.source_data_files."""
+    s3_read_data = ctx.config['s3_read_data']
+    response = get_client('s3').list_objects_v2(Bucket=s3_read_data['read_bucket'],
+                                                Prefix=s3_read_data['source_data_prefix'])
+    s3_files = [obj['Key'] for obj in response['Contents']]
+    logger.info(f"list_source_files, s3 paths of the data set -> {s3_files}")
+    jsonl_files = [key for key in s3_files
+                   if key.replace(s3_read_data['source_data_prefix'] + "/", "") in s3_read_data['source_data_files']]
+    logger.info(f"list_source_files, jsonl_files={jsonl_files}")
+    return jsonl_files
+
+
+def generate_data(ctx: PipelineContext) -> pd.DataFrame:
+    """
+    Creates the payload files whose inputs (source files, prompt template, tokenizer, filter, inference parameters)
+    changed since the last run, the others are reused as recorded in the manifest. Sets and returns
+    ctx.df_payload_file_stats, the number of prompts and the distribution of the prompt length of every file.
+    """
+    config = ctx.config
+    prompt_template = load_prompt_template(ctx)
+    jsonl_files = list_source_files(ctx)
+    prompts_prefix = os.path.join(ctx.run_context.data_dir, config['dir_paths']['prompts_prefix'])
+    payload_file_stats = update_payload_files(config['s3_read_data']['read_bucket'],
+                                              jsonl_files,
+                                              config['datasets']['prompt_template_keys'],
+                                              prompt_template,
+                                              ctx.tokenizer.cache.fingerprint,
+                                              config['datasets']['filters'],
+                                              config['inference_parameters'],
+                                              config['aws']['bucket'],
+                                              prompts_prefix,
+                                              config['dir_paths'].get('all_prompts_file'),
+                                              config['dir_paths'].get('prompt_store_file'),
+                                              config['datasets'].get('reference_prompts_by_id', False))
+    logger.info(f"generate_data, token count cache stats={token_count_cache_stats()}")
+    ctx.df_payload_file_stats = pd.DataFrame(payload_file_stats)
+    logger.info(f"generate_data, payload files created ->\n{ctx.df_payload_file_stats}")
+    return ctx.df_payload_file_stats
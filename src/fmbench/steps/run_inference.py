@@ -0,0 +1,420 @@
+"""
+Run inference step: runs every experiment against its endpoint for the combinations of concurrency levels and
+payload files, writes the per inference and per chunk results, the cost of every endpoint and the results of the
+concurrency searches to the metrics directory.
+"""
+import io
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import logging
+import itertools
+import pandas as pd
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timezone
+import importlib.resources as pkg_resources
+from typing import Dict, List, Optional, Tuple
+from fmbench.globals import (LATENCY_BUDGET, LATENCY_BUDGET_PERCENTILE, PROMPT_ID_PAYLOAD_KEY, PAYLOAD_INDEX_KEY,
+                             METRICS_PATH_FNAME, ENDPOINT_LIST_FNAME, SUMMARY_MODEL_ENDPOINT_COST_PER_INSTANCE,
+                             CONCURRENCY_SEARCH_RESULTS_FNAME)
+from fmbench.utils import get_s3_object, write_to_s3, token_count_cache_stats
+from fmbench.results_sink import create_results_sink, read_part_files
+from fmbench.aws_clients import configure_clients, max_concurrency_in_config, get_client, pool_saturation_count
+from fmbench.experiment_scheduler import run_experiments, max_parallel_experiments
+from fmbench.experiment_scheduler import run_pipelined_experiments, is_pipelined, max_live_endpoints
+from fmbench.endpoints import deploy_endpoint, delete_endpoint, sagemaker_execution_role
+from fmbench.deployment_scheduler import deployment_scheduler_spec
+from fmbench.prompt_store import open_prompt_store, resolve_prompt_references
+from fmbench.run_journal import RunJournal, WARMUP_CHUNK_INDEX, DEFAULT_CHECKPOINT_SECONDS, remaining_payloads
+from fmbench.inference import run_inferences, should_warm_up, supports_async
+from fmbench.concurrency_search import ConcurrencySearch
+from fmbench.steps.context import PipelineContext
+
+logger = logging.getLogger(__name__)
+
+
+def load_endpoints(ctx: PipelineContext) -> List[Dict]:
+    """
+    Returns the info of the deployed endpoints, from the deploy step or else from endpoints.json. In the pipelined
+    mode the endpoints are deployed by this step and added to the list as they are deployed.
+    """
+    if is_pipelined(ctx.config):
+        return []
+    if ctx.endpoints is not None:
+        return list(ctx.endpoints)
+    endpoint_list_path = os.path.join(ctx.run_context.models_dir, ENDPOINT_LIST_FNAME)
+    endpoint_info_list = json.loads(get_s3_object(ctx.config['aws']['bucket'], endpoint_list_path))
+    logger.info(f"load_endpoints, found information for {len(endpoint_info_list)} endpoints in "
+                f"bucket={ctx.config['aws']['bucket']}, key={endpoint_list_path}")
+    return endpoint_info_list
+
+
+def create_predictor_for_experiment(experiment: Dict, endpoint_info_list: List[Dict]):
+    """Creates the predictor of the experiment with the create_predictor function of its inference script."""
+    ep_info = [e for e in endpoint_info_list if e['experiment_name'] == experiment['name']]
+    if not ep_info:
+        logger.error(f"create_predictor_for_experiment, endpoint for experiment={experiment['name']} not found, skipping")
+        return None
+    ep_name = ep_info[0]['endpoint']['EndpointName']
+    inference_spec = experiment.get("inference_spec")
+    logger.info(f"create_predictor_for_experiment, experiment name={experiment['name']}, ep_name={ep_name}, "
+                f"inference_spec={inference_spec}")
+
+    scripts_dir = Path(pkg_resources.files('fmbench'), 'scripts')
+    scripts_dir.mkdir(parents=True, exist_ok=True)
+    module_name = Path(experiment['inference_script']).stem
+    script_path = scripts_dir / f"{module_name}.py"
+    logger.info(f"create_predictor_for_experiment, script path is --> {script_path}")
+    if not script_path.exists():
+        logger.error(f"create_predictor_for_experiment, script {script_path} not found.")
+        return None
+
+    spec = importlib.util.spec_from_file_location(module_name, str(script_path))
+    inference_module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = inference_module
+    spec.loader.exec_module(inference_module)
+    return inference_module.create_predictor(ep_name, inference_spec)
+
+
+def read_payload_list(ctx: PipelineContext, payload_file: str) -> Optional[List[Dict]]:
+    """Reads the payloads of the payload file from S3, None if the file could not be read."""
+    config = ctx.config
+    s3_file_path = os.path.join(ctx.run_context.prompts_dir, payload_file)
+    try:
+        response = get_client('s3').get_object(Bucket=config['aws']['bucket'], Key=s3_file_path)
+        payload_list = [json.loads(jline) for jline in response['Body'].read().decode('utf-8').splitlines()]
+        # payload files that reference the prompts by id are resolved against the memory mapped prompt store
+        if any(PROMPT_ID_PAYLOAD_KEY in p for p in payload_list):
+            prompt_store = open_prompt_store(config['aws']['bucket'],
+                                             os.path.join(ctx.run_context.prompts_dir, config['dir_paths']['prompt_store_file']))
+            payload_list = resolve_prompt_references(payload_list, prompt_store)
+        # the position of every payload in the file identifies the payloads that completed when a run is resumed
+        for payload_index, payload in enumerate(payload_list):
+            payload[PAYLOAD_INDEX_KEY] = payload_index
+        logger.info(f"read_payload_list, read from s3://{config['aws']['bucket']}/{s3_file_path}, "
+                    f"contains {len(payload_list)} lines")
+        return payload_list
+    except Exception as e:
+        logger.error(f"read_payload_list, error reading file from S3: {e}")
+        return None
+
+
+def create_combinations(ctx: PipelineContext, experiment: Dict) -> List[Tuple]:
+    """
+    Returns (concurrency, payload_file, split_payload) for every combination of the concurrency levels and the
+    payload files of the experiment, the payloads are split in chunks of concurrency payloads and a short chunk
+    is filled with the first payload of the chunk.
+    """
+    combinations_data = []
+    combinations = list(itertools.product(experiment['concurrency_levels'], experiment['payload_files']))
+    logger.info(f"create_combinations, there are {len(combinations)} combinations of {combinations} to run")
+    for concurrency, payload_file in combinations:
+        payload_list = read_payload_list(ctx, payload_file)
+        if payload_list is None:
+            continue
+        n = concurrency
+        if len(payload_list) < n:
+            payload_list.extend([payload_list[0]] * (n - len(payload_list)))
+        payload_list_splitted = [payload_list[i * n:(i + 1) * n] for i in range((len(payload_list) + n - 1) // n)]
+        for p in payload_list_splitted:
+            if len(p) < n:
+                p.extend([p[0]] * (n - len(p)))
+        logger.info(f"create_combinations, concurrency={concurrency}, payload_file={payload_file}, "
+                    f"payload_list length={len(payload_list)}, chunks={len(payload_list_splitted)}")
+        combinations_data.append((concurrency, payload_file, payload_list_splitted))
+    return combinations_data
+
+
+def clear_dir(dir_path: str) -> None:
+    for f in glob.glob(os.path.join(dir_path, "*")):
+        os.remove(f)
+
+
+def endpoints_frame(endpoint_info_list: List[Dict]) -> pd.DataFrame:
+    """The instance type, the model and the container environment of every endpoint, one row per experiment."""
+    df_endpoints = pd.json_normalize(endpoint_info_list)
+    # in the pipelined mode the list only has the endpoints that were deployed, it is empty if every deployment failed
+    if df_endpoints.empty:
+        df_endpoints = pd.DataFrame(columns=['experiment_name', 'endpoint_config.ProductionVariants'])
+    df_endpoints['instance_type'] = df_endpoints['endpoint_config.ProductionVariants'].map(lambda x: x[0]['InstanceType'])
+    cols_for_env = [c for c in df_endpoints.columns if 'Environment' in c]
+    cols_of_interest = ['experiment_name',
+                        'instance_type',
+                        'endpoint.EndpointName',
+                        'model_config.ModelName',
+                        'model_config.PrimaryContainer.Image',
+                        'model_config.PrimaryContainer.ModelDataSource.S3DataSource.S3Uri'] + cols_for_env
+    cols_of_interest = [c for c in cols_of_interest if c in df_endpoints.columns]
+    df_endpoints = df_endpoints[cols_of_interest]
+    df_endpoints.columns = [c.split('.')[-1] for c in cols_of_interest]
+    return df_endpoints
+
+
+def write_csv(df: pd.DataFrame, bucket: str, metrics_dir: str, file_name: str) -> str:
+    csv_buffer = io.StringIO()
+    df.to_csv(csv_buffer, index=False)
+    write_to_s3(csv_buffer.getvalue(), bucket, "", metrics_dir, file_name)
+    s3_path = f"s3://{bucket}/{os.path.join(metrics_dir, file_name)}"
+    logger.info(f"write_csv, saved dataframe of shape={df.shape} in {s3_path}")
+    return s3_path
+
+
+async def run_inference(ctx: PipelineContext) -> pd.DataFrame:
+    """
+    Runs the experiments and sets ctx.df_responses, ctx.df_metrics (both merged with the endpoint info), ctx.df_cost,
+    ctx.df_concurrency_search and ctx.metrics_dir. A resumed run continues in the metrics directory of the interrupted
+    run, from the chunks recorded in its journal. Returns ctx.df_metrics.
+    """
+    config = ctx.config
+    run_context = ctx.run_context
+    bucket = config['aws']['bucket']
+    metrics_dir = run_context.metrics_dir
+    date_time = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+
+    # size the connection pools of the shared AWS clients (used by the predictors as well) for the largest
+    # concurrency levels of the experiments that run in parallel so that requests do not wait for a free connection
+    configure_clients(max_concurrency_in_config(config, max_parallel_experiments(config)))
+    endpoint_info_list = load_endpoints(ctx)
+    logger.info(f"run_inference, endpoints={[e['endpoint']['EndpointName'] for e in endpoint_info_list]}")
+
+    if run_context.resume is False:
+        _ = list(map(clear_dir, [run_context.metrics_per_inference_dir, run_context.metrics_per_chunk_dir]))
+    journal = RunJournal(bucket, metrics_dir, run_context.run_id, run_context.resume,
+                         config.get('run_journal', {}).get('checkpoint_seconds', DEFAULT_CHECKPOINT_SECONDS))
+
+    # results of the experiments that search for the highest concurrency within the latency budget
+    concurrency_search_results = []
+    logger.info(f"run_inference, current time={datetime.now(timezone.utc)}, deployed models are going to start inferences")
+    num_experiments: int = len(config['experiments'])
+
+    async def run_experiment(e_idx: int, experiment: Dict) -> Optional[Dict]:
+        experiment_start_time = time.perf_counter()
+
+        predictor = create_predictor_for_experiment(experiment, endpoint_info_list)
+        if predictor is None:
+            logger.error(f"run_inference, predictor could not be created for experiment={experiment}, moving to next...")
+            return None
+
+        # every experiment has its own per-inference and per-chunk results stream, buffered and written
+        # to S3 as part files in the background
+        per_inference_sink = create_results_sink(config, os.path.join(run_context.metrics_per_inference_dir, experiment['name']),
+                                                 run_context.resume)
+        per_chunk_sink = create_results_sink(config, os.path.join(run_context.metrics_per_chunk_dir, experiment['name']),
+                                             run_context.resume)
+
+        def record_results(responses: List[Dict], metrics: Dict, concurrency: int, payload_file: str, chunk_index: int) -> None:
+            # every record carries its chunk and the attempt that produced it so that the records of
+            # chunks that were interrupted (and run again on resume) are not counted twice
+            tags = dict(run_id=run_context.run_id, attempt=journal.attempt, payload_file=payload_file, chunk_index=chunk_index)
+            if metrics:
+                per_chunk_sink.add(metrics | tags)
+            if responses:
+                for r in responses:
+                    per_inference_sink.add(r | tags)
+            # the journal keeps the payload index and the latency of every measured request
+            journal.record_chunk(experiment['name'], concurrency, payload_file, chunk_index, responses if metrics else None)
+
+        async def checkpoint(force: bool = True) -> None:
+            # the results and then the journal are written to S3 in a thread so that the requests in flight
+            # are not held up, a running combination is checkpointed every run_journal.checkpoint_seconds
+            if force or journal.is_checkpoint_due(experiment['name']):
+                await asyncio.to_thread(journal.flush, experiment['name'], [per_inference_sink, per_chunk_sink])
+
+        # concurrency levels for which the warm-up requests configured in the experiment have been sent
+        warmed_up_levels = set()
+
+        try:
+            if experiment.get('concurrency_search') is not None:
+                # search for the highest concurrency within the latency budget instead of sweeping concurrency_levels,
+                # the probed levels are recorded in the per chunk and per inference metrics like any other level
+                for payload_file in experiment['payload_files']:
+                    search_info = dict(experiment_name=experiment['name'], instance_type=experiment['instance_type'],
+                                       payload_file=payload_file)
+                    if journal.is_combination_done(experiment['name'], None, payload_file):
+                        logger.info(f"run_inference, concurrency search for experiment={experiment['name']}, "
+                                    f"payload_file={payload_file} completed before the run was resumed, skipping")
+                        concurrency_search_results.append(search_info | journal.combination_result(experiment['name'], None, payload_file))
+                        continue
+                    payload_list = read_payload_list(ctx, payload_file)
+                    if not payload_list:
+                        continue
+                    search_chunk_indices: Dict[int, int] = {}
+                    search = ConcurrencySearch(experiment['concurrency_search'],
+                                               config['report'].get('latency_budget', LATENCY_BUDGET),
+                                               config['report'].get('latency_budget_percentile', LATENCY_BUDGET_PERCENTILE))
+                    # the levels probed before the run was resumed are replayed from the journal, a level that was being
+                    # probed when the run was interrupted is probed again and its new chunks replace the earlier ones
+                    while ((concurrency := search.next_concurrency()) is not None
+                           and journal.is_combination_done(experiment['name'], concurrency, payload_file)):
+                        search.restore(journal.combination_result(experiment['name'], concurrency, payload_file))
+                    if search.trace:
+                        logger.info(f"run_inference, concurrency search for experiment={experiment['name']}, "
+                                    f"payload_file={payload_file}, resuming after {len(search.trace)} steps")
+                    # every completed step is recorded as a combination with the step as its result
+                    on_step = lambda step: journal.record_combination(experiment['name'], step['concurrency'], payload_file, step)
+                    async for responses, metrics in search.run(predictor, payload_list, experiment, payload_file,
+                                                               warmed_up_levels, on_step):
+                        concurrency = metrics['concurrency'] if metrics else responses[0]['concurrency']
+                        chunk_index = WARMUP_CHUNK_INDEX
+                        if metrics:
+                            chunk_index = search_chunk_indices[concurrency] = search_chunk_indices.get(concurrency, 0) + 1
+                        record_results(responses, metrics, concurrency, payload_file, chunk_index)
+                        await checkpoint(force=False)
+                    journal.record_combination(experiment['name'], None, payload_file, search.result())
+                    await checkpoint()
+                    concurrency_search_results.append(search_info | search.result())
+                combination_data = []
+            else:
+                combination_data = create_combinations(ctx, experiment)
+
+            for concurrency, payload_file, split_payload in combination_data:
+                if journal.is_combination_done(experiment['name'], concurrency, payload_file):
+                    logger.info(f"run_inference, experiment={experiment['name']}, concurrency={concurrency}, "
+                                f"payload_file={payload_file} completed before the run was resumed, skipping")
+                    continue
+                # only the payloads that did not complete before the run was resumed are sent, in the sliding-window and
+                # open-loop modes the completed chunks are not a slice of the payloads, so they are found by payload index
+                num_chunks: int = len(split_payload)
+                chunk_index = journal.completed_chunks(experiment['name'], concurrency, payload_file)
+                completed_latencies = None
+                if chunk_index > 0:
+                    completed_indices, completed_latencies = journal.completed_payloads(experiment['name'], concurrency, payload_file)
+                    split_payload = remaining_payloads(split_payload, completed_indices, concurrency)
+                    logger.info(f"run_inference, experiment={experiment['name']}, concurrency={concurrency}, "
+                                f"payload_file={payload_file}, resuming after {chunk_index}/{num_chunks} completed chunks, "
+                                f"{len(completed_indices)} completed requests")
+                saturation_count_before = pool_saturation_count()
+                warmup = should_warm_up(experiment, concurrency, warmed_up_levels)
+                async for responses, metrics in run_inferences(predictor, split_payload, experiment, concurrency, payload_file,
+                                                               warmup, completed_latencies):
+                    # the responses of the warm-up requests come without metrics
+                    if metrics:
+                        chunk_index += 1
+                        logger.info(f"run_inference, e_idx={e_idx}/{num_experiments}, chunk_index={chunk_index}/{num_chunks}")
+                    record_results(responses, metrics, concurrency, payload_file, chunk_index if metrics else WARMUP_CHUNK_INDEX)
+                    await checkpoint(force=False)
+                journal.record_combination(experiment['name'], concurrency, payload_file)
+                await checkpoint()
+                if warmup:
+                    warmed_up_levels.add(concurrency)
+                saturation_count = pool_saturation_count() - saturation_count_before
+                if saturation_count > 0:
+                    logger.warning(f"run_inference, connection pool was full {saturation_count} times for "
+                                   f"experiment={experiment['name']}, concurrency={concurrency}, payload_file={payload_file}, "
+                                   f"latencies may include connection setup")
+        finally:
+            # release the HTTP sessions of predictors with a native async interface
+            if supports_async(predictor):
+                await predictor.aclose()
+            # flush whatever is still buffered, the part file keys are used to read the results back, a sink
+            # raises if some results could not be written so the experiment is not reported as complete
+            try:
+                per_inference_part_keys = per_inference_sink.close()
+            finally:
+                per_chunk_part_keys = per_chunk_sink.close()
+
+        # experiments running in parallel are timed separately so every endpoint is charged for its own benchmarking time
+        experiment_duration = time.perf_counter() - experiment_start_time
+        hourly_rate = config['pricing'].get(experiment['instance_type'], 0)
+        exp_cost = experiment_duration * hourly_rate / 3600
+        logger.info(f"run_inference, experiment={e_idx}/{num_experiments}, name={experiment['name']}, "
+                    f"instance_type={experiment['instance_type']}, hourly_rate={hourly_rate}, "
+                    f"duration={experiment_duration:.2f} seconds, cost=${exp_cost}, done")
+        return dict(duration={'experiment_name': experiment['name'],
+                              'instance_type': experiment['instance_type'],
+                              'duration_in_seconds': f"{experiment_duration:.2f}",
+                              'cost': f"{exp_cost:.2f}"},
+                    cost=exp_cost,
+                    per_inference_part_keys=per_inference_part_keys,
+                    per_chunk_part_keys=per_chunk_part_keys)
+
+    def endpoint_of(experiment: Dict) -> str:
+        ep_info = [e for e in endpoint_info_list if e['experiment_name'] == experiment['name']]
+        return ep_info[0]['endpoint']['EndpointName'] if ep_info else experiment['name']
+
+    if is_pipelined(config):
+        # every experiment is deployed, benchmarked and deleted on its own, with up to
+        # experiment_scheduler.max_live_endpoints endpoints deployed at a time
+        role_arn = sagemaker_execution_role(config)
+
+        def deploy_fn(experiment: Dict) -> Optional[Dict]:
+            endpoint_info = deploy_endpoint(experiment, config['aws']['region'], role_arn)
+            if endpoint_info is not None:
+                endpoint_info_list.append(endpoint_info)
+            return endpoint_info
+
+        # throttled deployments are retried with backoff as they are by the deploy step
+        experiment_results = await run_pipelined_experiments(config['experiments'], deploy_fn, run_experiment, delete_endpoint,
+                                                              max_live_endpoints(config), max_parallel_experiments(config),
+                                                              deployment_scheduler_spec(config)['max_throttling_retries'])
+        # the endpoints are deleted as soon as their experiment is done, only the ones that could not be deleted
+        # are left for the cleanup step
+        ctx.endpoints = [r['endpoint'] for r in experiment_results if r is not None and r['endpoint_deleted'] is False]
+        if ctx.endpoints:
+            logger.error(f"run_inference, {len(ctx.endpoints)} endpoints could not be deleted, they are left for the cleanup step")
+        write_to_s3(json.dumps(ctx.endpoints, indent=2, default=str), bucket, run_context.models_dir, "", ENDPOINT_LIST_FNAME)
+    else:
+        # experiments against different endpoints run concurrently, up to experiment_scheduler.max_parallel_experiments at a time
+        experiment_results = await run_experiments(config['experiments'], run_experiment, max_parallel_experiments(config),
+                                                   endpoint_of)
+    experiment_results = [r for r in experiment_results if r is not None]
+
+    experiment_durations = []
+    for r in experiment_results:
+        # in the pipelined mode an endpoint is billed from the start of its deployment until it is deleted
+        if r.get('endpoint_lifetime_seconds') is not None:
+            # an experiment that failed after its endpoint was deployed has no results but its endpoint was billed
+            if r.get('duration') is None:
+                experiment = [e for e in config['experiments'] if e['name'] == r['endpoint']['experiment_name']][0]
+                r |= dict(duration={'experiment_name': experiment['name'],
+                                    'instance_type': experiment['instance_type'],
+                                    'duration_in_seconds': None},
+                          per_inference_part_keys=[],
+                          per_chunk_part_keys=[])
+            hourly_rate = config['pricing'].get(r['duration']['instance_type'], 0)
+            r['cost'] = r['endpoint_lifetime_seconds'] * hourly_rate / 3600
+            r['duration'] = r['duration'] | {'billed_lifetime_in_seconds': f"{r['endpoint_lifetime_seconds']:.2f}",
+                                             'cost': f"{r['cost']:.2f}"}
+        experiment_durations.append(r['duration'])
+
+    # cost of every endpoint for this run
+    ctx.df_cost = pd.DataFrame(experiment_durations)
+    write_csv(ctx.df_cost, bucket, metrics_dir, SUMMARY_MODEL_ENDPOINT_COST_PER_INSTANCE)
+    logger.info(f"run_inference, total cost of all experiments: ${sum(r['cost'] for r in experiment_results)}")
+
+    if concurrency_search_results:
+        ctx.df_concurrency_search = pd.DataFrame(concurrency_search_results)
+        write_csv(ctx.df_concurrency_search, bucket, metrics_dir, CONCURRENCY_SEARCH_RESULTS_FNAME)
+        logger.info(f"run_inference, concurrency search results:\n{ctx.df_concurrency_search}")
+    logger.info(f"run_inference, token count cache stats={token_count_cache_stats()}")
+
+    # only the records of the attempt that completed each chunk are kept, see the run journal, there are
+    # no results if no experiment could be run (e.g. every deployment failed in the pipelined mode)
+    per_inference_part_keys = [k for r in experiment_results for k in r['per_inference_part_keys']]
+    per_chunk_part_keys = [k for r in experiment_results for k in r['per_chunk_part_keys']]
+    df_responses = journal.completed_records(read_part_files(bucket, per_inference_part_keys))
+    if df_responses.empty:
+        df_responses = pd.DataFrame(columns=['experiment_name'])
+    df_metrics = journal.completed_records(read_part_files(bucket, per_chunk_part_keys))
+    if df_metrics.empty:
+        df_metrics = pd.DataFrame(columns=['experiment_name'])
+
+    df_endpoints = endpoints_frame(endpoint_info_list)
+    ctx.df_responses = pd.merge(left=df_responses, right=df_endpoints, how='left', on='experiment_name')
+    write_csv(ctx.df_responses, bucket, metrics_dir, config['report']['per_inference_request_file'].format(datetime=date_time))
+    ctx.df_metrics = pd.merge(left=df_metrics, right=df_endpoints, how='left', on='experiment_name')
+    write_csv(ctx.df_metrics, bucket, metrics_dir, config['report']['all_metrics_file'].format(datetime=date_time))
+
+    # the analysis step finds the metrics directory of the run in metrics_path.txt
+    ctx.metrics_dir = metrics_dir
+    metadata_dir = config['dir_paths']['metadata_dir']
+    os.makedirs(metadata_dir, exist_ok=True)
+    with open(os.path.join(metadata_dir, METRICS_PATH_FNAME), 'w') as file:
+        file.write(metrics_dir)
+    write_to_s3(metrics_dir, bucket, "", run_context.data_dir, METRICS_PATH_FNAME)
+    logger.info(f"run_inference, the results of this run are in --> {metrics_dir}")
+    return ctx.df_metrics
@@ -0,0 +1,48 @@
+"""
+Setup step: resolves the SageMaker execution role and downloads the custom deployment and inference
+scripts from S3 into the fmbench.scripts package directory.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+import importlib.resources as pkg_resources
+from botocore.exceptions import ClientError
+from fmbench.aws_clients import get_client
+from fmbench.endpoints import sagemaker_execution_role
+from fmbench.steps.context import PipelineContext
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_execution_role(ctx: PipelineContext) -> Optional[str]:
+    """Sets config['aws']['sagemaker_execution_role'] to the execution role of the notebook instance if there is one."""
+    role_arn = sagemaker_execution_role(ctx.config)
+    if role_arn is not None:
+        ctx.config['aws']['sagemaker_execution_role'] = role_arn
+    logger.info(f"resolve_execution_role, aws_region={ctx.config['aws']['region']}, sagemaker_execution_role={role_arn}")
+    return role_arn
+
+
+def setup(ctx: PipelineContext) -> None:
+    resolve_execution_role(ctx)
+    logger.info(f"setup, config={json.dumps(ctx.config, indent=2)}")
+
+    # Assuming fmbench is a valid Python package and scripts is a subdirectory within it
+    scripts_dir = Path(pkg_resources.files('fmbench'), 'scripts')
+    logger.info(f"setup, using fmbench.scripts directory: {scripts_dir}")
+    scripts_dir.mkdir(parents=True, exist_ok=True)
+
+    s3_read_data = ctx.config['s3_read_data']
+    script_files = s3_read_data.get('script_files', [])
+    logger.info(f"setup, read_bucket={s3_read_data['read_bucket']}, scripts_prefix={s3_read_data['scripts_prefix']}, "
+                f"script_files={script_files}")
+    s3_client = get_client('s3', ctx.config['aws']['region'])
+    try:
+        for script_name in script_files:
+            s3_script_path = f"{s3_read_data['scripts_prefix']}/{script_name}"
+            local_script_path = scripts_dir / script_name
+            logger.info(f"setup, downloading {s3_script_path} to {local_script_path}")
+            s3_client.download_file(s3_read_data['read_bucket'], s3_script_path, str(local_script_path))
+    except ClientError as error:
+        logger.error(f"setup, failed to download script files: {error}")
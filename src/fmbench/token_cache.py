@@ -0,0 +1,127 @@
+"""
+Content addressed cache for token counts.
+
+Token counts are keyed by a hash of the text and a fingerprint of the tokenizer that
+counted them, so the same cache can hold counts from different tokenizers without mixing
+them up. Counts are kept in a bounded in-memory LRU and can optionally be persisted to a
+local SQLite database that is shared across runs and across the notebook processes.
+"""
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES: int = 100000
+CACHE_DB_FNAME: str = "token_counts.db"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def tokenizer_fingerprint(local_dir: Optional[str], fallback: str) -> str:
+    """
+    Fingerprint of the tokenizer files in local_dir, the fallback is used when there
+    are no tokenizer files (i.e. when tokens are estimated from the number of words).
+    """
+    files = sorted(Path(local_dir).iterdir()) if local_dir is not None and Path(local_dir).is_dir() else []
+    files = [f for f in files if f.is_file()]
+    if not files:
+        return fallback
+    h = hashlib.sha256()
+    for f in files:
+        h.update(f.name.encode('utf-8'))
+        h.update(f.read_bytes())
+    return h.hexdigest()
+
+
+class TokenCountCache:
+    """Bounded LRU of token counts with an optional on-disk store shared across processes."""
+
+    def __init__(self,
+                 fingerprint: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 local_dir: Optional[str] = None):
+        self.fingerprint: str = fingerprint
+        self.max_entries: int = max_entries
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = dict(hits=0, disk_hits=0, misses=0)
+        self._db_path: Optional[str] = None
+        self._local = threading.local()
+        if local_dir is not None:
+            os.makedirs(local_dir, exist_ok=True)
+            self._db_path = os.path.join(local_dir, CACHE_DB_FNAME)
+            with self._connection() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS token_counts ("
+                             "fingerprint TEXT NOT NULL, text_hash TEXT NOT NULL, token_count INTEGER NOT NULL, "
+                             "PRIMARY KEY (fingerprint, text_hash))")
+            logger.info(f"TokenCountCache, persisting token counts to {self._db_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared across threads, keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _lru_put(self, key: str, count: int) -> None:
+        self._lru[key] = count
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[int]]:
+        """Returns the cached count for each text or None if the text is not in the cache."""
+        keys = [text_hash(text) for text in texts]
+        counts: List[Optional[int]] = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._lru.get(key)
+                if count is not None:
+                    self._lru.move_to_end(key)
+                    counts[i] = count
+            self._stats['hits'] += sum([c is not None for c in counts])
+        missing = [i for i, c in enumerate(counts) if c is None]
+        if missing and self._db_path is not None:
+            conn = self._connection()
+            for i in missing:
+                row = conn.execute("SELECT token_count FROM token_counts WHERE fingerprint = ? AND text_hash = ?",
+                                   (self.fingerprint, keys[i])).fetchone()
+                if row is not None:
+                    counts[i] = row[0]
+            with self._lock:
+                for i in missing:
+                    if counts[i] is not None:
+                        self._stats['disk_hits'] += 1
+                        self._lru_put(keys[i], counts[i])
+        with self._lock:
+            self._stats['misses'] += sum([c is None for c in counts])
+        return counts
+
+    def put_many(self, texts: List[str], counts: List[int]) -> None:
+        keys = [text_hash(text) for text in texts]
+        with self._lock:
+            for key, count in zip(keys, counts):
+                self._lru_put(key, count)
+        if self._db_path is not None:
+            with self._connection() as conn:
+                conn.executemany("INSERT OR IGNORE INTO token_counts (fingerprint, text_hash, token_count) VALUES (?, ?, ?)",
+                                 [(self.fingerprint, key, count) for key, count in zip(keys, counts)])
+
+    def stats(self) -> Dict:
+        """Hit rate statistics, disk hits are lookups that missed the in-memory LRU but were found on disk."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._lru)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        return stats
@@ -1,17 +1,24 @@
+import io
 import re
 import os
+import json
 import yaml
 import math
 import boto3
 import logging
+import itertools
 import requests
 import posixpath
 import unicodedata
+import pandas as pd
 from pathlib import Path
 from fmbench import globals
-from typing import Dict, List
-from transformers import AutoTokenizer
+from fmbench.run_context import get_run_context
+from fmbench.aws_clients import get_client
 from botocore.exceptions import NoCredentialsError
+from fmbench.token_cache import TokenCountCache, tokenizer_fingerprint, DEFAULT_MAX_ENTRIES
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -23,7 +30,7 @@ def _normalize(text, form='NFC'):
 
 def _download_from_s3(bucket_name, prefix, local_dir):
     """Downloads files from an S3 bucket and a specified prefix to a local directory."""
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     # Ensure the local directory exists
     if not os.path.exists(local_dir):
@@ -45,58 +52,131 @@ def _download_from_s3(bucket_name, prefix, local_dir):
     except Exception as e:
         logger.error(f"An error occurred while downloading from S3: {e}")
 
+# batched tokenization: number of texts encoded in one call to the fast tokenizer and the number
+# of texts above which the work is spread across a pool of processes
+TOKENIZATION_BATCH_SIZE: int = 256
+TOKENIZATION_PARALLEL_THRESHOLD: int = 4096
+
+# tokenizer loaded in each worker process of the tokenization process pool
+_worker_tokenizer = None
+
+def _init_tokenizer_worker(local_dir: str) -> None:
+    global _worker_tokenizer
+    # the work is already spread across processes, do not oversubscribe the cores with tokenizer threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from transformers import AutoTokenizer
+    _worker_tokenizer = AutoTokenizer.from_pretrained(local_dir)
+
+def _count_tokens_in_worker(texts: List[str]) -> List[int]:
+    return [len(ids) for ids in _worker_tokenizer(texts)['input_ids']]
+
 class CustomTokenizer:    
     """A custom tokenizer class"""
     TOKENS: int = 1000
     WORDS: int = 750
 
-    def __init__(self, bucket, prefix, local_dir):
+    def __init__(self, bucket, prefix, local_dir, cache_config: Optional[Dict] = None):
         print(f"CustomTokenizer, based on HF transformers")
-        # Check if the tokenizer files exist in s3 and if not, use the autotokenizer       
-        _download_from_s3(bucket, prefix, local_dir)
+        self.local_dir = local_dir
+        # Check if the tokenizer files exist in s3 and if not, use the autotokenizer,
+        # without a bucket the tokenizer files already in local_dir are used
+        if bucket is not None:
+            _download_from_s3(bucket, prefix, local_dir)
         # Load the tokenizer from the local directory
         dir_not_empty = any(Path(local_dir).iterdir())
         if dir_not_empty is True:
             logger.info("loading the provided tokenizer")
+            # transformers is slow to import, only import it when a tokenizer is actually loaded
+            from transformers import AutoTokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(local_dir)
         else:
             logger.error(f"no tokenizer provided, the {local_dir} is empty, "
                          f"using default tokenizer i.e. {self.WORDS} words = {self.TOKENS} tokens")
             self.tokenizer = None
+        # token counts are memoized, optionally on disk so that they are shared across runs and notebooks
+        cache_config = cache_config if cache_config is not None else {}
+        fingerprint = tokenizer_fingerprint(local_dir if dir_not_empty else None,
+                                            fallback=f"words-{self.WORDS}-tokens-{self.TOKENS}")
+        self.cache = TokenCountCache(fingerprint,
+                                     max_entries=cache_config.get('max_entries', DEFAULT_MAX_ENTRIES),
+                                     local_dir=cache_config.get('local_dir'))
 
-    def count_tokens(self, text):
+    def _count_tokens(self, text):
         if self.tokenizer is not None:
             return len(self.tokenizer.encode(text))
         else:
             return int(math.ceil((self.TOKENS/self.WORDS) * len(text.split())))
-    
-_tokenizer = CustomTokenizer(globals.READ_BUCKET_NAME, globals.TOKENIZER_DIR_S3, globals.TOKENIZER)
+
+    def _count_tokens_batch(self,
+                            texts: List[str],
+                            batch_size: int,
+                            num_workers: Optional[int]) -> List[int]:
+        if self.tokenizer is None:
+            return [self._count_tokens(text) for text in texts]
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        num_workers = num_workers if num_workers is not None else os.cpu_count()
+        if len(texts) < TOKENIZATION_PARALLEL_THRESHOLD or num_workers <= 1:
+            counts_per_batch = [[len(ids) for ids in self.tokenizer(batch)['input_ids']] for batch in batches]
+        else:
+            logger.info(f"count_tokens_batch, counting tokens for {len(texts)} texts with {num_workers} processes")
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     initializer=_init_tokenizer_worker,
+                                     initargs=(self.local_dir,)) as executor:
+                counts_per_batch = list(executor.map(_count_tokens_in_worker, batches))
+        return [c for counts in counts_per_batch for c in counts]
+
+    def count_tokens(self, text):
+        count = self.cache.get_many([text])[0]
+        if count is None:
+            count = self._count_tokens(text)
+            self.cache.put_many([text], [count])
+        return count
+
+    def count_tokens_batch(self,
+                           texts: List[str],
+                           batch_size: int = TOKENIZATION_BATCH_SIZE,
+                           num_workers: Optional[int] = None) -> List[int]:
+        """
+        Counts the tokens in each of the texts, same counts as count_tokens but the texts are encoded
+        in batches by the fast tokenizer and large lists are spread across a pool of processes.
+        Only the texts that are not in the token count cache are encoded.
+        """
+        counts = self.cache.get_many(texts)
+        missing = [i for i, c in enumerate(counts) if c is None]
+        if missing:
+            # the same text may appear more than once, encode it only once
+            texts_to_count = list(dict.fromkeys([texts[i] for i in missing]))
+            new_counts = dict(zip(texts_to_count, self._count_tokens_batch(texts_to_count, batch_size, num_workers)))
+            self.cache.put_many(texts_to_count, [new_counts[t] for t in texts_to_count])
+            for i in missing:
+                counts[i] = new_counts[texts[i]]
+        return counts
+
+    def cache_stats(self) -> Dict:
+        return self.cache.stats()
+
+def get_tokenizer() -> CustomTokenizer:
+    """The tokenizer of the current run context, it is created the first time tokens are counted."""
+    return get_run_context().tokenizer
 
 # utility functions
 def load_config(config_file) -> Dict:
     """
     Load configuration from a local file or an S3 URI.
 
-    :param config_file: Path to the local file or S3 URI (s3://bucket/key)
+    :param config_file: Path to the local file or S3 URI (s3://bucket/key), None for the config of the current run context
     :return: Dictionary with the loaded configuration
     """
-    session = boto3.session.Session()
-    caller = boto3.client('sts').get_caller_identity()
-    account_id = caller.get('Account')
-    arn_string = caller.get('Arn')
-
-    # check if the file is still parameterized and if so replace the parameters with actual values
-    # if the file is not parameterized then the following statements change nothing
-    args = dict(region=session.region_name,
-                role_arn=arn_string,
-                write_bucket=f"sagemaker-fmbench-write-{account_id}",
-                read_bucket=f"sagemaker-fmbench-read-{account_id}")
+    if config_file is None:
+        return get_run_context().config
+    # the parameters of a parameterized config file come from the account identity of the run context
+    args = get_run_context().config_params
 
     # Check if config_file is an S3 URI
     if config_file.startswith("s3://"):
         try:
             # Parse S3 URI
-            s3_client = boto3.client('s3')
+            s3_client = get_client('s3')
             bucket, key = config_file.replace("s3://", "").split("/", 1)
 
             # Get object from S3 and load YAML
@@ -131,15 +211,14 @@ def load_config(config_file) -> Dict:
     return config
 
 def count_tokens(text: str) -> int:
-    global _tokenizer
-    return _tokenizer.count_tokens(text)
+    return get_tokenizer().count_tokens(text)
 
 def process_item(item, prompt_template_keys: List, prompt_fmt: str) -> Dict:
     args = {}
     for k in prompt_template_keys:
         v = _normalize(item[k])
         args[k] = v
-        args[f"{k}_len"] = _tokenizer.count_tokens(v)
+        args[f"{k}_len"] = count_tokens(v)
     prompt = prompt_fmt.format(**args)
     prompt_len = count_tokens(prompt)
     return args | {
@@ -147,6 +226,28 @@ def process_item(item, prompt_template_keys: List, prompt_fmt: str) -> Dict:
         "prompt_len": prompt_len
     }
 
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    return get_tokenizer().count_tokens_batch(texts)
+
+def token_count_cache_stats() -> Dict:
+    return get_tokenizer().cache_stats()
+
+def process_items(items: pd.DataFrame, prompt_template_keys: List, prompt_fmt: str) -> List[Dict]:
+    """Batched version of process_item, returns the same dict for each row of the dataframe."""
+    args_list: List[Dict] = [{} for _ in range(len(items))]
+    for k in prompt_template_keys:
+        values = [_normalize(v) for v in items[k]]
+        counts = count_tokens_batch(values)
+        for args, v, c in zip(args_list, values, counts):
+            args[k] = v
+            args[f"{k}_len"] = c
+    prompts = [prompt_fmt.format(**args) for args in args_list]
+    prompt_lens = count_tokens_batch(prompts)
+    return [args | {
+        "prompt": prompt,
+        "prompt_len": prompt_len
+    } for args, prompt, prompt_len in zip(args_list, prompts, prompt_lens)]
+
 def nt_to_posix(p: str) -> str:
     return p.replace("\\", "/")
 
@@ -154,7 +255,7 @@ def nt_to_posix(p: str) -> str:
 def write_to_s3(data, bucket_name, dir1, dir2, file_name):
 
     # Initialize S3 client
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     # Construct the S3 file path
     s3_file_path = posixpath.join(nt_to_posix(dir1), nt_to_posix(dir2), file_name)
@@ -173,7 +274,7 @@ def write_to_s3(data, bucket_name, dir1, dir2, file_name):
 def read_from_s3(bucket_name, s3_file_path):
 
     # Initialize S3 client
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     s3_file_path = nt_to_posix(s3_file_path)
 
     try:
@@ -196,7 +297,7 @@ def get_s3_object(bucket: str, key: str) -> str:
     logger.debug(f"get_s3_object, bucket_name={bucket}, key={key}")
 
     # Create an S3 client
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     # Retrieve the object from S3
     response = s3_client.get_object(Bucket=bucket, Key=key)
@@ -209,7 +310,7 @@ def get_s3_object(bucket: str, key: str) -> str:
 # Function to list files in S3 bucket with a specific prefix
 def list_s3_files(bucket, prefix, suffix='.json'):
     filter_key_by_suffix = lambda k,s: True if s is None else k.endswith(s)
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
     next_continuation_token = None
     
     return_list = []
@@ -227,10 +328,185 @@ def list_s3_files(bucket, prefix, suffix='.json'):
     logger.info(f"there are total of {len(return_list)} items in bucket={bucket}, prefix={prefix}, suffix={suffix}")
     return return_list
 
+# number of objects downloaded in parallel by the bulk S3 readers
+S3_BULK_READ_MAX_WORKERS: int = 32
+# downloads queued or done but not yet consumed, per worker, so memory stays bounded when the consumer is slow
+S3_BULK_READ_PENDING_PER_WORKER: int = 2
+# records converted into a dataframe at a time by read_s3_records_to_df
+S3_BULK_READ_DF_BATCH_RECORDS: int = 10000
+
+def parse_json_records(content: bytes) -> List[Dict]:
+    """Parses a JSON file (one record) or a JSON lines file (one record per line) into a list of records."""
+    text = content.decode('utf-8').strip()
+    if not text:
+        return []
+    try:
+        record = json.loads(text)
+        return record if isinstance(record, list) else [record]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def iter_s3_objects(bucket: str,
+                    keys: List[str],
+                    parse_fn: Callable[[bytes], Any] = parse_json_records,
+                    max_workers: int = S3_BULK_READ_MAX_WORKERS,
+                    failures: Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Downloads the given keys concurrently using a bounded pool of workers that share one S3 client
+    and yields (key, parse_fn(content)) as soon as each object is downloaded and parsed. At most
+    S3_BULK_READ_PENDING_PER_WORKER downloads per worker are outstanding, the next keys are submitted
+    as the results are consumed. Keys that could not be read are logged and recorded in `failures`
+    (key -> error) if provided.
+    """
+    # boto3 clients are thread safe, size the connection pool to the number of workers
+    s3_client = get_client('s3', max_pool_connections=max_workers)
+
+    def _get(key: str) -> Any:
+        response = s3_client.get_object(Bucket=bucket, Key=nt_to_posix(key))
+        return parse_fn(response['Body'].read())
+
+    num_keys: int = len(keys)
+    max_pending: int = max_workers * S3_BULK_READ_PENDING_PER_WORKER
+    log_every: int = max(1, num_keys // 10)
+    num_done: int = 0
+    num_failed: int = 0
+    logger.info(f"iter_s3_objects, going to read {num_keys} objects from bucket={bucket} with max_workers={max_workers}")
+    key_iter = iter(keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: Dict = {}
+
+        def _submit() -> None:
+            for key in itertools.islice(key_iter, max_pending - len(pending)):
+                pending[executor.submit(_get, key)] = key
+
+        try:
+            _submit()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    num_done += 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        num_failed += 1
+                        logger.error(f"iter_s3_objects, failed to read bucket={bucket}, key={key}, exception={e}")
+                        if failures is not None:
+                            failures[key] = str(e)
+                    else:
+                        yield key, result
+                    if num_done % log_every == 0 or num_done == num_keys:
+                        logger.info(f"iter_s3_objects, read {num_done}/{num_keys} objects, {num_failed} failed")
+                _submit()
+        finally:
+            # the consumer stopped early, do not download the keys that were submitted but not started
+            for future in pending:
+                future.cancel()
+
+def read_s3_records_to_df(bucket: str,
+                          keys: List[str],
+                          parse_fn: Callable[[bytes], List[Dict]] = parse_json_records,
+                          max_workers: int = S3_BULK_READ_MAX_WORKERS,
+                          batch_records: int = S3_BULK_READ_DF_BATCH_RECORDS) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Reads the records in the given keys concurrently into a dataframe, the records are kept
+    in the order of the keys. The records are converted into dataframes batch_records at a time
+    as the objects are read and the batches are concatenated at the end. Returns the dataframe
+    and the keys that could not be read along with the error for each.
+    """
+    key_index_col: str = "_s3_key_index"
+    key_index: Dict[str, int] = {key: i for i, key in enumerate(keys)}
+    failures: Dict[str, str] = {}
+    frames: List[pd.DataFrame] = []
+    batch: List[Dict] = []
+    batch_key_index: List[int] = []
+
+    def _flush_batch() -> None:
+        df_batch = pd.DataFrame(batch)
+        df_batch[key_index_col] = batch_key_index
+        frames.append(df_batch)
+        batch.clear()
+        batch_key_index.clear()
+
+    for key, key_records in iter_s3_objects(bucket, keys, parse_fn, max_workers, failures):
+        batch.extend(key_records)
+        batch_key_index.extend([key_index[key]] * len(key_records))
+        if len(batch) >= batch_records:
+            _flush_batch()
+    if batch:
+        _flush_batch()
+    if failures:
+        logger.error(f"read_s3_records_to_df, {len(failures)} out of {len(keys)} objects could not be read")
+    if not frames:
+        return pd.DataFrame(), failures
+    # keep the records in the same order as the keys irrespective of the order in which they were read
+    df = pd.concat(frames, ignore_index=True).sort_values(key_index_col, kind='stable')
+    return df.drop(columns=[key_index_col]).reset_index(drop=True), failures
+
+def iter_s3_lines(bucket: str, key: str) -> Iterator[str]:
+    """Yields the lines of an S3 object as they are downloaded, without reading the whole object into memory."""
+    response = get_client('s3').get_object(Bucket=bucket, Key=nt_to_posix(key))
+    for line in response['Body'].iter_lines():
+        if line.strip():
+            yield line.decode('utf-8')
+
+# S3 multipart uploads need parts of at least 5 MiB (except the last one)
+S3_STREAM_PART_SIZE: int = 8 * 1024 * 1024
+
+class S3StreamWriter:
+    """
+    Writes an S3 object as the data is produced: data is buffered up to part_size and uploaded
+    as a part of a multipart upload, so memory stays bounded irrespective of the object size.
+    Objects smaller than one part are written with a single put_object on close.
+    """
+
+    def __init__(self, bucket: str, key: str, part_size: int = S3_STREAM_PART_SIZE):
+        self.bucket: str = bucket
+        self.key: str = nt_to_posix(key)
+        self.part_size: int = part_size
+        self.bytes_written: int = 0
+        self._s3_client = get_client('s3')
+        self._buffer = io.BytesIO()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict] = []
+
+    def write(self, data) -> None:
+        data = data.encode('utf-8') if isinstance(data, str) else data
+        self._buffer.write(data)
+        self.bytes_written += len(data)
+        if self._buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self._parts) + 1
+        response = self._s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               PartNumber=part_number, Body=self._buffer.getvalue())
+        self._parts.append(dict(PartNumber=part_number, ETag=response['ETag']))
+        self._buffer = io.BytesIO()
+
+    def close(self) -> str:
+        """Uploads what is still buffered and completes the object, returns its s3 uri."""
+        if self._upload_id is None:
+            self._s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=self._buffer.getvalue())
+        else:
+            if self._buffer.tell() > 0:
+                self._upload_part()
+            self._s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                      MultipartUpload=dict(Parts=self._parts))
+        logger.info(f"S3StreamWriter, wrote {self.bytes_written} bytes to s3://{self.bucket}/{self.key} in {max(1, len(self._parts))} part(s)")
+        return f"s3://{self.bucket}/{self.key}"
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            self._s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+
 def download_multiple_files_from_s3(bucket_name, prefix, local_dir):
     """Downloads files from an S3 bucket and a specified prefix to a local directory."""
     logger.info(f"download_multiple_files_from_s3, bucket_name={bucket_name}, prefix={prefix}, local_dir={local_dir}")
-    s3_client = boto3.client('s3')
+    s3_client = get_client('s3')
 
     # Ensure the local directory exists
     if not os.path.exists(local_dir):
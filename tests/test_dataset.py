@@ -0,0 +1,103 @@
+import random
+import pytest
+from fmbench.dataset import FilterIndex, StratifiedReservoir
+
+
+def _filter(lo: int, hi: int, language: str = "en") -> dict:
+    return dict(language=language, min_length_in_tokens=lo, max_length_in_tokens=hi)
+
+
+FILTERS = [_filter(1, 500), _filter(500, 1000), _filter(1001, 2000), _filter(1, 2000, language="fr")]
+
+
+@pytest.mark.parametrize("prompt_len, expected", [(0, []), (1, [0, 3]), (2, [0, 3]),
+                                                  # both ends of a range are inclusive, 500 is in two filters
+                                                  (499, [0, 3]), (500, [0, 1, 3]), (501, [1, 3]),
+                                                  (1000, [1, 3]), (1001, [2, 3]), (2000, [2, 3]), (2001, [])])
+def test_lookup_includes_both_ends_of_a_range(prompt_len, expected):
+    assert FilterIndex(FILTERS).lookup(prompt_len) == expected
+
+
+def test_lookup_checks_the_language():
+    index = FilterIndex(FILTERS)
+    assert index.lookup(500, "en") == [0, 1]
+    assert index.lookup(500, "fr") == [3]
+    assert index.lookup(500, "de") == []
+
+
+def test_lookup_single_length_filter():
+    index = FilterIndex([_filter(10, 10), _filter(5, 20)])
+    assert index.lookup(9) == [1]
+    assert index.lookup(10) == [0, 1]
+    assert index.lookup(11) == [1]
+
+
+def test_lookup_matches_a_linear_scan():
+    rng = random.Random(0)
+    filters = []
+    for _ in range(30):
+        lo = rng.randint(1, 3000)
+        filters.append(_filter(lo, lo + rng.randint(0, 1000)))
+    index = FilterIndex(filters)
+    for prompt_len in range(0, 4100):
+        assert index.lookup(prompt_len) == [i for i, f in enumerate(filters)
+                                            if f['min_length_in_tokens'] <= prompt_len <= f['max_length_in_tokens']]
+
+
+def _prompts(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [(f"source.jsonl:{i}", rng.randint(1, 100)) for i in range(n)]
+
+
+def _sample(prompts: list, max_prompts: int, seed: int = 0) -> StratifiedReservoir:
+    reservoir = StratifiedReservoir(1, 100, max_prompts, seed=seed)
+    for prompt_id, prompt_len in prompts:
+        reservoir.add(prompt_id, prompt_len, prompt_id)
+    return reservoir
+
+
+def test_sample_does_not_depend_on_the_input_order():
+    prompts = _prompts(1000)
+    shuffled = list(prompts)
+    random.Random(1).shuffle(shuffled)
+    sample = _sample(prompts, 50).sample()
+    assert len(sample) == 50
+    assert sorted(sample) == sorted(_sample(shuffled, 50).sample())
+    # the sample keeps the order in which the prompts were read
+    sampled_ids = {item for _, item in sample}
+    assert [item for _, item in sample] == [prompt_id for prompt_id, _ in prompts if prompt_id in sampled_ids]
+
+
+def test_sample_depends_on_the_seed():
+    prompts = _prompts(1000)
+    assert sorted(_sample(prompts, 50, seed=0).sample()) != sorted(_sample(prompts, 50, seed=1).sample())
+
+
+def test_every_prompt_is_kept_below_max_prompts():
+    prompts = _prompts(30)
+    sample = _sample(prompts, 50).sample()
+    assert [item for _, item in sample] == [prompt_id for prompt_id, _ in prompts]
+
+
+def test_allocation_is_proportional_to_the_strata_sizes():
+    # strata of 10 tokens each
+    prompts = [(f"a:{i}", 5) for i in range(50)] + [(f"b:{i}", 15) for i in range(30)] + [(f"c:{i}", 25) for i in range(20)]
+    reservoir = _sample(prompts, 4)
+    assert reservoir.counts[:3] == [50, 30, 20]
+    # quotas of 2.0, 1.2 and 0.8: the largest remainder gets the last prompt
+    assert reservoir.allocation()[:3] == [2, 1, 1]
+    sample = reservoir.sample()
+    assert sorted(reservoir.stratum(prompt_len) for prompt_len, _ in sample) == [0, 0, 1, 2]
+    stats = reservoir.stats(sample)
+    assert stats['matched_prompts'] == 100
+    assert stats['sampled_prompts'] == 4
+    assert [s['sampled'] for s in stats['strata'][:3]] == [2, 1, 1]
+
+
+def test_strata_cover_the_filter_range():
+    reservoir = StratifiedReservoir(1, 100, 10, strata=10)
+    assert reservoir.stratum_bounds(0) == (1, 10)
+    assert reservoir.stratum_bounds(9) == (91, 100)
+    assert [reservoir.stratum(n) for n in (1, 10, 11, 100)] == [0, 0, 1, 9]
+    # never more strata than prompt lengths in the range
+    assert StratifiedReservoir(1, 3, 10, strata=10).strata == 3
@@ -0,0 +1,177 @@
+import random
+import boto3
+import asyncio
+import pytest
+from datetime import datetime
+from botocore.stub import Stubber
+from botocore.exceptions import ClientError
+from fmbench.deployment_scheduler import Backoff, call_with_backoff, deploy_with_retries, wait_for_endpoint
+
+ENDPOINT_NAME = "test-endpoint"
+
+
+def _describe_endpoint_response(status: str) -> dict:
+    return dict(EndpointName=ENDPOINT_NAME,
+                EndpointArn=f"arn:aws:sagemaker:us-east-1:123456789012:endpoint/{ENDPOINT_NAME}",
+                EndpointConfigName=ENDPOINT_NAME,
+                EndpointStatus=status,
+                CreationTime=datetime(2024, 1, 1),
+                LastModifiedTime=datetime(2024, 1, 1))
+
+
+def _throttling_error(operation_name: str = "CreateEndpoint") -> ClientError:
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation_name)
+
+
+class FakeClock:
+    """Clock that only moves forward when the code under test sleeps."""
+
+    def __init__(self):
+        self.now: float = 0
+        self.sleeps = []
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def sm_client():
+    client = boto3.client('sagemaker', region_name='us-east-1',
+                          aws_access_key_id='testing', aws_secret_access_key='testing')
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+def test_backoff_without_jitter_grows_to_the_cap():
+    delays = Backoff(dict(initial_delay_seconds=5, max_delay_seconds=30, multiplier=2, jitter=0)).delays()
+    assert [next(delays) for _ in range(6)] == [5, 10, 20, 30, 30, 30]
+
+
+def test_backoff_jitter_stays_within_bounds():
+    spec = dict(initial_delay_seconds=1, max_delay_seconds=8, multiplier=2, jitter=0.5)
+    delays = Backoff(spec, random.Random(0)).delays()
+    for bound in [1, 2, 4, 8, 8, 8]:
+        assert bound * 0.5 <= next(delays) <= bound
+
+
+def test_backoff_is_repeatable_with_a_seeded_rng():
+    first = Backoff(rng=random.Random(42)).delays()
+    second = Backoff(rng=random.Random(42)).delays()
+    assert [next(first) for _ in range(5)] == [next(second) for _ in range(5)]
+
+
+def test_call_with_backoff_retries_throttling_errors():
+    calls = []
+
+    def create_endpoint(**kwargs):
+        calls.append(kwargs)
+        if len(calls) < 3:
+            raise _throttling_error()
+        return "created"
+
+    clock = FakeClock()
+    assert call_with_backoff(create_endpoint, EndpointName=ENDPOINT_NAME, sleep=clock.sleep) == "created"
+    assert len(calls) == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_call_with_backoff_raises_other_errors_right_away():
+    calls = []
+
+    def create_endpoint():
+        calls.append(1)
+        raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'bad'}}, "CreateEndpoint")
+
+    clock = FakeClock()
+    with pytest.raises(ClientError):
+        call_with_backoff(create_endpoint, sleep=clock.sleep)
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_call_with_backoff_gives_up_after_max_retries():
+    def create_endpoint():
+        raise _throttling_error()
+
+    clock = FakeClock()
+    with pytest.raises(ClientError):
+        call_with_backoff(create_endpoint, max_retries=2, sleep=clock.sleep)
+    assert len(clock.sleeps) == 2
+
+
+def test_wait_for_endpoint_retries_throttled_polls(sm_client):
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'),
+                                   dict(EndpointName=ENDPOINT_NAME))
+    sm_client.stubber.add_client_error('describe_endpoint', service_error_code='ThrottlingException',
+                                       http_status_code=400)
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'))
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('InService'))
+    clock = FakeClock()
+    spec = dict(initial_delay_seconds=5, max_delay_seconds=30, multiplier=2, jitter=0)
+    result = wait_for_endpoint(sm_client, ENDPOINT_NAME, spec, sleep=clock.sleep, clock=clock)
+    assert result == dict(endpoint_name=ENDPOINT_NAME, status='InService', ready_seconds=35,
+                          polls=4, throttled=1)
+    assert clock.sleeps == [5, 10, 20]
+
+
+def test_wait_for_endpoint_returns_the_failed_status(sm_client):
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'))
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Failed'))
+    clock = FakeClock()
+    result = wait_for_endpoint(sm_client, ENDPOINT_NAME, sleep=clock.sleep, clock=clock, rng=random.Random(0))
+    assert result['status'] == 'Failed'
+    assert result['polls'] == 2
+
+
+def test_wait_for_endpoint_stops_polling_at_the_timeout(sm_client):
+    for _ in range(4):
+        sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'))
+    clock = FakeClock()
+    spec = dict(initial_delay_seconds=10, max_delay_seconds=10, jitter=0, timeout_seconds=30)
+    result = wait_for_endpoint(sm_client, ENDPOINT_NAME, spec, sleep=clock.sleep, clock=clock)
+    assert result['status'] == 'Creating'
+    assert result['polls'] == 4
+    assert result['ready_seconds'] == 30
+
+
+def test_wait_for_endpoint_raises_errors_other_than_throttling(sm_client):
+    sm_client.stubber.add_client_error('describe_endpoint', service_error_code='ValidationException',
+                                       http_status_code=400)
+    clock = FakeClock()
+    with pytest.raises(ClientError):
+        wait_for_endpoint(sm_client, ENDPOINT_NAME, sleep=clock.sleep, clock=clock)
+
+
+def test_deploy_with_retries_retries_throttled_deployments():
+    calls = []
+    sleeps = []
+
+    def deploy(experiment):
+        calls.append(experiment['name'])
+        if len(calls) < 3:
+            raise _throttling_error()
+        return dict(endpoint_name=ENDPOINT_NAME)
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    result = asyncio.run(deploy_with_retries(dict(name="test-experiment"), deploy, max_throttling_retries=3, sleep=sleep))
+    assert result == dict(endpoint_name=ENDPOINT_NAME)
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_deploy_with_retries_returns_none_for_failed_deployments():
+    def deploy(experiment):
+        raise _throttling_error()
+
+    async def sleep(seconds):
+        pass
+
+    assert asyncio.run(deploy_with_retries(dict(name="test-experiment"), deploy, max_throttling_retries=1, sleep=sleep)) is None
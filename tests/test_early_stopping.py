@@ -0,0 +1,85 @@
+import random
+import pytest
+from fmbench.early_stopping import EarlyStopping, STOP_REASON
+
+
+def _responses(latencies: list) -> list:
+    return [dict(completion="text", latency=latency) for latency in latencies]
+
+
+def _run(early_stopping: EarlyStopping, latencies: list, chunk_size: int = 10):
+    """Feeds the latencies chunk by chunk, returns the stop reason and the number of requests sent."""
+    for i in range(0, len(latencies), chunk_size):
+        reason = early_stopping.update(_responses(latencies[i:i + chunk_size]))
+        if reason is not None:
+            return reason, early_stopping.sample_count
+    return None, early_stopping.sample_count
+
+
+def test_stops_once_the_mean_has_converged():
+    rng = random.Random(0)
+    latencies = [rng.gauss(1.0, 0.05) for _ in range(1000)]
+    reason, sample_count = _run(EarlyStopping(dict(min_requests=20, max_requests=1000)), latencies)
+    assert reason == STOP_REASON.CONVERGED
+    # the interval of such a tight distribution is narrow as soon as the minimum is reached
+    assert sample_count == 20
+
+
+def test_does_not_stop_before_min_requests():
+    latencies = [1.0] * 100
+    reason, sample_count = _run(EarlyStopping(dict(min_requests=50, max_requests=1000)), latencies)
+    assert reason == STOP_REASON.CONVERGED
+    assert sample_count == 50
+
+
+def test_noisy_latencies_run_until_max_requests():
+    rng = random.Random(1)
+    latencies = [rng.choice([0.1, 10.0]) for _ in range(1000)]
+    early_stopping = EarlyStopping(dict(min_requests=20, max_requests=200, relative_ci_width=0.05))
+    reason, sample_count = _run(early_stopping, latencies)
+    assert reason == STOP_REASON.MAX_REQUESTS
+    assert sample_count == 200
+    assert early_stopping.relative_ci_width() > 0.05
+
+
+def test_no_stop_when_the_payloads_run_out_first():
+    rng = random.Random(2)
+    latencies = [rng.choice([0.1, 10.0]) for _ in range(100)]
+    reason, sample_count = _run(EarlyStopping(dict(min_requests=20, max_requests=1000)), latencies)
+    assert reason is None
+    assert sample_count == 100
+
+
+def test_percentile_interval_needs_enough_samples():
+    early_stopping = EarlyStopping(dict(statistic=99, min_requests=10, max_requests=10000))
+    # p99 cannot be bracketed by the order statistics of a few dozen samples
+    assert early_stopping.update(_responses([1.0] * 50)) is None
+    assert early_stopping.relative_ci_width() is None
+
+
+def test_stops_once_a_percentile_has_converged():
+    rng = random.Random(3)
+    latencies = [rng.uniform(1.0, 1.1) for _ in range(2000)]
+    early_stopping = EarlyStopping(dict(statistic="p90", min_requests=20, max_requests=2000, relative_ci_width=0.02))
+    assert early_stopping.percentile == 90
+    reason, sample_count = _run(early_stopping, latencies, chunk_size=20)
+    assert reason == STOP_REASON.CONVERGED
+    assert sample_count < 2000
+    assert early_stopping.relative_ci_width() <= 0.02
+
+
+def test_failed_requests_count_as_samples_without_latency():
+    early_stopping = EarlyStopping(dict(min_requests=5, max_requests=1000))
+    failed = [dict(completion=None, latency=None)] * 10
+    assert early_stopping.update(failed) is None
+    assert early_stopping.sample_count == 10
+    assert early_stopping.relative_ci_width() is None
+
+
+@pytest.mark.parametrize("confidence, expected", [(0.95, STOP_REASON.CONVERGED), (0.9999, None)])
+def test_higher_confidence_needs_more_samples(confidence, expected):
+    # mean 1.0, standard deviation about 0.2: after 100 samples the 95% interval is within 10% of the mean,
+    # the 99.99% interval is not
+    latencies = [0.8, 1.2] * 50
+    early_stopping = EarlyStopping(dict(min_requests=100, max_requests=1000, confidence=confidence))
+    assert early_stopping.update(_responses(latencies)) == expected
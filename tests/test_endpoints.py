@@ -0,0 +1,58 @@
+import boto3
+import pytest
+import functools
+from datetime import datetime
+from botocore.stub import Stubber
+import fmbench.endpoints as endpoints
+from fmbench.deployment_scheduler import wait_for_endpoint
+
+ENDPOINT_NAME = "test-endpoint"
+
+
+def _describe_endpoint_response(status: str) -> dict:
+    return dict(EndpointName=ENDPOINT_NAME,
+                EndpointArn=f"arn:aws:sagemaker:us-east-1:123456789012:endpoint/{ENDPOINT_NAME}",
+                EndpointConfigName=ENDPOINT_NAME,
+                EndpointStatus=status,
+                CreationTime=datetime(2024, 1, 1),
+                LastModifiedTime=datetime(2024, 1, 1))
+
+
+def _endpoint_info() -> dict:
+    return dict(experiment_name="test-experiment",
+                endpoint=dict(EndpointName=ENDPOINT_NAME),
+                model_config=dict(PrimaryContainer=dict(Image="test-image")))
+
+
+@pytest.fixture
+def sm_client(monkeypatch):
+    client = boto3.client('sagemaker', region_name='us-east-1',
+                          aws_access_key_id='testing', aws_secret_access_key='testing')
+    monkeypatch.setattr(endpoints, "get_client", lambda service_name: client)
+    # the readiness polling does not sleep in the tests
+    monkeypatch.setattr(endpoints, "wait_for_endpoint", functools.partial(wait_for_endpoint, sleep=lambda seconds: None))
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize("status", ["InService", "Failed"])
+def test_delete_endpoint_deletes_deletable_endpoints(sm_client, status):
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response(status))
+    sm_client.stubber.add_response('delete_endpoint', {}, dict(EndpointName=ENDPOINT_NAME))
+    endpoints.delete_endpoint(_endpoint_info())
+
+
+def test_delete_endpoint_waits_for_an_endpoint_that_is_being_created(sm_client):
+    # e.g. the readiness polling of the deployment timed out while the endpoint was being created
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'))
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Creating'))
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('InService'))
+    sm_client.stubber.add_response('delete_endpoint', {}, dict(EndpointName=ENDPOINT_NAME))
+    endpoints.delete_endpoint(_endpoint_info())
+
+
+def test_delete_endpoint_leaves_endpoints_that_are_being_deleted(sm_client):
+    sm_client.stubber.add_response('describe_endpoint', _describe_endpoint_response('Deleting'))
+    endpoints.delete_endpoint(_endpoint_info())
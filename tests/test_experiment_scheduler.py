@@ -0,0 +1,47 @@
+import asyncio
+from fmbench.experiment_scheduler import run_pipelined_experiments
+
+
+def _deploy(experiment: dict) -> dict:
+    if experiment['name'] == "not-deployed":
+        return None
+    return dict(experiment_name=experiment['name'], endpoint=dict(EndpointName=experiment['name']))
+
+
+async def _run_experiment(e_idx: int, experiment: dict) -> dict:
+    if experiment['name'] == "failed":
+        raise RuntimeError("benchmark failed")
+    return dict(duration=dict(experiment_name=experiment['name']), cost=0)
+
+
+def _run(names: list, delete) -> list:
+    experiments = [dict(name=name) for name in names]
+    return asyncio.run(run_pipelined_experiments(experiments, _deploy, _run_experiment, delete, max_live=2, max_parallel=2))
+
+
+def test_every_deployed_endpoint_is_deleted():
+    deleted = []
+    results = _run(["a", "b", "c"], lambda endpoint: deleted.append(endpoint['experiment_name']))
+    assert sorted(deleted) == ["a", "b", "c"]
+    assert [r['endpoint_deleted'] for r in results] == [True, True, True]
+    assert [r['duration']['experiment_name'] for r in results] == ["a", "b", "c"]
+    assert all(r['endpoint_lifetime_seconds'] >= 0 for r in results)
+
+
+def test_endpoints_that_could_not_be_deleted_are_reported():
+    def delete(endpoint: dict) -> None:
+        if endpoint['experiment_name'] == "b":
+            raise RuntimeError("endpoint could not be deleted")
+
+    results = _run(["a", "b"], delete)
+    assert [r['endpoint_deleted'] for r in results] == [True, False]
+
+
+def test_failed_experiments_keep_their_endpoint_lifetime():
+    deleted = []
+    results = _run(["failed", "not-deployed"], lambda endpoint: deleted.append(endpoint['experiment_name']))
+    assert deleted == ["failed"]
+    assert 'duration' not in results[0]
+    assert results[0]['endpoint']['experiment_name'] == "failed"
+    assert results[0]['endpoint_lifetime_seconds'] >= 0
+    assert results[1] is None
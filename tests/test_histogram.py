@@ -0,0 +1,88 @@
+import math
+import random
+import pytest
+import pandas as pd
+from fmbench.histogram import (LatencyHistogram, merge_histograms, latency_percentiles, percentile_col,
+                               DEFAULT_RELATIVE_ACCURACY, LATENCY_HISTOGRAM_COL)
+
+
+def _exact_percentile(values: list, percentile: float) -> float:
+    """Nearest rank percentile, as computed by the histogram."""
+    values = sorted(values)
+    return values[max(1, math.ceil(percentile / 100 * len(values))) - 1]
+
+
+def _latencies(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    # a long tailed latency distribution spanning a few orders of magnitude
+    return [rng.lognormvariate(0, 1.5) for _ in range(n)]
+
+
+@pytest.mark.parametrize("relative_accuracy", [DEFAULT_RELATIVE_ACCURACY, 0.05])
+@pytest.mark.parametrize("percentile", [1, 50, 90, 99, 99.9, 100])
+def test_percentile_is_within_the_relative_accuracy(relative_accuracy, percentile):
+    values = _latencies(5000)
+    hist = LatencyHistogram(relative_accuracy).update(values)
+    exact = _exact_percentile(values, percentile)
+    assert abs(hist.percentile(percentile) - exact) <= relative_accuracy * exact
+
+
+def test_merged_histograms_equal_the_histogram_of_all_values():
+    values = _latencies(3000, seed=1)
+    chunks = [values[i:i + 100] for i in range(0, len(values), 100)]
+    merged = merge_histograms([LatencyHistogram().update(chunk).to_json() for chunk in chunks])
+    whole = LatencyHistogram().update(values)
+    assert merged.counts == whole.counts
+    assert merged.count == len(values)
+    for p in [50, 90, 99]:
+        assert merged.percentile(p) == whole.percentile(p)
+
+
+def test_failed_requests_are_not_counted():
+    hist = LatencyHistogram().update([None, float('nan'), 0.5])
+    assert hist.count == 1
+
+
+def test_tiny_latencies_are_counted_in_the_lowest_bucket():
+    hist = LatencyHistogram().update([0, 1e-9])
+    assert hist.count == 2
+    assert len(hist.counts) == 1
+
+
+def test_empty_histogram_has_no_percentile():
+    assert LatencyHistogram().percentile(50) is None
+    assert merge_histograms([None, float('nan')]) is None
+
+
+def test_json_round_trip():
+    hist = LatencyHistogram(0.02).update(_latencies(100))
+    restored = LatencyHistogram.from_json(hist.to_json())
+    assert restored.relative_accuracy == 0.02
+    assert restored.counts == hist.counts
+
+
+def test_histograms_with_different_accuracies_do_not_merge():
+    with pytest.raises(ValueError):
+        LatencyHistogram(0.01).merge(LatencyHistogram(0.02))
+
+
+def test_percentile_col():
+    assert percentile_col(90) == "latency_p90"
+    assert percentile_col(99.9) == "latency_p99_9"
+
+
+def test_latency_percentiles_per_group():
+    values_a, values_b = _latencies(1000, seed=2), [v * 10 for v in _latencies(1000, seed=3)]
+    rows = []
+    for name, values in [("a", values_a), ("b", values_b)]:
+        for i in range(0, len(values), 250):
+            rows.append({"experiment_name": name, LATENCY_HISTOGRAM_COL: LatencyHistogram().update(values[i:i + 250]).to_json()})
+    # chunks recorded before histograms were recorded have none
+    rows.append({"experiment_name": "a", LATENCY_HISTOGRAM_COL: None})
+    df = latency_percentiles(pd.DataFrame(rows), ["experiment_name"], percentiles=[50, 99])
+    assert df.columns.tolist() == ["experiment_name", "latency_p50", "latency_p99"]
+    for name, values in [("a", values_a), ("b", values_b)]:
+        row = df[df.experiment_name == name].iloc[0]
+        for p in [50, 99]:
+            exact = _exact_percentile(values, p)
+            assert abs(row[percentile_col(p)] - exact) <= DEFAULT_RELATIVE_ACCURACY * exact
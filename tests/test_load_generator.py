@@ -0,0 +1,128 @@
+import time
+import asyncio
+import logging
+import pytest
+from fmbench.load_generator import generate_load, max_in_flight, LOAD_MODE
+
+
+class FakeEndpoint:
+    """Async infer function that records the requests in flight and the time every request was sent."""
+
+    def __init__(self, latency: float = 0.01, failing_payloads: set = frozenset()):
+        self.latency = latency
+        self.failing_payloads = failing_payloads
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.sent_at = []
+
+    async def infer(self, payload: dict) -> dict:
+        self.sent_at.append(time.perf_counter())
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if payload['id'] in self.failing_payloads:
+                raise RuntimeError(f"request {payload['id']} failed")
+            return dict(id=payload['id'], latency=self.latency)
+        finally:
+            self.in_flight -= 1
+
+
+def _chunks(num_payloads: int, concurrency: int) -> list:
+    payloads = [dict(id=i) for i in range(num_payloads)]
+    return [payloads[i:i + concurrency] for i in range(0, num_payloads, concurrency)]
+
+
+def _collect(endpoint: FakeEndpoint, num_payloads: int, concurrency, load_spec=None) -> list:
+    async def _run():
+        results = []
+        async for chunk, responses, elapsed in generate_load(endpoint.infer, _chunks(num_payloads, max(1, int(concurrency))),
+                                                             concurrency, load_spec):
+            assert len(chunk) == len(responses)
+            assert elapsed >= 0
+            results.append((chunk, responses))
+        return results
+    # a load generator that waits for a completion that never comes fails the test instead of hanging it
+    return asyncio.run(asyncio.wait_for(_run(), timeout=10))
+
+
+def _ids(results: list) -> list:
+    return sorted(r['id'] for _, responses in results for r in responses if 'id' in r)
+
+
+def test_chunked_sends_one_chunk_at_a_time():
+    endpoint = FakeEndpoint()
+    results = _collect(endpoint, 10, 4)
+    assert [len(chunk) for chunk, _ in results] == [4, 4, 2]
+    assert endpoint.peak_in_flight == 4
+    assert _ids(results) == list(range(10))
+
+
+def test_sliding_window_keeps_the_window_full():
+    endpoint = FakeEndpoint()
+    results = _collect(endpoint, 20, 4, dict(mode=LOAD_MODE.SLIDING_WINDOW))
+    assert [len(chunk) for chunk, _ in results] == [4] * 5
+    assert endpoint.peak_in_flight == 4
+    assert _ids(results) == list(range(20))
+    # every payload of a chunk is the one that got the response at the same position
+    for chunk, responses in results:
+        assert [p['id'] for p in chunk] == [r['id'] for r in responses]
+
+
+def test_open_loop_sends_at_the_arrival_rate():
+    # 50 requests per second with constant arrivals, one every 20 ms
+    endpoint = FakeEndpoint(latency=0.001)
+    results = _collect(endpoint, 11, 50, dict(mode=LOAD_MODE.OPEN_LOOP, arrival_process='constant'))
+    assert _ids(results) == list(range(11))
+    interarrivals = [t2 - t1 for t1, t2 in zip(endpoint.sent_at, endpoint.sent_at[1:])]
+    assert sum(interarrivals) == pytest.approx(0.2, abs=0.05)
+    assert min(interarrivals) > 0.01
+
+
+def test_open_loop_does_not_wait_for_completions():
+    # requests take much longer than the interarrival time, so they pile up in flight
+    endpoint = FakeEndpoint(latency=0.3)
+    _collect(endpoint, 10, 100, dict(mode=LOAD_MODE.OPEN_LOOP, arrival_process='constant'))
+    assert endpoint.peak_in_flight == 10
+
+
+def test_open_loop_poisson_arrivals_are_repeatable_with_a_seed():
+    load_spec = dict(mode=LOAD_MODE.OPEN_LOOP, seed=7)
+    schedules = []
+    for _ in range(2):
+        endpoint = FakeEndpoint(latency=0.001)
+        _collect(endpoint, 8, 100, load_spec)
+        schedules.append([t - endpoint.sent_at[0] for t in endpoint.sent_at])
+    assert schedules[0] == pytest.approx(schedules[1], abs=0.01)
+
+
+def test_open_loop_warns_when_the_client_falls_behind(caplog):
+    class BlockingEndpoint(FakeEndpoint):
+        async def infer(self, payload: dict) -> dict:
+            # blocks the event loop so that the following requests are sent late
+            time.sleep(0.15)
+            return await super().infer(payload)
+
+    with caplog.at_level(logging.WARNING, logger="fmbench.load_generator"):
+        _collect(BlockingEndpoint(latency=0.001), 3, 100, dict(mode=LOAD_MODE.OPEN_LOOP, arrival_process='constant'))
+    assert any("behind schedule" in record.message for record in caplog.records)
+
+
+def test_max_in_flight():
+    assert max_in_flight(None, 8) == 8
+    assert max_in_flight(dict(mode=LOAD_MODE.SLIDING_WINDOW), 8) == 8
+    # open-loop: the arrival rate times the default maximum latency, unless configured
+    assert max_in_flight(dict(mode=LOAD_MODE.OPEN_LOOP), 2.5) == 25
+    assert max_in_flight(dict(mode=LOAD_MODE.OPEN_LOOP, max_in_flight=200), 50) == 200
+
+
+@pytest.mark.parametrize("load_spec", [None,
+                                       dict(mode=LOAD_MODE.SLIDING_WINDOW),
+                                       dict(mode=LOAD_MODE.OPEN_LOOP, arrival_process='constant')])
+def test_failed_requests_complete_with_a_failed_response(load_spec):
+    endpoint = FakeEndpoint(latency=0.001, failing_payloads={1, 5})
+    results = _collect(endpoint, 8, 4, load_spec)
+    responses = [r for _, chunk_responses in results for r in chunk_responses]
+    assert len(responses) == 8
+    assert _ids(results) == [0, 2, 3, 4, 6, 7]
+    assert sorted(r['error'] for r in responses if 'error' in r) == ["request 1 failed", "request 5 failed"]
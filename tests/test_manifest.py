@@ -0,0 +1,86 @@
+import json
+import boto3
+import pytest
+from moto import mock_aws
+import fmbench.aws_clients as aws_clients
+from fmbench.manifest import Manifest, content_hash, MANIFEST_FNAME, MANIFEST_VERSION
+
+BUCKET = "bench-bucket"
+PREFIX = "data"
+INPUTS = dict(source_files=content_hash({"a.jsonl": "etag-1"}),
+              prompt_template=content_hash("{context} {question}"),
+              tokenizer="tokenizer-1")
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        aws_clients._clients.clear()
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    aws_clients._clients.clear()
+
+
+def _record(s3_client, artifact: str, inputs: dict) -> None:
+    """Writes the artifact to S3 and records it in the manifest."""
+    s3_client.put_object(Bucket=BUCKET, Key=f"{PREFIX}/{artifact}", Body=b"{}")
+    manifest = Manifest(BUCKET, PREFIX)
+    manifest.record(artifact, inputs, f"s3://{BUCKET}/{PREFIX}/{artifact}", dict(prompts=1))
+    manifest.save()
+
+
+def test_content_hash_is_canonical():
+    assert content_hash(dict(a=1, b=2)) == content_hash(dict(b=2, a=1))
+    assert content_hash("x") != content_hash(["x"])
+
+
+def test_unchanged_inputs(s3_client):
+    _record(s3_client, "payload.jsonl", INPUTS)
+    manifest = Manifest(BUCKET, PREFIX)
+    assert manifest.changed_inputs("payload.jsonl", dict(INPUTS)) == []
+    assert manifest.is_up_to_date("payload.jsonl", INPUTS)
+    assert manifest.get("payload.jsonl")['stats'] == dict(prompts=1)
+
+
+def test_changed_inputs_returns_the_keys_that_changed(s3_client):
+    _record(s3_client, "payload.jsonl", INPUTS)
+    manifest = Manifest(BUCKET, PREFIX)
+    inputs = INPUTS | dict(tokenizer="tokenizer-2", prompt_template=content_hash("{question}"))
+    assert manifest.changed_inputs("payload.jsonl", inputs) == ["prompt_template", "tokenizer"]
+    assert not manifest.is_up_to_date("payload.jsonl", inputs)
+
+
+def test_added_and_removed_inputs_are_changed(s3_client):
+    _record(s3_client, "payload.jsonl", INPUTS)
+    manifest = Manifest(BUCKET, PREFIX)
+    inputs = {k: v for k, v in INPUTS.items() if k != "tokenizer"} | dict(filter=content_hash(dict(language="en")))
+    assert manifest.changed_inputs("payload.jsonl", inputs) == ["filter", "tokenizer"]
+
+
+def test_missing_artifacts_have_to_be_created(s3_client):
+    _record(s3_client, "payload.jsonl", INPUTS)
+    manifest = Manifest(BUCKET, PREFIX)
+    assert manifest.changed_inputs("other.jsonl", INPUTS) is None
+    # recorded in the manifest but deleted from S3
+    s3_client.delete_object(Bucket=BUCKET, Key=f"{PREFIX}/payload.jsonl")
+    assert manifest.changed_inputs("payload.jsonl", INPUTS) is None
+    assert not manifest.is_up_to_date("payload.jsonl", INPUTS)
+
+
+def test_payload_file_without_prompts_is_up_to_date(s3_client):
+    manifest = Manifest(BUCKET, PREFIX)
+    manifest.record("empty.jsonl", INPUTS, None, dict(prompts=0))
+    manifest.save()
+    assert Manifest(BUCKET, PREFIX).changed_inputs("empty.jsonl", INPUTS) == []
+
+
+def test_manifest_of_another_version_is_ignored(s3_client):
+    _record(s3_client, "payload.jsonl", INPUTS)
+    manifest = json.loads(s3_client.get_object(Bucket=BUCKET, Key=f"{PREFIX}/{MANIFEST_FNAME}")['Body'].read())
+    s3_client.put_object(Bucket=BUCKET, Key=f"{PREFIX}/{MANIFEST_FNAME}",
+                         Body=json.dumps(manifest | dict(version=MANIFEST_VERSION + 1)))
+    assert Manifest(BUCKET, PREFIX).changed_inputs("payload.jsonl", INPUTS) is None
@@ -0,0 +1,73 @@
+import sys
+import json
+import types
+import pytest
+import subprocess
+from pathlib import Path
+import fmbench.pipeline as pipeline
+
+
+class FakeContext:
+    def __init__(self):
+        self.calls = []
+
+
+@pytest.fixture
+def steps(monkeypatch):
+    """Stands in for fmbench.steps, whose step modules import the dependencies of the whole benchmark."""
+    module = types.ModuleType("fmbench.steps")
+    module.contexts = []
+
+    def create_context():
+        module.contexts.append(FakeContext())
+        return module.contexts[-1]
+
+    def generate_data(ctx):
+        ctx.calls.append("generate_data")
+
+    async def deploy(ctx):
+        ctx.calls.append("deploy")
+
+    def analyze(ctx):
+        # the context is shared, the steps see what the earlier steps set
+        ctx.calls.append(("analyze", list(ctx.calls)))
+
+    module.generate_data, module.deploy, module.analyze = generate_data, deploy, analyze
+    module.PipelineContext = create_context
+    monkeypatch.setitem(sys.modules, "fmbench.steps", module)
+    return module
+
+
+def test_steps_run_in_order_with_one_context(steps, tmp_path):
+    stats = pipeline.run_in_process(["1_generate_data.ipynb", "2_deploy_model.ipynb", "4_model_metric_analysis.ipynb"],
+                                    tmp_path)
+    assert len(steps.contexts) == 1
+    assert steps.contexts[0].calls == ["generate_data", "deploy", ("analyze", ["generate_data", "deploy"])]
+    assert [s['stage'] for s in stats] == ["1_generate_data", "2_deploy_model", "4_model_metric_analysis"]
+    assert all(s['wall_time_seconds'] >= 0 and s['peak_rss_mb'] > 0 for s in stats)
+    written = list(tmp_path.glob("pipeline_stages_*.json"))
+    assert len(written) == 1
+    assert json.loads(written[0].read_text()) == stats
+
+
+def test_unknown_step_fails_before_anything_runs(steps):
+    with pytest.raises(ValueError):
+        pipeline.run_in_process(["1_generate_data.ipynb", "6_unknown.ipynb"])
+    assert steps.contexts == []
+
+
+def test_stats_are_written_when_a_step_fails(steps, tmp_path, monkeypatch):
+    def analyze(ctx):
+        raise RuntimeError("analysis failed")
+    monkeypatch.setattr(steps, "analyze", analyze)
+    with pytest.raises(RuntimeError):
+        pipeline.run_in_process(["1_generate_data.ipynb", "4_model_metric_analysis.ipynb"], tmp_path)
+    written = list(tmp_path.glob("pipeline_stages_*.json"))
+    assert [s['stage'] for s in json.loads(written[0].read_text())] == ["1_generate_data"]
+
+
+def test_importing_the_pipeline_does_not_import_the_steps():
+    code = "import sys, fmbench.pipeline; print('fmbench.steps' in sys.modules, 'IPython' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=Path(pipeline.__file__).parents[1])
+    assert result.stdout.split() == ["False", "False"]
@@ -0,0 +1,103 @@
+import boto3
+import pytest
+from moto import mock_aws
+import fmbench.aws_clients as aws_clients
+import fmbench.results_sink as results_sink
+from fmbench.results_sink import ResultsSink, read_part_files
+
+BUCKET = "bench-bucket"
+PREFIX = "metrics/per_inference/test-experiment"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        aws_clients._clients.clear()
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    aws_clients._clients.clear()
+
+
+class _FlakyS3Client:
+    """S3 client whose put_object fails the given number of times before it succeeds."""
+
+    def __init__(self, client, failures: int):
+        self._client = client
+        self.failures = failures
+        self.puts = 0
+
+    def put_object(self, **kwargs):
+        self.puts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+        return self._client.put_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _sink(**kwargs) -> ResultsSink:
+    # parts are only written by flush and close in the tests
+    return ResultsSink(BUCKET, PREFIX, max_seconds_per_part=3600, sleep=lambda seconds: None, **kwargs)
+
+
+def _records(start: int, n: int) -> list:
+    return [dict(request_index=i, latency=0.1 * i) for i in range(start, start + n)]
+
+
+def test_records_are_written_in_parts_and_read_back(s3_client):
+    sink = _sink(max_records_per_part=4)
+    for r in _records(0, 10):
+        sink.add(r)
+    part_keys = sink.close()
+    assert len(part_keys) == 3
+    df = read_part_files(BUCKET, prefix=PREFIX)
+    assert sorted(df.request_index.tolist()) == list(range(10))
+
+
+def test_failed_writes_are_retried(s3_client, monkeypatch):
+    flaky = _FlakyS3Client(s3_client, failures=2)
+    monkeypatch.setattr(results_sink, "get_client", lambda service_name: flaky)
+    sink = _sink(write_retries=3)
+    for r in _records(0, 5):
+        sink.add(r)
+    sink.flush()
+    assert len(sink.part_keys) == 1
+    assert flaky.puts == 3
+    sink.close()
+    assert len(read_part_files(BUCKET, prefix=PREFIX)) == 5
+
+
+def test_records_that_could_not_be_written_are_kept_and_reported(s3_client, monkeypatch):
+    flaky = _FlakyS3Client(s3_client, failures=3)
+    monkeypatch.setattr(results_sink, "get_client", lambda service_name: flaky)
+    sink = _sink(write_retries=2)
+    for r in _records(0, 5):
+        sink.add(r)
+    with pytest.raises(RuntimeError, match="5 records could not be written"):
+        sink.flush()
+    assert sink.part_keys == []
+    # the records are written with the ones added since once S3 can be written again
+    for r in _records(5, 3):
+        sink.add(r)
+    sink.close()
+    df = read_part_files(BUCKET, prefix=PREFIX)
+    assert df.request_index.tolist() == list(range(8))
+
+
+def test_close_raises_if_records_could_not_be_written(s3_client, monkeypatch):
+    # the part file is never written, the manifest is
+    flaky = _FlakyS3Client(s3_client, failures=6)
+    monkeypatch.setattr(results_sink, "get_client", lambda service_name: flaky)
+    sink = _sink(write_retries=2)
+    for r in _records(0, 5):
+        sink.add(r)
+    with pytest.raises(RuntimeError, match="5 records could not be written"):
+        sink.close()
+    # the manifest of the part files that were written is still there
+    assert read_part_files(BUCKET, prefix=PREFIX).empty
@@ -0,0 +1,196 @@
+import asyncio
+import boto3
+import pytest
+import pandas as pd
+from moto import mock_aws
+from contextlib import aclosing
+import fmbench.inference as inference
+import fmbench.aws_clients as aws_clients
+from fmbench.globals import PAYLOAD_INDEX_KEY, PROMPT_TOKENS_PAYLOAD_KEY
+from fmbench.load_generator import LOAD_MODE
+from fmbench.concurrency_search import ConcurrencySearch
+from fmbench.run_journal import RunJournal, remaining_payloads
+
+BUCKET = "bench-bucket"
+METRICS_DIR = "metrics/run"
+RUN_ID = "run-1"
+EXPERIMENT = "experiment-1"
+PAYLOAD_FILE = "payload.jsonl"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        aws_clients._clients.clear()
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    aws_clients._clients.clear()
+
+
+@pytest.fixture(autouse=True)
+def word_counts(monkeypatch):
+    # the completions are counted with whitespace splitting instead of a tokenizer
+    monkeypatch.setattr(inference, "count_tokens_batch", lambda texts: [len(t.split()) for t in texts])
+
+
+class VariableLatencyPredictor:
+    """Async predictor whose latency depends on the payload so that requests complete out of order."""
+    supports_async: bool = True
+    endpoint_name: str = "variable-latency"
+
+    async def get_prediction_async(self, payload: dict) -> dict:
+        latency = 0.001 * (int(payload['inputs']) * 7 % 5)
+        await asyncio.sleep(latency)
+        return dict(response_json=dict(generated_text="a completion"), latency=latency)
+
+
+def _payloads(n: int) -> list:
+    return [{'inputs': str(i), 'parameters': {}, PROMPT_TOKENS_PAYLOAD_KEY: 1, PAYLOAD_INDEX_KEY: i} for i in range(n)]
+
+
+def _split(payloads: list, concurrency: int) -> list:
+    return [payloads[i:i + concurrency] for i in range(0, len(payloads), concurrency)]
+
+
+def _run(journal: RunJournal, split_payload: list, experiment: dict, concurrency: int, first_chunk_index: int = 0,
+         completed_latencies: list = None, max_chunks: int = None) -> list:
+    """Runs the combination and records its chunks in the journal, stops after max_chunks like an interrupted run."""
+    async def _collect():
+        results = []
+        chunk_index = first_chunk_index
+        async with aclosing(inference.run_inferences(VariableLatencyPredictor(), split_payload, experiment, concurrency,
+                                                     PAYLOAD_FILE, completed_latencies=completed_latencies)) as chunks:
+            async for responses, metrics in chunks:
+                chunk_index += 1
+                journal.record_chunk(EXPERIMENT, concurrency, PAYLOAD_FILE, chunk_index, responses)
+                results.append((responses, metrics))
+                if len(results) == max_chunks:
+                    break
+        journal.flush(EXPERIMENT, [])
+        return results
+    return asyncio.run(_collect())
+
+
+def _resume() -> RunJournal:
+    return RunJournal(BUCKET, METRICS_DIR, RUN_ID, resume=True)
+
+
+def test_remaining_payloads_of_the_chunked_mode_are_the_chunks_not_sent():
+    split_payload = _split(_payloads(10), 4)
+    assert remaining_payloads(split_payload, [0, 1, 2, 3], 4) == split_payload[1:]
+    assert remaining_payloads(split_payload, list(range(10)), 4) == []
+
+
+def test_remaining_payloads_skip_completions_in_any_order():
+    split_payload = _split(_payloads(10), 4)
+    remaining = remaining_payloads(split_payload, [5, 0, 9, 2], 4)
+    assert [[p[PAYLOAD_INDEX_KEY] for p in chunk] for chunk in remaining] == [[1, 3, 4, 6], [7, 8]]
+
+
+def test_remaining_payloads_with_repeated_payloads():
+    # the last chunk is filled with the first payload of the file
+    payloads = _payloads(3)
+    split_payload = [payloads[:2], [payloads[2], payloads[0]]]
+    remaining = remaining_payloads(split_payload, [0, 1], 2)
+    assert [[p[PAYLOAD_INDEX_KEY] for p in chunk] for chunk in remaining] == [[2, 0]]
+
+
+def test_journal_is_replayed_on_resume(s3_client):
+    journal = RunJournal(BUCKET, METRICS_DIR, RUN_ID)
+    responses = [dict(payload_index=3, completion="text", latency=0.5), dict(payload_index=1, completion=None, latency=None)]
+    journal.record_chunk(EXPERIMENT, 2, PAYLOAD_FILE, 1, responses)
+    journal.record_combination(EXPERIMENT, None, "other.jsonl", dict(max_sustainable_concurrency=8))
+    journal.flush(EXPERIMENT, [])
+    # another run sharing the metrics directory is not replayed
+    RunJournal(BUCKET, METRICS_DIR, "run-2").flush(EXPERIMENT, [])
+
+    resumed = _resume()
+    assert resumed.attempt != journal.attempt
+    assert resumed.completed_chunks(EXPERIMENT, 2, PAYLOAD_FILE) == 1
+    assert resumed.completed_payloads(EXPERIMENT, 2, PAYLOAD_FILE) == ([3, 1], [0.5, None])
+    assert resumed.combination_result(EXPERIMENT, None, "other.jsonl") == dict(max_sustainable_concurrency=8)
+    assert not resumed.is_combination_done(EXPERIMENT, 2, PAYLOAD_FILE)
+
+
+@pytest.mark.parametrize("load_spec", [None,
+                                       dict(mode=LOAD_MODE.SLIDING_WINDOW),
+                                       # 4 requests per second, a chunk is every 4 completions
+                                       dict(mode=LOAD_MODE.OPEN_LOOP, arrival_process='constant')])
+def test_resumed_combination_sends_every_payload_once(s3_client, load_spec):
+    concurrency = 4
+    experiment = dict(name=EXPERIMENT, load_generator=load_spec)
+    split_payload = _split(_payloads(12), 4)
+    interrupted = _run(RunJournal(BUCKET, METRICS_DIR, RUN_ID), split_payload, experiment, concurrency, max_chunks=2)
+
+    journal = _resume()
+    chunk_index = journal.completed_chunks(EXPERIMENT, concurrency, PAYLOAD_FILE)
+    completed_indices, _ = journal.completed_payloads(EXPERIMENT, concurrency, PAYLOAD_FILE)
+    assert chunk_index == 2
+    assert completed_indices == [r['payload_index'] for responses, _ in interrupted for r in responses]
+    resumed = _run(journal, remaining_payloads(split_payload, completed_indices, 4), experiment, concurrency, chunk_index)
+    sent = completed_indices + [r['payload_index'] for responses, _ in resumed for r in responses]
+    assert sorted(sent) == list(range(12))
+
+
+def test_early_stopping_continues_from_the_journal(s3_client):
+    experiment = dict(name=EXPERIMENT, early_stopping=dict(min_requests=8, max_requests=12))
+    split_payload = _split(_payloads(20), 4)
+    _run(RunJournal(BUCKET, METRICS_DIR, RUN_ID), split_payload, experiment, 4, max_chunks=2)
+
+    journal = _resume()
+    completed_indices, completed_latencies = journal.completed_payloads(EXPERIMENT, 4, PAYLOAD_FILE)
+    assert len(completed_latencies) == 8
+    resumed = _run(journal, remaining_payloads(split_payload, completed_indices, 4), experiment, 4, 2, completed_latencies)
+    # max_requests counts the requests sent before the run was interrupted
+    assert len(resumed) == 1
+    assert resumed[-1][1]['sample_count'] == 12
+    assert resumed[-1][1]['stop_reason'] == "max-requests"
+
+    # a combination that reached its stop decision before the interruption sends nothing more
+    _, completed_latencies = _resume().completed_payloads(EXPERIMENT, 4, PAYLOAD_FILE)
+    assert len(completed_latencies) == 12
+    assert _run(_resume(), split_payload[3:], experiment, 4, 3, completed_latencies) == []
+
+
+def _step(search: ConcurrencySearch, concurrency: int, latency: float) -> dict:
+    return search.record(concurrency, [dict(transactions=10, errors=[], successes=10, latency_mean=latency,
+                                            transactions_per_minute=600)])
+
+
+def test_concurrency_search_continues_from_the_journal(s3_client):
+    spec = dict(min_concurrency=1, max_concurrency=64)
+    search = ConcurrencySearch(spec, latency_budget=1.0)
+    journal = RunJournal(BUCKET, METRICS_DIR, RUN_ID)
+    # ramp 1, 2, 4, 8, 16 where 16 is over the budget, then interrupted before the bisection
+    for concurrency in [1, 2, 4, 8, 16]:
+        assert search.next_concurrency() == concurrency
+        step = _step(search, concurrency, 0.5 if concurrency < 16 else 2.0)
+        journal.record_combination(EXPERIMENT, concurrency, PAYLOAD_FILE, step)
+    journal.flush(EXPERIMENT, [])
+
+    journal = _resume()
+    resumed = ConcurrencySearch(spec, latency_budget=1.0)
+    while ((concurrency := resumed.next_concurrency()) is not None
+           and journal.is_combination_done(EXPERIMENT, concurrency, PAYLOAD_FILE)):
+        resumed.restore(journal.combination_result(EXPERIMENT, concurrency, PAYLOAD_FILE))
+    assert resumed.trace == search.trace
+    # the bisection between 8 and 16 continues where the interrupted search was
+    assert concurrency == search.next_concurrency() == 12
+    assert resumed.result() == search.result()
+
+
+def test_completed_records_keep_the_attempt_that_completed_the_chunk(s3_client):
+    journal = RunJournal(BUCKET, METRICS_DIR, RUN_ID)
+    journal.record_chunk(EXPERIMENT, 4, PAYLOAD_FILE, 1, [])
+    df = pd.DataFrame([dict(run_id=RUN_ID, attempt=journal.attempt, experiment_name=EXPERIMENT, concurrency=4,
+                            payload_file=PAYLOAD_FILE, chunk_index=1),
+                       # the chunk was run again by another attempt, and a chunk that never completed
+                       dict(run_id=RUN_ID, attempt="interrupted", experiment_name=EXPERIMENT, concurrency=4,
+                            payload_file=PAYLOAD_FILE, chunk_index=1),
+                       dict(run_id=RUN_ID, attempt=journal.attempt, experiment_name=EXPERIMENT, concurrency=4,
+                            payload_file=PAYLOAD_FILE, chunk_index=2)])
+    assert journal.completed_records(df).attempt.tolist() == [journal.attempt]
@@ -0,0 +1,149 @@
+import json
+import pytest
+import fmbench.scripts.sagemaker_streaming_predictor as streaming_predictor
+from fmbench.scripts.token_stream import TokenStreamParser
+
+TOKENS = ["Hello", ",", " world", "!", " How", " are", " you", "?"]
+# arrival time of every token, the request is sent at t=0
+TOKEN_TIMES = [0.5, 0.6, 0.7, 0.9, 1.0, 1.1, 1.4, 1.5]
+
+
+def _tgi_events(tokens) -> list:
+    """Server sent events as streamed by TGI, the last one carries the generated text."""
+    events = []
+    for i, token in enumerate(tokens):
+        event = dict(token=dict(id=i, text=token, special=False))
+        if i == len(tokens) - 1:
+            event["generated_text"] = "".join(tokens)
+        events.append(f"data:{json.dumps(event)}\n\n".encode("utf-8"))
+    return events
+
+
+def _jsonl_events(tokens) -> list:
+    """JSON lines as streamed by the DJL LMI and TensorRT-LLM containers."""
+    return [f"{json.dumps(dict(outputs=[token]))}\n".encode("utf-8") for token in tokens]
+
+
+def _split(data: bytes, size: int) -> list:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _feed_events(parser: TokenStreamParser, events: list) -> None:
+    for event, t in zip(events, TOKEN_TIMES):
+        parser.feed(event, t)
+    parser.close(TOKEN_TIMES[-1])
+
+
+def _assert_metrics(metrics: dict) -> None:
+    # inter-token latencies sorted: 0.1 x 5, 0.2, 0.3
+    assert metrics["time_to_first_token"] == pytest.approx(0.5)
+    assert metrics["inter_token_latency_mean"] == pytest.approx(1.0 / 7)
+    assert metrics["inter_token_latency_p50"] == pytest.approx(0.1)
+    assert metrics["inter_token_latency_p90"] == pytest.approx(0.3)
+    assert metrics["inter_token_latency_p99"] == pytest.approx(0.3)
+    assert metrics["decode_tokens_per_second"] == pytest.approx(7 / 1.0)
+
+
+@pytest.mark.parametrize("make_events", [_tgi_events, _jsonl_events])
+def test_one_token_per_chunk(make_events):
+    parser = TokenStreamParser()
+    _feed_events(parser, make_events(TOKENS))
+    assert parser.generated_text == "".join(TOKENS)
+    assert parser.token_times == TOKEN_TIMES
+    _assert_metrics(parser.metrics(start=0))
+
+
+@pytest.mark.parametrize("make_events", [_tgi_events, _jsonl_events])
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_events_split_across_chunks(make_events, size):
+    # the bytes of every event arrive in several chunks, the token is only complete once its newline arrives
+    parser = TokenStreamParser()
+    for i, (event, t) in enumerate(zip(make_events(TOKENS), TOKEN_TIMES)):
+        line_end = event.index(b"\n")
+        for chunk in _split(event[:line_end], size):
+            parser.feed(chunk, t - 0.01)
+        assert len(parser.token_times) == i
+        parser.feed(event[line_end:], t)
+    parser.close(TOKEN_TIMES[-1])
+    assert parser.generated_text == "".join(TOKENS)
+    assert parser.token_times == pytest.approx(TOKEN_TIMES)
+    _assert_metrics(parser.metrics(start=0))
+
+
+@pytest.mark.parametrize("make_events", [_tgi_events, _jsonl_events])
+def test_events_merged_into_one_chunk(make_events):
+    # several events arriving in the same chunk get the same arrival time
+    events = make_events(TOKENS)
+    parser = TokenStreamParser()
+    parser.feed(b"".join(events[:3]), 0.5)
+    parser.feed(b"".join(events[3:]), 1.0)
+    parser.close(1.0)
+    assert parser.generated_text == "".join(TOKENS)
+    assert parser.token_times == [0.5] * 3 + [1.0] * 5
+    metrics = parser.metrics(start=0)
+    assert metrics["time_to_first_token"] == pytest.approx(0.5)
+    assert metrics["inter_token_latency_p50"] == pytest.approx(0)
+    assert metrics["inter_token_latency_p90"] == pytest.approx(0.5)
+    assert metrics["decode_tokens_per_second"] == pytest.approx(7 / 0.5)
+
+
+def test_last_line_without_newline_is_parsed_on_close():
+    parser = TokenStreamParser()
+    parser.feed(b'{"outputs": ["a"]}\n{"outputs": ["b"]}', 0.1)
+    assert parser.token_times == [0.1]
+    parser.close(0.2)
+    assert parser.generated_text == "ab"
+    assert parser.token_times == [0.1, 0.2]
+
+
+def test_special_tokens_comments_and_done_marker_are_skipped():
+    parser = TokenStreamParser()
+    stream = (b": keep-alive\n"
+              b"event: message\n"
+              b'data:{"token": {"id": 1, "text": "Hi", "special": false}}\n\n'
+              b'data:{"token": {"id": 2, "text": "</s>", "special": true}}\n\n'
+              b"data: [DONE]\n\n")
+    parser.feed(stream, 0.2)
+    parser.close(0.2)
+    assert parser.generated_text == "Hi"
+    assert parser.token_times == [0.2]
+
+
+def test_no_tokens():
+    parser = TokenStreamParser()
+    parser.close(0.1)
+    metrics = parser.metrics(start=0)
+    assert all(value is None for value in metrics.values())
+
+
+class _FakeRuntimeClient:
+    """sagemaker-runtime client that streams the given payload parts."""
+
+    def __init__(self, parts: list):
+        self.parts = parts
+        self.requests = []
+
+    def invoke_endpoint_with_response_stream(self, **kwargs):
+        self.requests.append(kwargs)
+        return dict(Body=(dict(PayloadPart=dict(Bytes=part)) for part in self.parts))
+
+
+def test_streaming_predictor_records_the_stream_metrics(monkeypatch):
+    # every payload part is one chunk of bytes of the TGI events, split at arbitrary boundaries
+    parts = _split(b"".join(_tgi_events(TOKENS)), 50)
+    client = _FakeRuntimeClient(parts)
+    monkeypatch.setattr(streaming_predictor, "get_client", lambda service_name: client)
+    # one clock reading when the request is sent, one per payload part, one at close and one for the latency
+    clock = iter([0.0] + [0.1 * i for i in range(1, len(parts) + 1)] + [0.1 * len(parts)] * 2)
+    monkeypatch.setattr(streaming_predictor.time, "perf_counter", lambda: next(clock))
+
+    predictor = streaming_predictor.create_predictor("test-endpoint", None)
+    response = predictor.get_prediction(dict(inputs="Hello", parameters=dict(max_new_tokens=8)))
+
+    assert json.loads(client.requests[0]["Body"])["stream"] is True
+    assert response["response_json"] == dict(generated_text="".join(TOKENS))
+    assert response["latency"] == pytest.approx(0.1 * len(parts))
+    assert response["time_to_first_token"] is not None
+    assert response["time_to_first_token"] <= response["latency"]
+    assert response["inter_token_latency_p50"] <= response["inter_token_latency_p90"] <= response["inter_token_latency_p99"]
+    assert response["decode_tokens_per_second"] > 0
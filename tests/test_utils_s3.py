@@ -0,0 +1,140 @@
+import json
+import time
+import boto3
+import pytest
+from moto import mock_aws
+import fmbench.aws_clients as aws_clients
+from fmbench.utils import (iter_s3_objects, iter_s3_lines, read_s3_records_to_df,
+                           S3StreamWriter, parse_json_records, S3_BULK_READ_PENDING_PER_WORKER)
+
+BUCKET = "bench-bucket"
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        # the shared clients must be created inside the mock
+        aws_clients._clients.clear()
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    aws_clients._clients.clear()
+
+
+def _put_records(s3_client, num_keys: int) -> list:
+    """One JSON lines object per key with two records each."""
+    keys = []
+    for i in range(num_keys):
+        key = f"metrics/chunk-{i:03d}.jsonl"
+        body = "\n".join(json.dumps(dict(key_index=i, record_index=j)) for j in range(2))
+        s3_client.put_object(Bucket=BUCKET, Key=key, Body=body.encode("utf-8"))
+        keys.append(key)
+    return keys
+
+
+def test_parse_json_records():
+    assert parse_json_records(b'{"a": 1}') == [dict(a=1)]
+    assert parse_json_records(b'[{"a": 1}, {"a": 2}]') == [dict(a=1), dict(a=2)]
+    assert parse_json_records(b'{"a": 1}\n\n{"a": 2}\n') == [dict(a=1), dict(a=2)]
+    assert parse_json_records(b"  ") == []
+
+
+def test_iter_s3_objects_reads_every_key_with_a_pooled_client(s3_client):
+    keys = _put_records(s3_client, 20)
+    results = dict(iter_s3_objects(BUCKET, keys, max_workers=4))
+    assert set(results) == set(keys)
+    assert results[keys[3]] == [dict(key_index=3, record_index=0), dict(key_index=3, record_index=1)]
+    # the workers share one client whose connection pool is sized to the number of workers
+    pooled_clients = [client for (service_name, *_), client in aws_clients._clients.items() if service_name == "s3"]
+    assert len(pooled_clients) == 1
+    assert pooled_clients[0].meta.config.max_pool_connections == 4
+
+
+def test_iter_s3_objects_records_the_keys_that_could_not_be_read(s3_client):
+    keys = _put_records(s3_client, 5)
+    missing = ["metrics/missing-1.jsonl", "metrics/missing-2.jsonl"]
+    failures = {}
+    results = dict(iter_s3_objects(BUCKET, keys + missing, max_workers=3, failures=failures))
+    assert set(results) == set(keys)
+    assert set(failures) == set(missing)
+    assert all("NoSuchKey" in error for error in failures.values())
+
+
+def test_read_s3_records_to_df_keeps_the_order_of_the_keys(s3_client):
+    keys = _put_records(s3_client, 12)
+    missing = "metrics/missing.jsonl"
+    df, failures = read_s3_records_to_df(BUCKET, keys[:6] + [missing] + keys[6:], max_workers=8)
+    assert list(failures) == [missing]
+    assert len(df) == 24
+    assert df.key_index.tolist() == [i for i in range(12) for _ in range(2)]
+    assert df.record_index.tolist() == [0, 1] * 12
+
+
+def test_s3_stream_writer_writes_small_objects_with_one_put(s3_client):
+    writer = S3StreamWriter(BUCKET, "results/small.jsonl")
+    writer.write('{"a": 1}\n')
+    writer.write(b'{"a": 2}\n')
+    assert writer.close() == f"s3://{BUCKET}/results/small.jsonl"
+    assert writer._upload_id is None
+    assert list(iter_s3_lines(BUCKET, "results/small.jsonl")) == ['{"a": 1}', '{"a": 2}']
+
+
+def test_s3_stream_writer_multipart_upload_reads_back(s3_client):
+    # S3 needs parts of at least 5 MiB except for the last one
+    key = "results/large.jsonl"
+    writer = S3StreamWriter(BUCKET, key, part_size=5 * MiB)
+    padding = "x" * (256 * 1024)
+    lines = [json.dumps(dict(line_index=i, padding=padding)) for i in range(48)]
+    for line in lines:
+        writer.write(line + "\n")
+    writer.close()
+    # 48 lines of ~256 KiB are two full parts and a smaller last part
+    assert len(writer._parts) == 3
+    assert writer.bytes_written == sum(len(line) + 1 for line in lines)
+    assert s3_client.head_object(Bucket=BUCKET, Key=key)["ContentLength"] == writer.bytes_written
+    assert [json.loads(line)["line_index"] for line in iter_s3_lines(BUCKET, key)] == list(range(48))
+
+
+def test_s3_stream_writer_abort_discards_the_upload(s3_client):
+    writer = S3StreamWriter(BUCKET, "results/aborted.jsonl", part_size=5 * MiB)
+    writer.write(b"x" * (5 * MiB))
+    assert writer._upload_id is not None
+    writer.abort()
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+    assert s3_client.list_objects_v2(Bucket=BUCKET, Prefix="results/").get("KeyCount") == 0
+
+
+def test_read_s3_records_to_df_in_batches(s3_client):
+    keys = _put_records(s3_client, 9)
+    df, failures = read_s3_records_to_df(BUCKET, keys, max_workers=3, batch_records=4)
+    assert failures == {}
+    assert list(df.columns) == ["key_index", "record_index"]
+    assert df.key_index.tolist() == [i for i in range(9) for _ in range(2)]
+    assert df.index.tolist() == list(range(18))
+
+
+def test_read_s3_records_to_df_without_records(s3_client):
+    df, failures = read_s3_records_to_df(BUCKET, ["metrics/missing.jsonl"])
+    assert df.empty
+    assert list(failures) == ["metrics/missing.jsonl"]
+
+
+def test_iter_s3_objects_bounds_the_outstanding_downloads(s3_client):
+    keys = _put_records(s3_client, 50)
+    parsed = []
+
+    def parse_fn(content: bytes) -> list:
+        parsed.append(content)
+        return parse_json_records(content)
+
+    objects = iter_s3_objects(BUCKET, keys, parse_fn, max_workers=2)
+    next(objects)
+    # a slow consumer: the workers stop once the outstanding downloads are done
+    time.sleep(0.5)
+    assert len(parsed) <= 2 * S3_BULK_READ_PENDING_PER_WORKER + 1
+    assert len(list(objects)) == 49
+    assert len(parsed) == 50